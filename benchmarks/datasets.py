@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.offline import OfflineSpreadsheet, OfflineWorksheet
+
+# Spreadsheet keys used by the pages
+STUDENTS_KEY = "1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew"
+EMERGENCY_KEY = "1os1G3ri4xMmJdQSNsVSNx6VJttyM8JsPNbmH0DCFUiI"
+UNIVERSITIES_KEY = "1gCxnCOhQRHtVdVMSiLaReBRJbCUz1Wn6-KJRZshneuM"
+
+STUDENT_COLUMNS = [
+    "DATE", "First Name", "Last Name", "Age", "Gender", "Phone N°", "Address", "E-mail",
+    "Emergency contact N°", "Chosen School", "Specialite", "Duration", "Payment Amount",
+    "Payment Type", "Compte", "Sevis payment ?", "Application payment ?", "DS-160 maker",
+    "Password DS-160", "Secret Q.", "School Entry Date", "Entry Date in the US",
+    "ADDRESS in the U.S", "E-MAIL RDV", "PASSWORD RDV", "EMBASSY ITW. DATE", "Attempts",
+    "Visa Result", "Agent", "Note", "Stage", "BANK", "Student Name", "Prep ITW", "School Paid",
+]
+
+PROGRAM_COLUMNS = [
+    "University Name", "Picture", "Speciality", "Adjusted Speciality", "Field", "Major",
+    "Country", "City", "Level", "Institution Type", "Tuition Price", "Tuition Currency",
+    "Application Fee Price", "Application Fee Currency", "Duration",
+    "prime 2", "prime 3", "prime 4", "prime 5",
+]
+
+FIRST_NAMES = ["Amine", "Yasmine", "Karim", "Sara", "Walid", "Lina", "Rayan", "Imene", "Nassim", "Meriem"]
+LAST_NAMES = ["Benali", "Haddad", "Mansouri", "Zerrouki", "Belkacem", "Saadi", "Khelifi", "Boudiaf"]
+AGENTS = ["Nesrine", "Hamza", "Djazila", "Nada", ""]
+STAGES = ['PAYMENT & MAIL', 'APPLICATION', 'SCAN & SEND', 'ARAMEX & RDV', 'DS-160', 'ITW Prep.', 'CLIENTS']
+SCHOOLS = ["University", "Community College", "CCLS Miami", "CCLS NY NJ", "Connect English",
+           "CONVERSE SCHOOL", "ELI San Francisco", "GT Chicago", "OHLA Miami", "Not yet"]
+ATTEMPTS = ["1st Try", "2nd Try", "3rd Try"]
+VISA_RESULTS = ["", "", "Approved", "Denied"]
+SPECIALTIES = ["Computer Science", "Business", "Nursing", "Civil Engineering", "English", "Finance"]
+
+FIELDS = {
+    "Computer Science and Information Technology": ["Software Engineering", "Cybersecurity", "Data Science and Analytics"],
+    "Business and Management": ["Business Administration", "Marketing", "Finance and Accounting"],
+    "Engineering and Technology": ["Civil Engineering", "Mechanical Engineering", "Electrical Engineering"],
+    "Health and Medicine": ["Nursing", "Public Health", "Pharmacy"],
+    "English and ESL": ["English Language Studies", "ESL (English as a Second Language)"],
+}
+COUNTRIES = {"Canada": ["Toronto", "Vancouver", "Montreal"], "USA": ["Miami", "Chicago", "New York"],
+             "UK": ["London", "Manchester"], "France": ["Paris", "Lyon"]}
+CURRENCIES = {"Canada": "CAD", "USA": "USD", "UK": "GBP", "France": "EUR"}
+LEVELS = ["Bachelor", "Master", "Diploma", "Certificate", "Foundation"]
+INSTITUTION_TYPES = ["University", "College", "Language School"]
+PRIMES = ["Scholarship", "Co-op", "Fast admission", "PGWP eligible", None]
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def _dates(rng, base, offsets_days, missing_ratio=0.0):
+    values = []
+    missing = rng.random(len(offsets_days)) < missing_ratio
+    for offset, is_missing in zip(offsets_days, missing):
+        values.append("" if is_missing else (base + timedelta(days=int(offset))).strftime(DATE_FORMAT))
+    return values
+
+
+def student_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    today = datetime.now().replace(microsecond=0)
+    first = rng.choice(FIRST_NAMES, n)
+    last = rng.choice(LAST_NAMES, n)
+    registered = _dates(rng, today, -rng.integers(0, 720, n))
+    entry = _dates(rng, today, rng.integers(-60, 240, n), missing_ratio=0.3)
+    interview = _dates(rng, today, rng.integers(-30, 90, n), missing_ratio=0.4)
+    agent = rng.choice(AGENTS, n)
+    stage = rng.choice(STAGES, n)
+    school = rng.choice(SCHOOLS, n)
+    attempts = rng.choice(ATTEMPTS, n)
+    visa = rng.choice(VISA_RESULTS, n)
+    specialite = rng.choice(SPECIALTIES, n)
+    yes_no = np.array(["YES", "NO"])
+    rows = []
+    for i in range(n):
+        # Suffix the row number so names, phones and e-mails are unique
+        first_name = f"{first[i]}{i}"
+        record = {
+            "DATE": registered[i], "First Name": first_name, "Last Name": last[i],
+            "Age": str(18 + i % 15), "Gender": "Male" if i % 2 else "Female",
+            "Phone N°": f"+2135{i:08d}", "Address": f"{i} Rue Didouche Mourad, Alger",
+            "E-mail": f"{first_name.lower()}.{last[i].lower()}@example.com",
+            "Emergency contact N°": f"+2136{i:08d}", "Chosen School": school[i],
+            "Specialite": specialite[i], "Duration": "12 months", "Payment Amount": "159.000 DZD",
+            "Payment Type": "Cash", "Compte": "Mohamed", "Sevis payment ?": yes_no[i % 2],
+            "Application payment ?": yes_no[(i + 1) % 2], "DS-160 maker": "", "Password DS-160": "",
+            "Secret Q.": "", "School Entry Date": entry[i], "Entry Date in the US": "",
+            "ADDRESS in the U.S": "", "E-MAIL RDV": "", "PASSWORD RDV": "",
+            "EMBASSY ITW. DATE": interview[i], "Attempts": attempts[i], "Visa Result": visa[i],
+            "Agent": agent[i], "Note": "", "Stage": stage[i], "BANK": "",
+            "Student Name": f"{first_name} {last[i]}", "Prep ITW": "NO", "School Paid": yes_no[i % 2],
+        }
+        rows.append([record[column] for column in STUDENT_COLUMNS])
+    return rows
+
+
+def program_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    fields = list(FIELDS)
+    countries = list(COUNTRIES)
+    field_idx = rng.integers(0, len(fields), n)
+    country_idx = rng.integers(0, len(countries), n)
+    level = rng.choice(LEVELS, n)
+    institution = rng.choice(INSTITUTION_TYPES, n)
+    tuition = rng.integers(5_000, 60_000, n)
+    fee = rng.integers(0, 250, n)
+    university = rng.integers(0, max(1, n // 50), n)
+    prime_idx = rng.integers(0, len(PRIMES), (n, 4))
+    rows = []
+    for i in range(n):
+        field = fields[field_idx[i]]
+        majors = FIELDS[field]
+        major = majors[i % len(majors)]
+        country = countries[country_idx[i]]
+        cities = COUNTRIES[country]
+        primes = [PRIMES[k] or "" for k in prime_idx[i]]
+        rows.append([
+            f"University {university[i]}", f"https://logos.example.com/{university[i]}.png",
+            f"{major} ({level[i]})", major, field, major, country, cities[i % len(cities)], level[i],
+            institution[i], int(tuition[i]), CURRENCIES[country], int(fee[i]), CURRENCIES[country],
+            f"{1 + i % 4} years", *primes,
+        ])
+    return rows
+
+
+def build_spreadsheets(n_students=1000, n_programs=10000, seed=0):
+    students = student_rows(n_students, seed)
+    spreadsheets = {
+        STUDENTS_KEY: OfflineSpreadsheet(STUDENTS_KEY, [OfflineWorksheet('ALL', STUDENT_COLUMNS, students)]),
+        EMERGENCY_KEY: OfflineSpreadsheet(EMERGENCY_KEY, [OfflineWorksheet('ALL', STUDENT_COLUMNS, students)]),
+        UNIVERSITIES_KEY: OfflineSpreadsheet(UNIVERSITIES_KEY, [
+            OfflineWorksheet('cleaned_universities_data', PROGRAM_COLUMNS, program_rows(n_programs, seed))
+        ]),
+    }
+    return spreadsheets
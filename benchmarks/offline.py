@@ -0,0 +1,299 @@
+import contextlib
+import json
+import re
+import threading
+from collections import Counter
+from unittest import mock
+
+# In-memory stand-ins for the gspread client and the Drive v3 service.
+# Every call is counted and every payload is measured as the JSON size it
+# would have on the wire, so the benchmark can report backend traffic
+# per interaction without touching Google.
+
+
+class BackendStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def record(self, name, received=None, sent=None):
+        with self.lock:
+            self.calls[name] += 1
+            if received is not None:
+                self.bytes_in += payload_size(received)
+            if sent is not None:
+                self.bytes_out += payload_size(sent)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'total_calls': sum(self.calls.values()),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+            }
+
+
+STATS = BackendStats()
+
+
+def payload_size(obj):
+    return len(json.dumps(obj, default=str).encode('utf-8'))
+
+
+_A1_CELL = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+def _column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index
+
+
+def _parse_a1(range_name, n_rows, n_cols):
+    # Returns zero-based (row_start, row_end, col_start, col_end), end exclusive
+    if '!' in range_name:
+        range_name = range_name.split('!', 1)[1]
+    start, _, end = range_name.partition(':')
+    end = end or start
+    start_col, start_row = _A1_CELL.match(start.upper()).groups()
+    end_col, end_row = _A1_CELL.match(end.upper()).groups()
+    row_start = int(start_row) - 1 if start_row else 0
+    row_end = int(end_row) if end_row else n_rows
+    col_start = _column_index(start_col) - 1 if start_col else 0
+    col_end = _column_index(end_col) if end_col else n_cols
+    return row_start, row_end, col_start, col_end
+
+
+class OfflineWorksheet:
+    def __init__(self, title, header, rows, sheet_id=0):
+        self.title = title
+        self.id = sheet_id
+        self._values = [list(header)] + [list(row) for row in rows]
+
+    @property
+    def row_count(self):
+        return len(self._values)
+
+    @property
+    def col_count(self):
+        return len(self._values[0]) if self._values else 0
+
+    def _records(self):
+        header = self._values[0] if self._values else []
+        return [dict(zip(header, row)) for row in self._values[1:]]
+
+    def get_all_records(self, expected_headers=None, value_render_option=None, **kwargs):
+        records = self._records()
+        STATS.record('worksheet.get_all_records', received=self._values)
+        return records
+
+    def _formatted(self, rows):
+        # Like FORMATTED_VALUE reads, every cell comes back as text
+        return [[value if isinstance(value, str) else str(value) for value in row] for row in rows]
+
+    def get_all_values(self, **kwargs):
+        values = self._formatted(self._values)
+        STATS.record('worksheet.get_all_values', received=values)
+        return values
+
+    def row_values(self, row, **kwargs):
+        values = list(self._values[row - 1]) if row <= len(self._values) else []
+        STATS.record('worksheet.row_values', received=values)
+        return values
+
+    def _slice(self, range_name):
+        row_start, row_end, col_start, col_end = _parse_a1(range_name, self.row_count, self.col_count)
+        return self._formatted(row[col_start:col_end] for row in self._values[row_start:row_end])
+
+    def get(self, range_name=None, **kwargs):
+        values = self._slice(range_name) if range_name else self._formatted(self._values)
+        STATS.record('worksheet.get', received=values)
+        return values
+
+    def batch_get(self, ranges, **kwargs):
+        values = [self._slice(range_name) for range_name in ranges]
+        STATS.record('worksheet.batch_get', received=values)
+        return values
+
+    def _appended(self, count):
+        first = len(self._values) - count + 1
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first}:A{len(self._values)}", 'updatedRows': count}}
+
+    def append_row(self, values, **kwargs):
+        self._values.append(list(values))
+        STATS.record('worksheet.append_row', sent=values)
+        return self._appended(1)
+
+    def append_rows(self, values, **kwargs):
+        self._values.extend(list(row) for row in values)
+        STATS.record('worksheet.append_rows', sent=values)
+        return self._appended(len(values))
+
+    def delete_rows(self, start_index, end_index=None):
+        del self._values[start_index - 1:(end_index or start_index)]
+        STATS.record('worksheet.delete_rows')
+
+    def clear(self):
+        self._values = []
+        STATS.record('worksheet.clear')
+
+    def _write(self, range_name, values):
+        row_start, _, col_start, _ = _parse_a1(range_name, self.row_count, self.col_count)
+        for offset, row in enumerate(values):
+            target = row_start + offset
+            while len(self._values) <= target:
+                self._values.append([])
+            current = self._values[target]
+            if len(current) < col_start + len(row):
+                current.extend([''] * (col_start + len(row) - len(current)))
+            current[col_start:col_start + len(row)] = list(row)
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread 6 takes update(values, range_name); older code passes (range_name, values)
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        self._write(range_name or 'A1', values)
+        STATS.record('worksheet.update', sent=values)
+        return {'updatedRows': len(values)}
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            self._write(item['range'], item['values'])
+        STATS.record('worksheet.batch_update', sent=data)
+        return {'totalUpdatedRows': sum(len(item['values']) for item in data)}
+
+
+class OfflineSpreadsheet:
+    def __init__(self, spreadsheet_id, worksheets):
+        self.id = spreadsheet_id
+        self._worksheets = worksheets
+        for worksheet in worksheets:
+            worksheet.spreadsheet = self
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def worksheet(self, title):
+        STATS.record('spreadsheet.worksheet')
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise KeyError(title)
+
+    def worksheets(self):
+        STATS.record('spreadsheet.worksheets')
+        return list(self._worksheets)
+
+    def batch_update(self, body):
+        # Only the row deletes EditSession sends; requests apply in order
+        requests = body.get('requests', [])
+        for request in requests:
+            target = request['deleteDimension']['range']
+            worksheet = next(ws for ws in self._worksheets if ws.id == target['sheetId'])
+            del worksheet._values[target['startIndex']:target['endIndex']]
+        STATS.record('spreadsheet.batch_update', sent=body)
+        return {'spreadsheetId': self.id, 'replies': [{} for _ in requests]}
+
+    def values_batch_get(self, ranges, params=None, **kwargs):
+        value_ranges = []
+        for range_name in ranges:
+            title = range_name.split('!', 1)[0].strip("'")
+            worksheet = next(ws for ws in self._worksheets if ws.title == title)
+            values = worksheet._slice(range_name) if '!' in range_name else worksheet._formatted(worksheet._values)
+            value_ranges.append({'range': range_name, 'values': values})
+        STATS.record('spreadsheet.values_batch_get', received=value_ranges)
+        return {'spreadsheetId': self.id, 'valueRanges': value_ranges}
+
+
+class OfflineSheetsClient:
+    def __init__(self, spreadsheets, default_key=None):
+        self._spreadsheets = spreadsheets
+        self._default_key = default_key or next(iter(spreadsheets))
+
+    def open_by_key(self, key):
+        STATS.record('client.open_by_key')
+        return self._spreadsheets.get(key, self._spreadsheets[self._default_key])
+
+    def open_by_url(self, url):
+        STATS.record('client.open_by_url')
+        match = re.search(r"/d/([a-zA-Z0-9-_]+)", url)
+        key = match.group(1) if match else self._default_key
+        return self._spreadsheets.get(key, self._spreadsheets[self._default_key])
+
+
+class _Request:
+    def __init__(self, name, result, sent=None):
+        self._name = name
+        self._result = result
+        self._sent = sent
+
+    def execute(self):
+        STATS.record(self._name, received=self._result, sent=self._sent)
+        return self._result
+
+
+class OfflineDriveService:
+    def __init__(self, modified_time='2024-01-01T00:00:00.000Z'):
+        self._files = {}
+        self._counter = 0
+        self.modified_time = modified_time
+
+    def files(self):
+        return self
+
+    def list(self, q=None, **kwargs):
+        return _Request('drive.files.list', {'files': []})
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        result = {'id': fileId, 'modifiedTime': self.modified_time, 'version': '1'}
+        return _Request('drive.files.get', result)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        self._counter += 1
+        file_id = f"offline-{self._counter}"
+        self._files[file_id] = body
+        return _Request('drive.files.create', {'id': file_id}, sent=body)
+
+    def update(self, fileId=None, body=None, **kwargs):
+        return _Request('drive.files.update', {'id': fileId}, sent=body)
+
+
+_LOGO_PNG = None
+
+
+def offline_logo(url, timeout=None):
+    """A generated 200x200 PNG in place of a remote university logo."""
+    global _LOGO_PNG
+    if _LOGO_PNG is None:
+        import io
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new("RGB", (200, 200), (30, 136, 229)).save(output, format="PNG")
+        _LOGO_PNG = output.getvalue()
+    STATS.record('logo.fetch', received=url)
+    return _LOGO_PNG
+
+
+@contextlib.contextmanager
+def offline_backends(spreadsheets, default_key=None, drive=None):
+    """Route gspread, service-account credentials, the Drive client and
+    logo downloads to the in-memory backends for the duration of the block."""
+    client = OfflineSheetsClient(spreadsheets, default_key)
+    drive = drive or OfflineDriveService()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch(
+            'google.oauth2.service_account.Credentials.from_service_account_info',
+            return_value=object()))
+        stack.enter_context(mock.patch('gspread.authorize', return_value=client))
+        stack.enter_context(mock.patch('googleapiclient.discovery.build', return_value=drive))
+        stack.enter_context(mock.patch('crm.logo_cache.fetch_image', side_effect=offline_logo))
+        yield client
@@ -0,0 +1,284 @@
+"""End-to-end benchmarks for the CRM pages.
+
+Each page runs through Streamlit's AppTest against the offline backends in
+``benchmarks.offline`` with synthetic datasets. For every interaction we
+record rerun latency, peak RSS, backend calls and bytes transferred.
+
+    python -m benchmarks.run                      # full matrix
+    python -m benchmarks.run --pages students --sizes 1000
+    python -m benchmarks.run --output new.json --compare old.json
+
+Every (page, size) pair runs in its own interpreter so peak RSS and
+Streamlit's caches are not shared between scenarios.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STUDENT_SIZES = [1_000, 10_000, 100_000]
+PROGRAM_SIZES = [10_000, 100_000, 500_000]
+
+FAKE_SERVICE_ACCOUNT = {
+    "type": "service_account",
+    "project_id": "offline",
+    "private_key_id": "offline",
+    "private_key": "offline",
+    "client_email": "offline@offline.iam.gserviceaccount.com",
+    "client_id": "0",
+    "token_uri": "https://oauth2.googleapis.com/token",
+}
+
+
+def _button(at, label):
+    for button in list(at.button) + list(at.get('form_submit_button')):
+        if button.label == label:
+            return button
+    raise LookupError(f"No button labelled {label!r}")
+
+
+def _by_label(widgets, label):
+    for widget in widgets:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+# --- Interactions ---
+
+def load(at):
+    at.run()
+
+
+def students_select_student(at):
+    selectbox = at.selectbox(key="search_query")
+    selectbox.select(selectbox.options[-1]).run()
+
+
+def students_apply_filter(at):
+    at.selectbox(key="status_filter").select("DS-160").run()
+
+
+def students_save_note(at):
+    at.text_area(key="note_input").input("Called, waiting for the bank statement")
+    _button(at, "Save Note").click()
+    at.run()
+
+
+def new_student_submit(at):
+    _by_label(at.text_input, "👤 First Name").input("Bench")
+    _by_label(at.text_input, "👤 Last Name").input("Student")
+    _by_label(at.text_input, "📞 Phone Number").input("+213799999999")
+    _by_label(at.text_input, "📧 Email").input("bench.student@example.com")
+    _button(at, "Add Student").click()
+    at.run()
+
+
+def student_list_apply_filter(at):
+    _by_label(at.multiselect, "Filter by Agent").select("Hamza").run()
+
+
+def universities_apply_filter(at):
+    at.selectbox(key="country_filter").select("Canada")
+    _button(at, "Apply Filter").click()
+    at.run()
+
+
+def universities_next_page(at):
+    _button(at, "Next ▶").click()
+    at.run()
+
+
+PAGES = {
+    'students': {
+        'path': "pages/👥Students (1).py",
+        'dataset': 'students',
+        'interactions': [
+            ('load', load),
+            ('select_student', students_select_student),
+            ('apply_filter', students_apply_filter),
+            ('save_note', students_save_note),
+        ],
+    },
+    'new_student': {
+        'path': "pages/➕New Student.py",
+        'dataset': 'students',
+        'interactions': [
+            ('load', load),
+            ('submit_student', new_student_submit),
+        ],
+    },
+    'student_list': {
+        'path': "pages/📝GoogleSheet.py",
+        'dataset': 'students',
+        'interactions': [
+            ('load', load),
+            ('apply_filter', student_list_apply_filter),
+        ],
+    },
+    'emergency': {
+        'path': "pages/🚨Emergency.py",
+        'dataset': 'students',
+        'interactions': [
+            ('open', load),
+        ],
+    },
+    'universities': {
+        'path': "pages/universities.py",
+        'dataset': 'programs',
+        'interactions': [
+            ('load', load),
+            ('apply_filter', universities_apply_filter),
+            ('next_page', universities_next_page),
+        ],
+    },
+}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_scenario(page, size, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    from benchmarks.datasets import STUDENTS_KEY, build_spreadsheets
+    from benchmarks.offline import STATS, offline_backends
+
+    spec = PAGES[page]
+    if spec['dataset'] == 'students':
+        spreadsheets = build_spreadsheets(n_students=size, n_programs=100)
+    else:
+        spreadsheets = build_spreadsheets(n_students=100, n_programs=size)
+    setup_rss = _peak_rss_mb()
+
+    results = []
+    with offline_backends(spreadsheets, default_key=STUDENTS_KEY):
+        at = AppTest.from_file(os.path.join(REPO_ROOT, spec['path']), default_timeout=timeout)
+        at.secrets["gcp_service_account"] = FAKE_SERVICE_ACCOUNT
+        for name, action in spec['interactions']:
+            STATS.reset()
+            error = None
+            start = time.perf_counter()
+            try:
+                action(at)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latency = time.perf_counter() - start
+            backend = STATS.snapshot()
+            exceptions = [exc.message for exc in at.exception]
+            results.append({
+                'page': page,
+                'dataset_size': size,
+                'interaction': name,
+                'latency_s': round(latency, 4),
+                'peak_rss_mb': _peak_rss_mb(),
+                'setup_rss_mb': setup_rss,
+                'backend_calls': backend['total_calls'],
+                'backend_calls_by_method': backend['calls'],
+                'bytes_in': backend['bytes_in'],
+                'bytes_out': backend['bytes_out'],
+                'error': error or (exceptions[0] if exceptions else None),
+            })
+            if error:
+                # Later interactions depend on the page state, so stop here
+                break
+    return results
+
+
+def _spawn(page, size, timeout):
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker', '--pages', page,
+               '--sizes', str(size), '--timeout', str(timeout)]
+    completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return [{'page': page, 'dataset_size': size, 'interaction': None,
+                 'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'worker failed'}]
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _sizes_for(page, sizes):
+    if sizes:
+        return sizes
+    return PROGRAM_SIZES if PAGES[page]['dataset'] == 'programs' else STUDENT_SIZES
+
+
+def compare(current, baseline, threshold):
+    # Print interactions whose latency regressed by more than the threshold
+    def key(row):
+        return row['page'], row['dataset_size'], row['interaction']
+
+    previous = {key(row): row for row in baseline['results'] if row.get('latency_s') is not None}
+    regressions = []
+    for row in current['results']:
+        before = previous.get(key(row))
+        if before is None or row.get('latency_s') is None:
+            continue
+        ratio = row['latency_s'] / before['latency_s'] if before['latency_s'] else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((key(row), before['latency_s'], row['latency_s'], ratio))
+    for (page, size, interaction), before, after, ratio in regressions:
+        print(f"REGRESSION {page}/{interaction} @ {size}: {before:.3f}s -> {after:.3f}s (x{ratio:.2f})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', nargs='+', choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument('--sizes', nargs='+', type=int, help="Dataset sizes (defaults depend on the page)")
+    parser.add_argument('--timeout', type=float, default=600, help="Per-rerun timeout in seconds")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="Previous results file to check for latency regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown ratio for --compare")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_scenario(args.pages[0], args.sizes[0], args.timeout)))
+        return 0
+
+    results = []
+    for page in args.pages:
+        for size in _sizes_for(page, args.sizes):
+            print(f"Running {page} @ {size}...", file=sys.stderr)
+            results.extend(_spawn(page, size, args.timeout))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} measurements to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
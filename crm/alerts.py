@@ -0,0 +1,309 @@
+"""Headless evaluation of the Emergency rules, with digest emails.
+
+Runs outside Streamlit and never executes a page script:
+
+    python -m crm.alerts                  # every 15 minutes
+    python -m crm.alerts --once --dry-run # evaluate once, print the digests
+
+Credentials come from ``.streamlit/secrets.toml``: ``gcp_service_account``
+for the sheet, ``alerts_email``/``alerts_password`` for the sender
+(``Djazila_email``/``Djazila_password`` when unset), ``<Agent>_email`` for
+the recipients, and ``alerts_admin_email`` for students without a known
+agent.
+
+The 'ALL' sheet is cached in process and downloaded again only when its
+Drive ``modifiedTime`` changes; the rules themselves run every cycle since
+they depend on today's date. The students each rule flagged are kept in a
+JSON state file, so a digest only lists students that are newly flagged
+since the previous run. Each agent gets one digest per cycle, all sent
+through a single SMTP connection that stays open between cycles.
+"""
+import argparse
+import json
+import logging
+import os
+import smtplib
+import ssl
+import sys
+import time
+import tomllib
+from datetime import datetime
+from email.message import EmailMessage
+
+import gspread
+import pandas as pd
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+
+from crm import tracing
+from crm.deadlines import DeadlineIndex
+from crm.emergency_rules import RULES, SHEET_NAME, SPREADSHEET_ID, evaluate, parse_dates
+
+SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+STATE_PATH = "alert_state.json"
+INTERVAL_SECONDS = 15 * 60
+SMTP_HOST = "smtp.titan.email"
+SMTP_PORT = 465
+UNASSIGNED = "Unassigned"
+
+# The date shown next to each student in the digest
+RULE_DATES = {
+    'school_payment': 'School Payment Due',
+    'ds160': 'EMBASSY ITW. DATE',
+    'interview_prep': 'EMBASSY ITW. DATE',
+    'sevis': 'EMBASSY ITW. DATE',
+    'i20': 'DATE',
+    'aramex': 'DATE',
+    'visa_result': 'EMBASSY ITW. DATE',
+    'unassigned': 'DATE',
+}
+
+# Spellings used in the sheet's Agent column -> secrets prefix
+AGENT_ALIASES = {"Nesrine": "Nessrine"}
+
+log = logging.getLogger("crm.alerts")
+
+
+def load_secrets(path=SECRETS_PATH):
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def _text(value):
+    return "" if pd.isna(value) else str(value).strip()
+
+
+def student_key(record):
+    """Stable identity of a student row across reloads."""
+    return "|".join(_text(record.get(column)).casefold()
+                    for column in ('First Name', 'Last Name', 'E-mail', 'Phone N°'))
+
+
+def agent_of(record):
+    agent = _text(record.get('Agent'))
+    return UNASSIGNED if not agent or agent.lower() == 'nan' else agent
+
+
+class SheetSource:
+    """The emergency sheet, downloaded again only when Drive reports a change."""
+
+    def __init__(self, service_account, spreadsheet_id=SPREADSHEET_ID, sheet_name=SHEET_NAME):
+        creds = Credentials.from_service_account_info(service_account, scopes=SCOPES)
+        self.client = gspread.authorize(creds)
+        self.drive = build('drive', 'v3', credentials=creds)
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.modified = None
+        self.frame = None
+        self.deadlines = DeadlineIndex()
+
+    def _modified_time(self):
+        try:
+            return self.drive.files().get(fileId=self.spreadsheet_id, fields='modifiedTime').execute()['modifiedTime']
+        except Exception as e:
+            # Without the timestamp, reload every cycle rather than risk stale data
+            log.warning("Could not read modifiedTime: %s", e)
+            return None
+
+    @tracing.traced("alerts.load")
+    def load(self):
+        modified = self._modified_time()
+        if self.frame is None or modified is None or modified != self.modified:
+            sheet = self.client.open_by_key(self.spreadsheet_id).worksheet(self.sheet_name)
+            self.frame = pd.DataFrame(sheet.get_all_records())
+            self.modified = modified
+            self.deadlines.sync(self.frame)
+            log.info("Loaded %d rows (modified %s)", len(self.frame), modified)
+        return self.frame
+
+
+class AlertState:
+    """Keys of the students each rule flagged on the previous run."""
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        self.rules = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.rules = {rule: set(keys) for rule, keys in json.load(f)['rules'].items()}
+        except FileNotFoundError:
+            pass
+
+    @property
+    def initialized(self):
+        return self.rules is not None
+
+    def new_keys(self, rule, keys):
+        return set(keys) - (self.rules or {}).get(rule, set())
+
+    def save(self, rules):
+        self.rules = {rule: set(keys) for rule, keys in rules.items()}
+        state = {'updated': datetime.now().isoformat(timespec='seconds'),
+                 'rules': {rule: sorted(keys) for rule, keys in self.rules.items()}}
+        # Write then rename so a crash never leaves half a file behind
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(temporary, self.path)
+
+
+class Mailer:
+    """One logged-in SMTP connection, reused for every digest and
+    re-opened when the server has dropped it."""
+
+    def __init__(self, address, password, host=SMTP_HOST, port=SMTP_PORT):
+        self.address = address
+        self.password = password
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def _connection(self):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self._server = smtplib.SMTP_SSL(self.host, self.port, context=ssl.create_default_context())
+        self._server.login(self.address, self.password)
+        return self._server
+
+    def send(self, to, subject, body):
+        msg = EmailMessage()
+        msg['From'] = self.address
+        msg['To'] = to
+        msg['Subject'] = subject
+        msg.set_content(body)
+        try:
+            self._connection().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.close()
+            self._connection().send_message(msg)
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def agent_address(secrets, agent):
+    """The agent's ``<Agent>_email`` secret, or the admin address."""
+    agent = AGENT_ALIASES.get(agent, agent)
+    for key, value in secrets.items():
+        if key.endswith("_email") and key[:-len("_email")].casefold() == agent.casefold():
+            return value
+    return secrets.get("alerts_admin_email") or sender_credentials(secrets)[0]
+
+
+def sender_credentials(secrets):
+    if "alerts_email" in secrets:
+        return secrets["alerts_email"], secrets["alerts_password"]
+    return secrets["Djazila_email"], secrets["Djazila_password"]
+
+
+def digest_body(agent, sections):
+    """Plain-text digest; ``sections`` is [(rule, [(name, stage, date)])]."""
+    lines = [f"Hello {agent},", "", "These students were newly flagged on the Emergency dashboard:", ""]
+    for rule, students in sections:
+        lines.append(f"{RULES[rule]} ({len(students)})")
+        for name, stage, day in students:
+            lines.append(f"  - {name} · {stage or 'no stage'} · {day}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _format_day(value):
+    return value.strftime("%d/%m/%Y") if isinstance(value, (datetime, pd.Timestamp)) and not pd.isna(value) else ""
+
+
+@tracing.traced("alerts.cycle")
+def run_cycle(source, state, mailer, secrets, dry_run=False, today=None):
+    """Evaluate the rules once and send the digests; returns the number sent."""
+    data = parse_dates(source.load().copy())
+    results = evaluate(data, today, source.deadlines)
+    current = {rule: {student_key(record) for record in frame.to_dict('records')}
+               for rule, frame in results.items()}
+    if not state.initialized:
+        # First run: record what is already flagged instead of mailing the whole backlog
+        if not dry_run:
+            state.save(current)
+        log.info("Recorded %d flagged students as the baseline", sum(map(len, current.values())))
+        return 0
+
+    digests = {}  # agent -> {rule: [(key, name, stage, date)]}
+    for rule, frame in results.items():
+        new = state.new_keys(rule, current[rule])
+        for record in frame.to_dict('records'):
+            key = student_key(record)
+            if key in new:
+                name = f"{_text(record.get('First Name'))} {_text(record.get('Last Name'))}".strip()
+                entry = (key, name, _text(record.get('Stage')), _format_day(record.get(RULE_DATES[rule])))
+                digests.setdefault(agent_of(record), {}).setdefault(rule, []).append(entry)
+
+    sent = 0
+    for agent, rules in sorted(digests.items()):
+        sections = [(rule, [entry[1:] for entry in rules[rule]]) for rule in RULES if rule in rules]
+        body = digest_body(agent, sections)
+        count = sum(len(students) for _, students in sections)
+        subject = f"Emergency digest: {count} new alert(s) - {datetime.now():%d/%m/%Y}"
+        to = agent_address(secrets, agent)
+        if dry_run:
+            print(f"To: {to}\nSubject: {subject}\n\n{body}")
+            sent += 1
+            continue
+        try:
+            with tracing.span("alerts.send", agent=agent, students=count):
+                mailer.send(to, subject, body)
+            sent += 1
+        except Exception as e:
+            # Leave this agent's students out of the state so the next cycle retries them
+            log.error("Digest for %s failed: %s", agent, e)
+            for rule, entries in rules.items():
+                current[rule] -= {entry[0] for entry in entries}
+    if dry_run:
+        # A preview; the students are still new for the next real run
+        log.info("Printed %d digest(s), state left unchanged", sent)
+        return sent
+    state.save(current)
+    log.info("Sent %d digest(s)", sent)
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interval', type=float, default=INTERVAL_SECONDS, help="Seconds between evaluations")
+    parser.add_argument('--once', action='store_true', help="Evaluate once and exit")
+    parser.add_argument('--dry-run', action='store_true', help="Print the digests instead of sending them")
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--secrets', default=SECRETS_PATH)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    secrets = load_secrets(args.secrets)
+    source = SheetSource(secrets["gcp_service_account"])
+    state = AlertState(args.state)
+    mailer = Mailer(*sender_credentials(secrets))
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                run_cycle(source, state, mailer, secrets, dry_run=args.dry_run)
+            except Exception:
+                log.exception("Alert cycle failed")
+            if args.once:
+                return 0
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        mailer.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
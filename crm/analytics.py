@@ -0,0 +1,221 @@
+"""Pipeline and workload analytics for the Students sheet.
+
+``PipelineStats`` reduces the sheet to two small tables of counts: one
+keyed by (stage, agent, school, attempt, visa outcome) and a histogram of
+registration weeks per stage. ``sync`` hashes the columns they depend on
+and moves only the rows that changed from their old cell to their new one,
+so a rerun after one edit costs a hash of the frame plus a few additions.
+Every report (funnel, caseloads, approval rates, stage ages) is a groupby
+over those tables, whose size depends on the number of agents, schools and
+weeks rather than on how many students the sheet holds.
+"""
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+STAGES = ['PAYMENT & MAIL', 'APPLICATION', 'SCAN & SEND', 'ARAMEX & RDV', 'DS-160', 'ITW Prep.', 'CLIENTS']
+CLOSED_STAGE = 'CLIENTS'
+APPROVED = "Approved"
+DENIED = "Denied"
+PENDING = "Pending"
+UNKNOWN = "(none)"
+
+SOURCE_COLUMNS = ['Stage', 'Agent', 'Chosen School', 'Attempts', 'Visa Result', 'DATE']
+DIMENSIONS = ['stage', 'agent', 'school', 'attempt', 'outcome']
+AGE_DIMENSIONS = ['stage', 'week']
+NO_WEEK = -1
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+# Spellings found in the sheet -> canonical stage
+_STAGE_LOOKUP = {stage.rstrip('.').upper(): stage for stage in STAGES}
+_STAGE_LOOKUP['CLIENT'] = CLOSED_STAGE
+
+
+def normalize_stage(value):
+    text = "" if pd.isna(value) else str(value).strip()
+    return _STAGE_LOOKUP.get(text.rstrip('.').upper(), text or UNKNOWN)
+
+
+def visa_outcome(value):
+    text = "" if pd.isna(value) else str(value).casefold()
+    if "approv" in text:
+        return APPROVED
+    if "den" in text or "refus" in text:
+        return DENIED
+    return PENDING
+
+
+def _labels(values):
+    labels = values.astype(str).str.strip()
+    return labels.mask(values.isna() | labels.isin(['', 'nan', 'NaT']), UNKNOWN)
+
+
+def _column(frame, column):
+    if column in frame.columns:
+        return frame[column]
+    return pd.Series(np.nan, index=frame.index, dtype=object)
+
+
+def cube_keys(frame):
+    """The cells of every row of ``frame``, as a DataFrame of ``DIMENSIONS``
+    and the registration week."""
+    created = pd.to_datetime(_column(frame, 'DATE'), errors='coerce', dayfirst=True)
+    days = (created.to_numpy(dtype='datetime64[D]') - _EPOCH).astype('int64')
+    weeks = np.where(created.isna().to_numpy(), NO_WEEK, days // 7)
+    return pd.DataFrame({
+        'stage': _column(frame, 'Stage').map(normalize_stage),
+        'agent': _labels(_column(frame, 'Agent')),
+        'school': _labels(_column(frame, 'Chosen School')),
+        'attempt': _labels(_column(frame, 'Attempts')),
+        'outcome': _column(frame, 'Visa Result').map(visa_outcome),
+        'week': weeks,
+    }, index=frame.index)
+
+
+def _counts(keys):
+    return {'cube': keys.groupby(DIMENSIONS, sort=False).size(),
+            'ages': keys[keys['week'] != NO_WEEK].groupby(AGE_DIMENSIONS, sort=False).size()}
+
+
+def _empty(names):
+    return pd.Series(dtype='int64', index=pd.MultiIndex.from_tuples([], names=names))
+
+
+class PipelineStats:
+    def __init__(self):
+        self._tables = {'cube': _empty(DIMENSIONS), 'ages': _empty(AGE_DIMENSIONS)}
+        self._keys = cube_keys(pd.DataFrame(columns=SOURCE_COLUMNS))
+        self._hashes = np.array([], dtype=np.uint64)
+        # One instance is shared by every session of the server process
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return int(self._tables['cube'].sum())
+
+    def sync(self, frame):
+        """Bring the cube in line with ``frame`` (rows keyed by position);
+        returns how many rows moved."""
+        source = frame.reindex(columns=SOURCE_COLUMNS)
+        hashes = pd.util.hash_pandas_object(source, index=False).to_numpy()
+        with self.lock:
+            common = min(len(hashes), len(self._hashes))
+            changed = np.flatnonzero(hashes[:common] != self._hashes[:common])
+            removed = np.concatenate([changed, np.arange(common, len(self._hashes))])
+            added = np.concatenate([changed, np.arange(common, len(hashes))])
+            if not len(removed) and not len(added):
+                return 0
+            tables = dict(self._tables)
+            if len(removed):
+                for name, counts in _counts(self._keys.iloc[removed]).items():
+                    tables[name] = tables[name].sub(counts, fill_value=0)
+            keys = self._keys.iloc[:common].copy()
+            if len(added):
+                new_keys = cube_keys(source.iloc[added].set_axis(added))
+                for name, counts in _counts(new_keys).items():
+                    tables[name] = tables[name].add(counts, fill_value=0)
+                for position, column in enumerate(new_keys.columns):
+                    keys.iloc[changed, position] = new_keys[column].to_numpy()[:len(changed)]
+                keys = pd.concat([keys, new_keys.iloc[len(changed):]])
+            self._tables = {name: table[table > 0].astype('int64') for name, table in tables.items()}
+            self._keys = keys
+            self._hashes = hashes
+            return len(added)
+
+    def cube(self, name='cube'):
+        with self.lock:
+            return self._tables[name].rename('students').reset_index()
+
+    def funnel(self, agent=None):
+        """Students that reached each stage and the share that moved on to
+        the next one. A student at a stage has passed every earlier stage."""
+        cube = self.cube()
+        if agent:
+            cube = cube[cube['agent'] == agent]
+        at_stage = cube.groupby('stage')['students'].sum().reindex(STAGES, fill_value=0)
+        reached = at_stage[::-1].cumsum()[::-1]
+        funnel = pd.DataFrame({'stage': STAGES, 'at stage': at_stage.to_numpy(), 'reached': reached.to_numpy()})
+        following = funnel['reached'].shift(-1)
+        funnel['conversion'] = (following / funnel['reached'].replace(0, np.nan)).round(3)
+        return funnel
+
+    def caseloads(self, include_closed=False):
+        """Open students per agent and stage, busiest agents first."""
+        cube = self.cube()
+        if not include_closed:
+            cube = cube[cube['stage'] != CLOSED_STAGE]
+        table = cube.pivot_table(index='agent', columns='stage', values='students', aggfunc='sum', fill_value=0)
+        table = table.reindex(columns=[stage for stage in STAGES if stage in table.columns]
+                              + [stage for stage in table.columns if stage not in STAGES])
+        table['Total'] = table.sum(axis=1)
+        return table.sort_values('Total', ascending=False)
+
+    def approval_rates(self, by=('school', 'attempt')):
+        """Approved, denied and pending counts with the approval rate among
+        decided cases, per ``by`` group."""
+        cube = self.cube()
+        table = cube.pivot_table(index=list(by), columns='outcome', values='students', aggfunc='sum', fill_value=0)
+        table = table.reindex(columns=[APPROVED, DENIED, PENDING], fill_value=0)
+        decided = table[APPROVED] + table[DENIED]
+        table['Approval rate'] = (table[APPROVED] / decided.replace(0, np.nan)).round(3)
+        return table.sort_values(APPROVED, ascending=False)
+
+    def stage_ages(self, today=None, quantiles=(0.5, 0.9)):
+        """Days since registration of the students at each stage (median,
+        90th percentile, mean), from the weekly histogram."""
+        today = today or date.today()
+        today_days = (np.datetime64(today, 'D') - _EPOCH).astype('int64')
+        histogram = self.cube('ages').groupby(AGE_DIMENSIONS)['students'].sum()
+        rows = []
+        for stage in [stage for stage in STAGES if stage in histogram.index.get_level_values(0)]:
+            weeks = histogram.loc[stage].sort_index(ascending=False)
+            # Middle of the registration week, youngest first
+            ages = np.maximum(0, today_days - (weeks.index.to_numpy() * 7 + 3))
+            counts = weeks.to_numpy()
+            cumulative = np.cumsum(counts) / counts.sum()
+            row = {'stage': stage, 'students': int(counts.sum()),
+                   'mean days': round(float(np.average(ages, weights=counts)), 1)}
+            for q in quantiles:
+                row[f"p{int(q * 100)} days"] = int(ages[np.searchsorted(cumulative, q)])
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def render_dashboard(stats, key="pipeline", event_log=None):
+    """Funnel, caseload, stage-age and approval-rate views of ``stats``,
+    plus recorded time-in-stage when an ``event_log`` is given."""
+    import plotly.express as px
+    import streamlit as st
+
+    agents = ["All"] + sorted(stats.cube()['agent'].unique())
+    agent = st.selectbox("Agent", agents, key=f"{key}_agent")
+    agent = None if agent == "All" else agent
+
+    funnel_col, caseload_col = st.columns(2)
+    with funnel_col:
+        funnel = stats.funnel(agent)
+        st.plotly_chart(px.funnel(funnel, x='reached', y='stage', title="Stage funnel"),
+                        use_container_width=True, key=f"{key}_funnel")
+        st.dataframe(funnel, hide_index=True, use_container_width=True)
+    with caseload_col:
+        caseloads = stats.caseloads().drop(columns='Total')
+        long = caseloads.reset_index().melt(id_vars='agent', var_name='stage', value_name='students')
+        st.plotly_chart(px.bar(long, x='agent', y='students', color='stage', title="Open caseload per agent"),
+                        use_container_width=True, key=f"{key}_caseload")
+
+    ages_col, approval_col = st.columns(2)
+    with ages_col:
+        st.markdown("**Days since registration, by current stage**")
+        st.dataframe(stats.stage_ages(), hide_index=True, use_container_width=True)
+    with approval_col:
+        st.markdown("**Visa approval rate by school and attempt**")
+        st.dataframe(stats.approval_rates(), use_container_width=True)
+
+    if event_log is not None:
+        durations = event_log.stage_durations()
+        if not durations.empty:
+            st.markdown("**Time in stage, from recorded stage changes (days)**")
+            order = {stage: position for position, stage in enumerate(STAGES)}
+            durations = durations.sort_values('stage', key=lambda stages: stages.map(order).fillna(len(STAGES)))
+            st.dataframe(durations, hide_index=True, use_container_width=True)
@@ -0,0 +1,141 @@
+"""Ingest stage for uploaded recordings.
+
+Uploads are written once per file to a per-session directory in fixed-size
+chunks, then transcoded to mono 16 kHz Opus with an ``ffmpeg`` subprocess,
+which streams the file rather than decoding it into memory. The much
+smaller Opus file is what gets uploaded to AssemblyAI; the original WAV is
+kept for playing snippets. Without ffmpeg on the PATH the WAV is uploaded
+as-is.
+"""
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import uuid
+import wave
+
+import streamlit as st
+
+from crm import tracing
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# Smaller files upload quickly enough as they are
+TRANSCODE_ABOVE = 20 * 1024 * 1024
+OPUS_BITRATE = "24k"
+SESSION_KEY = "_audio_ingest"
+
+
+class IngestedAudio:
+    def __init__(self, original_path, upload_path, original_size, upload_size, codec):
+        self.original_path = original_path  # WAV, used for snippets
+        self.upload_path = upload_path      # what is sent for transcription
+        self.original_size = original_size
+        self.upload_size = upload_size
+        self.codec = codec
+
+    @property
+    def compressed(self):
+        return self.upload_path != self.original_path
+
+
+def session_dir():
+    """A temporary directory owned by the current browser session."""
+    state = st.session_state.setdefault(SESSION_KEY, {'dir': None, 'files': {}})
+    if not state['dir'] or not os.path.isdir(state['dir']):
+        state['dir'] = tempfile.mkdtemp(prefix="crm-audio-")
+    return state['dir']
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]", "_", os.path.basename(name or "audio.wav"))
+
+
+def save_stream(source, directory, name):
+    """Copy a file-like ``source`` to a unique file in ``directory`` in chunks."""
+    path = os.path.join(directory, f"{uuid.uuid4().hex}_{_safe_name(name)}")
+    source.seek(0)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+    return path
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+@tracing.traced("audio.transcode")
+def transcode_to_opus(path, directory=None, bitrate=OPUS_BITRATE):
+    """Transcode ``path`` to mono 16 kHz Opus in ``directory`` (default: next
+    to ``path``); returns the new path or None."""
+    if not ffmpeg_available():
+        return None
+    name = f"{uuid.uuid4().hex}.ogg" if directory else os.path.splitext(os.path.basename(path))[0] + ".ogg"
+    target = os.path.join(directory or os.path.dirname(path), name)
+    command = ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+               "-vn", "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", bitrate, target]
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=60 * 60)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        if os.path.exists(target):
+            os.remove(target)
+        return None
+    return target
+
+
+def _remove(audio):
+    for path in {audio.original_path, audio.upload_path}:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+@tracing.traced("audio.ingest")
+def ingest(uploaded_file, transcode_above=TRANSCODE_ABOVE):
+    """Save and, when large, transcode an uploaded recording.
+
+    Runs once per uploaded file; later reruns get the stored result. Files
+    of the session's previous upload are removed.
+    """
+    directory = session_dir()
+    files = st.session_state[SESSION_KEY]['files']
+    file_id = getattr(uploaded_file, 'file_id', None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    if file_id in files and os.path.exists(files[file_id].original_path):
+        return files[file_id]
+    for previous in files.values():
+        _remove(previous)
+    files.clear()
+
+    original = save_stream(uploaded_file, directory, uploaded_file.name)
+    size = os.path.getsize(original)
+    upload_path, codec = original, "wav"
+    if size > transcode_above:
+        transcoded = transcode_to_opus(original)
+        if transcoded:
+            upload_path, codec = transcoded, "opus"
+    audio = IngestedAudio(original, upload_path, size, os.path.getsize(upload_path), codec)
+    files[file_id] = audio
+    return audio
+
+
+def extract_audio_chunk(file_path, start_time, end_time):
+    """WAV bytes of ``start_time``..``end_time`` seconds, read by seeking
+    instead of decoding the whole file."""
+    with wave.open(file_path, 'rb') as wav_file:
+        framerate = wav_file.getframerate()
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        start_frame = max(0, int(start_time * framerate))
+        end_frame = min(wav_file.getnframes(), int(end_time * framerate))
+        wav_file.setpos(start_frame)
+        chunk_frames = wav_file.readframes(max(0, end_frame - start_frame))
+
+    chunk_io = io.BytesIO()
+    with wave.open(chunk_io, 'wb') as chunk_wav:
+        chunk_wav.setnchannels(channels)
+        chunk_wav.setsampwidth(sample_width)
+        chunk_wav.setframerate(framerate)
+        chunk_wav.writeframes(chunk_frames)
+
+    chunk_io.seek(0)
+    return chunk_io
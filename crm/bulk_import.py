@@ -0,0 +1,193 @@
+"""Bulk student import from CSV or Excel files.
+
+Rows are streamed in chunks (``pandas.read_csv(chunksize=...)`` or
+openpyxl's read-only mode), passed through the same record builder and
+validation as the New Student form, deduplicated against the shared
+``StudentTable`` and against each other, then written with bounded
+``append_rows`` batches. A batch the sheet refuses stops the import; the
+report keeps what was added before it and the rows of that batch.
+"""
+from datetime import date, datetime
+
+import openpyxl
+import pandas as pd
+
+from crm.identity import normalize_email, normalize_name, normalize_phone
+from crm.students import DATE_FORMAT, DUPLICATE_CHECK_MAX_AGE_SECONDS, new_student_record, validate_student
+
+CHUNK_SIZE = 500
+BATCH_SIZE = 200
+
+# Accepted spellings for the columns people usually rename in exports
+COLUMN_ALIASES = {
+    "date": "DATE",
+    "first name": "First Name",
+    "firstname": "First Name",
+    "prenom": "First Name",
+    "last name": "Last Name",
+    "lastname": "Last Name",
+    "nom": "Last Name",
+    "phone": "Phone N°",
+    "phone number": "Phone N°",
+    "phone n°": "Phone N°",
+    "email": "E-mail",
+    "e-mail": "E-mail",
+    "emergency contact": "Emergency contact N°",
+    "emergency contact n°": "Emergency contact N°",
+    "school": "Chosen School",
+    "chosen school": "Chosen School",
+    "specialty": "Specialite",
+    "speciality": "Specialite",
+    "specialite": "Specialite",
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.added = 0
+        self.batches = 0
+        self.rejected = []  # (row number, reason, raw record)
+        self.error = None
+        self.failed = []    # (row number, record) of the batch that was not written
+
+    def reject(self, row_number, reason, raw):
+        self.rejected.append((row_number, reason, raw))
+
+    def fail(self, batch, error):
+        self.failed = list(batch)
+        self.error = str(error)
+
+    def rejected_frame(self):
+        rows = [{'Row': row_number, 'Reason': reason, **raw} for row_number, reason, raw in self.rejected]
+        return pd.DataFrame(rows)
+
+    def failed_frame(self):
+        return pd.DataFrame([{'Row': row_number, **record} for row_number, record in self.failed])
+
+
+def _canonical(column, known_columns):
+    name = str(column).strip()
+    if name in known_columns:
+        return name
+    lowered = name.lower()
+    for known in known_columns:
+        if known.lower() == lowered:
+            return known
+    return COLUMN_ALIASES.get(lowered, name)
+
+
+def _clean(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, float) and value.is_integer():
+        # Excel stores phone numbers as floats
+        return str(int(value))
+    return str(value).strip()
+
+
+def _iter_csv(file, chunk_size):
+    # Blank lines are kept so row numbers match the file
+    for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                             skip_blank_lines=False):
+        yield list(chunk.columns), chunk.itertuples(index=False, name=None)
+
+
+def _iter_xlsx(file, chunk_size):
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_clean(cell) for cell in next(rows, [])]
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield header, chunk
+                chunk = []
+        if chunk:
+            yield header, chunk
+    finally:
+        workbook.close()
+
+
+def iter_chunks(file, chunk_size=CHUNK_SIZE):
+    """Yield (header, rows) chunks from an uploaded CSV or XLSX file."""
+    name = getattr(file, 'name', '').lower()
+    if name.endswith(('.xlsx', '.xlsm')):
+        return _iter_xlsx(file, chunk_size)
+    return _iter_csv(file, chunk_size)
+
+
+def _blank(row):
+    return all(cell is None or cell == "" or (isinstance(cell, float) and pd.isna(cell)) for cell in row)
+
+
+def import_students(table, file, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, progress=None, actor=None):
+    """Validate, deduplicate and append every row of ``file`` to ``table``.
+
+    Stops at the first batch that cannot be appended; ``report.error`` and
+    ``report.failed`` then say why and which rows were not written.
+    """
+    # The whole file is checked against this read of the sheet
+    table.refresh_if_stale(DUPLICATE_CHECK_MAX_AGE_SECONDS)
+    report = ImportReport()
+    seen = {'phone': set(), 'e-mail': set(), 'name': set()}
+    pending = []  # (row number, record)
+    row_number = 1  # header row
+
+    def flush():
+        if pending:
+            try:
+                report.added += table.append_many([record for _, record in pending], actor=actor)
+                report.batches += 1
+            except Exception as e:
+                report.fail(pending, e)
+            pending.clear()
+
+    for header, rows in iter_chunks(file, chunk_size):
+        columns = [_canonical(column, table.header) for column in header]
+        for row in rows:
+            # Blank rows are skipped but still counted
+            row_number += 1
+            if _blank(row):
+                continue
+            raw = {column: _clean(value) for column, value in zip(columns, row)}
+            record = new_student_record({column: value for column, value in raw.items() if value != ""})
+            record.setdefault("DATE", datetime.now().strftime(DATE_FORMAT))
+
+            errors = validate_student(record)
+            if errors:
+                report.reject(row_number, "; ".join(errors), raw)
+                continue
+
+            duplicate = table.find_duplicate(record)
+            if duplicate:
+                field, existing = duplicate
+                report.reject(row_number, f"Duplicate {field} of {existing.get('Student Name', '')}", raw)
+                continue
+
+            keys = {
+                'phone': normalize_phone(record.get("Phone N°")),
+                'e-mail': normalize_email(record.get("E-mail")),
+                'name': normalize_name(record.get("Student Name")),
+            }
+            repeated = next((field for field, value in keys.items() if value and value in seen[field]), None)
+            if repeated:
+                report.reject(row_number, f"Duplicate {repeated} within the file", raw)
+                continue
+            for field, value in keys.items():
+                if value:
+                    seen[field].add(value)
+
+            pending.append((row_number, record))
+            if len(pending) >= batch_size:
+                flush()
+                if report.error:
+                    return report
+        if progress:
+            progress(row_number - 1, report)
+    flush()
+    if progress:
+        progress(row_number - 1, report)
+    return report
@@ -0,0 +1,154 @@
+"""The universities catalogue, shared by every session and kept current.
+
+A ``Catalogue`` holds one ``Snapshot``: the programmes as a DataFrame plus
+everything the search page derives from them (the sorted CAD prices, the
+filter options and the card markup). At most every ``CHECK_SECONDS`` it
+asks Drive for the spreadsheet's ``modifiedTime`` and downloads the sheet
+only when that changed. The new snapshot is built in full before it
+replaces the old one in a single assignment, so a session sees either the
+old catalogue or the new one, never a mix, and other sessions keep serving
+the old one while the download runs.
+
+Catalogues live in a process-wide registry (``shared_catalogue``) rather
+than a Streamlit cache, so clearing Streamlit's caches does not throw the
+catalogue away.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from crm import tracing
+from crm.fx import PriceIndex, normalize_tuition
+from crm.session_state import shared_tables
+from crm.taxonomy import default_store
+from crm.university_cards import build_fragments, catalogue_version
+
+SPREADSHEET_ID = "1gCxnCOhQRHtVdVMSiLaReBRJbCUz1Wn6-KJRZshneuM"
+SHEET_NAME = "cleaned_universities_data"
+CHECK_SECONDS = 60
+NUMERIC_COLUMNS = ['Tuition Price', 'Application Fee Price']
+OPTION_COLUMNS = ['Major', 'Country', 'Level', 'Field', 'Adjusted Speciality', 'Institution Type']
+
+log = logging.getLogger(__name__)
+
+
+def prepare(records):
+    """The catalogue DataFrame of the sheet's ``records``."""
+    df = pd.DataFrame(records)
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    # Comparable tuition whatever currency each programme is priced in
+    normalize_tuition(df)
+    # Classify what the taxonomy store already knows, without calling the LLM
+    try:
+        store = default_store()
+        store.learn(df)
+        store.fill(df)
+    except sqlite3.Error as e:
+        log.warning("Could not use the taxonomy store: %s", e)
+    # Cached card markup is keyed by this
+    df.attrs['version'] = catalogue_version(df)
+    return df
+
+
+class Snapshot:
+    """One version of the catalogue and its indexes. Not modified once built."""
+
+    @tracing.traced("catalogue.build")
+    def __init__(self, frame, modified=None):
+        self.frame = frame
+        self.modified = modified
+        self.version = frame.attrs['version']
+        self.loaded_at = time.time()
+        self.prices = PriceIndex(frame['tuition_cad'])
+        self.options = {column: sorted(frame[column].unique().tolist())
+                        for column in OPTION_COLUMNS if column in frame.columns}
+        self.fragments = build_fragments(frame)
+
+    def __len__(self):
+        return len(self.frame)
+
+
+class Catalogue:
+    def __init__(self, client, drive, spreadsheet_id, sheet_name, check_seconds=CHECK_SECONDS):
+        self.client = client
+        self.drive = drive
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.check_seconds = check_seconds
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.downloads = 0
+        # Held while checking or downloading, so one session does it for all
+        self.lock = threading.Lock()
+
+    def _modified_time(self):
+        try:
+            return self.drive.files().get(fileId=self.spreadsheet_id, fields='modifiedTime').execute()['modifiedTime']
+        except Exception as e:
+            log.warning("Could not read the catalogue's modifiedTime: %s", e)
+            return None
+
+    @tracing.traced("catalogue.download")
+    def _download(self, modified):
+        sheet = self.client.open_by_key(self.spreadsheet_id).worksheet(self.sheet_name)
+        snapshot = Snapshot(prepare(sheet.get_all_records()), modified)
+        self.downloads += 1
+        log.info("Loaded %d programmes (modified %s)", len(snapshot), modified)
+        return snapshot
+
+    def current(self):
+        """The latest snapshot, checking Drive first when the last check is
+        older than ``check_seconds``."""
+        snapshot = self.snapshot
+        if snapshot is not None and time.time() - self.checked_at < self.check_seconds:
+            return snapshot
+        # With a snapshot to serve, don't queue up behind another session's check
+        if not self.lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            return self._refresh()
+        finally:
+            self.lock.release()
+
+    def refresh(self):
+        """Check Drive now, whatever the time of the last check."""
+        with self.lock:
+            self.checked_at = 0.0
+            return self._refresh()
+
+    def _refresh(self):
+        # Caller holds the lock
+        snapshot = self.snapshot
+        if snapshot is not None and time.time() - self.checked_at < self.check_seconds:
+            # Another session checked while we waited
+            return snapshot
+        with tracing.span("catalogue.check"):
+            modified = self._modified_time()
+        self.checked_at = time.time()
+        if snapshot is not None and (modified is None or modified == snapshot.modified):
+            # Unchanged, or Drive unreachable: keep serving what we have
+            return snapshot
+        self.snapshot = self._download(modified)
+        # Sessions hold views of it, so it is accounted for as a shared table
+        shared_tables().publish(("catalogue", self.spreadsheet_id, self.sheet_name),
+                                self.snapshot.frame, self.snapshot.version)
+        return self.snapshot
+
+
+_catalogues = {}
+_catalogues_lock = threading.Lock()
+
+
+def shared_catalogue(spreadsheet_id, sheet_name, connect, **kwargs):
+    """The process-wide ``Catalogue`` of a sheet. ``connect()`` returns the
+    (gspread client, Drive service) pair and is only called to create it."""
+    key = (spreadsheet_id, sheet_name)
+    with _catalogues_lock:
+        if key not in _catalogues:
+            client, drive = connect()
+            _catalogues[key] = Catalogue(client, drive, spreadsheet_id, sheet_name, **kwargs)
+        return _catalogues[key]
@@ -0,0 +1,181 @@
+"""Date-keyed index of student deadlines.
+
+Each student row yields up to four deadlines:
+
+- School Payment Due: School Entry Date - 50 days
+- DS-160 Due: EMBASSY ITW. DATE - 30 days
+- Interview: EMBASSY ITW. DATE
+- I-20 Due: DATE + 14 days, while School Entry Date is empty
+
+``DeadlineIndex`` keeps the days that have deadlines in a sorted list
+(``bisect``), so "due in the next N days" is a range scan rather than a
+pass over every row. ``sync`` hashes the date columns of each row and
+re-indexes only the rows that changed since the last call, so a frame with
+the dates as text and one with them parsed hash the same. One index is
+shared by every session; lookups given a ``frame`` sync with it and read
+under one lock, so they never see another session's rows. The index also
+renders iCal and JSON calendar feeds.
+"""
+import bisect
+import json
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+SCHOOL_PAYMENT = "School Payment Due"
+DS160 = "DS-160 Due"
+INTERVIEW = "Interview"
+I20 = "I-20 Due"
+KINDS = (SCHOOL_PAYMENT, DS160, INTERVIEW, I20)
+
+SCHOOL_PAYMENT_DAYS = 50
+DS160_DAYS = 30
+I20_DAYS = 14
+
+DATE_COLUMNS = ('School Entry Date', 'EMBASSY ITW. DATE', 'DATE')
+
+
+def _dates(frame, column):
+    if column not in frame.columns:
+        return pd.Series(pd.NaT, index=frame.index)
+    values = frame[column]
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+
+
+def deadline_frame(frame):
+    """(row, kind, day) for every deadline of the rows of ``frame``; ``row``
+    is the frame's index label."""
+    entry = _dates(frame, 'School Entry Date')
+    interview = _dates(frame, 'EMBASSY ITW. DATE')
+    created = _dates(frame, 'DATE')
+    deadlines = {
+        SCHOOL_PAYMENT: entry - timedelta(days=SCHOOL_PAYMENT_DAYS),
+        DS160: interview - timedelta(days=DS160_DAYS),
+        INTERVIEW: interview,
+        I20: (created + timedelta(days=I20_DAYS)).where(entry.isna()),
+    }
+    parts = []
+    for kind, days in deadlines.items():
+        days = days.dropna()
+        parts.append(pd.DataFrame({'row': days.index, 'kind': kind, 'day': days.dt.date}))
+    return pd.concat(parts, ignore_index=True)
+
+
+class DeadlineIndex:
+    def __init__(self):
+        self._days = []            # sorted days that have at least one deadline
+        self._entries = {}         # day -> {(row, kind)}
+        self._row_entries = {}     # row -> [(day, kind)]
+        self._hashes = np.array([], dtype=np.uint64)
+        # One index is shared by every session of the server process
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _add(self, row, kind, day):
+        if day not in self._entries:
+            bisect.insort(self._days, day)
+            self._entries[day] = set()
+        self._entries[day].add((row, kind))
+        self._row_entries.setdefault(row, []).append((day, kind))
+
+    def _remove_row(self, row):
+        for day, kind in self._row_entries.pop(row, []):
+            entries = self._entries[day]
+            entries.discard((row, kind))
+            if not entries:
+                del self._entries[day]
+                del self._days[bisect.bisect_left(self._days, day)]
+
+    def sync(self, frame):
+        """Bring the index in line with ``frame`` (rows keyed by position);
+        returns how many rows were re-indexed."""
+        # Deadlines only depend on the dates
+        dates = pd.DataFrame({column: _dates(frame, column) for column in DATE_COLUMNS})
+        hashes = pd.util.hash_pandas_object(dates, index=False).to_numpy()
+        with self.lock:
+            common = min(len(hashes), len(self._hashes))
+            changed = np.flatnonzero(hashes[:common] != self._hashes[:common])
+            changed = np.concatenate([changed, np.arange(common, len(hashes))])
+            for row in list(changed) + list(range(len(hashes), len(self._hashes))):
+                self._remove_row(int(row))
+            if len(changed):
+                subset = frame.iloc[changed].set_axis(changed)
+                for row, kind, day in deadline_frame(subset).itertuples(index=False):
+                    self._add(int(row), kind, day)
+            self._hashes = hashes
+            return len(changed)
+
+    def between(self, start=None, end=None, kinds=None, frame=None):
+        """(day, kind, row) for deadlines with start <= day <= end, by day.
+        ``None`` leaves that side of the range open. With ``frame`` the
+        index is first synced with it under the same lock."""
+        with self.lock:
+            if frame is not None:
+                self.sync(frame)
+            low = 0 if start is None else bisect.bisect_left(self._days, _day(start))
+            high = len(self._days) if end is None else bisect.bisect_right(self._days, _day(end))
+            result = []
+            for day in self._days[low:high]:
+                for row, kind in sorted(self._entries[day]):
+                    if kinds is None or kind in kinds:
+                        result.append((day, kind, row))
+            return result
+
+    def rows_between(self, kind, start=None, end=None, frame=None):
+        """Row positions with a ``kind`` deadline in the range; with
+        ``frame``, rows of ``frame`` (synced and looked up in one step)."""
+        rows = {row for _, _, row in self.between(start, end, kinds=(kind,), frame=frame)}
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def upcoming(self, days, kinds=None, today=None):
+        today = _day(today or date.today())
+        return self.between(today, today + timedelta(days=days), kinds)
+
+    def _events(self, frame, start, end, kinds):
+        for day, kind, row in self.between(start, end, kinds, frame=frame):
+            record = frame.iloc[row]
+            name = f"{record.get('First Name', '')} {record.get('Last Name', '')}".strip()
+            yield day, kind, row, name, record.get('Agent', ''), record.get('Stage', '')
+
+    def to_json(self, frame, start=None, end=None, kinds=None):
+        events = [{'date': day.isoformat(), 'kind': kind, 'row': row, 'student': name,
+                   'agent': agent, 'stage': stage}
+                  for day, kind, row, name, agent, stage in self._events(frame, start, end, kinds)]
+        return json.dumps(events, ensure_ascii=False, default=str)
+
+    def to_ical(self, frame, start=None, end=None, kinds=None, calendar_name="Student deadlines"):
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//The Us House//CRM deadlines//EN",
+                 f"X-WR-CALNAME:{_ical_text(calendar_name)}"]
+        for day, kind, row, name, agent, stage in self._events(frame, start, end, kinds):
+            uid = f"{_ical_text(name).replace(' ', '-')}-{kind.replace(' ', '-')}-{day:%Y%m%d}@crm"
+            lines += [
+                "BEGIN:VEVENT",
+                f"UID:{uid}",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART;VALUE=DATE:{day:%Y%m%d}",
+                f"DTEND;VALUE=DATE:{day + timedelta(days=1):%Y%m%d}",
+                f"SUMMARY:{_ical_text(f'{kind}: {name}')}",
+                f"DESCRIPTION:{_ical_text(f'Agent: {agent} - Stage: {stage}')}",
+                "END:VEVENT",
+            ]
+        lines.append("END:VCALENDAR")
+        return "\r\n".join(lines) + "\r\n"
+
+
+def _day(value):
+    # pd.Timestamp is a datetime too
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _ical_text(text):
+    return (str(text).replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
@@ -0,0 +1,259 @@
+"""Optimistic-concurrency saves for sheets edited by several agents.
+
+An ``EditSession`` remembers every row as it was when the agent loaded the
+sheet, with a short hash per row as its version. Saving sends only the
+changed cells: the changed rows are re-read in one ``batch_get`` and
+compared with the remembered version. If nobody else touched the row the
+cells are written as-is; otherwise each cell is merged on its own. A cell
+only the agent changed is written, a cell both sides changed to different
+values is reported as a ``Conflict`` instead of being overwritten.
+With an ``event_log`` every cell written, row added and row deleted is
+also recorded there (``crm.event_log``), as made by ``actor``.
+"""
+import hashlib
+import re
+import sys
+from datetime import date, datetime
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from crm import tracing
+from crm.event_log import CREATED, DELETED, STAGE_FIELD, safe_record, student_name
+from crm.identity import student_key
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# Columns used to check that a row number still points at the same student
+IDENTITY_COLUMNS = ("First Name", "Last Name")
+
+FIRST_DATA_ROW = 2
+
+# Conflict.column for a row deleted here but edited by someone else
+ROW_DELETED = "(row deleted)"
+
+
+def row_version(values):
+    text = "\x1f".join(str(value) for value in values)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def cell_text(value):
+    """Text form of a value as it is written to the sheet."""
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        if pd.isna(value):
+            return ""
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, float) and pd.isna(value):
+        return ""
+    return str(value)
+
+
+class Conflict:
+    def __init__(self, row, column, base, theirs, mine):
+        self.row = row
+        self.column = column
+        self.base = base
+        self.theirs = theirs
+        self.mine = mine
+
+    def as_dict(self):
+        return {'Row': self.row, 'Column': self.column, 'Loaded': self.base,
+                'Saved by someone else': self.theirs, 'Yours': self.mine}
+
+
+class SaveResult:
+    def __init__(self):
+        self.cells_written = 0
+        self.rows_appended = 0
+        self.rows_deleted = 0
+        self.conflicts = []
+        self.moved_rows = []  # row numbers that no longer hold the same student
+
+    @property
+    def ok(self):
+        return not self.conflicts and not self.moved_rows
+
+
+class EditSession:
+    def __init__(self, worksheet, values, identity_columns=IDENTITY_COLUMNS, event_log=None, source=None,
+                 actor=None):
+        self.worksheet = worksheet
+        self.event_log = event_log
+        self.source = source
+        self.actor = actor
+        self.header = list(values[0]) if values else []
+        self._columns = {}
+        for index, column in enumerate(self.header):
+            self._columns.setdefault(column, index)
+        self._identity = [self._columns[column] for column in identity_columns if column in self._columns]
+        self.rows = {}
+        self.versions = {}
+        for offset, row in enumerate(values[1:]):
+            self._remember(FIRST_DATA_ROW + offset, row)
+
+    @classmethod
+    @tracing.traced("sheets.load_edit_session")
+    def load(cls, worksheet, **kwargs):
+        return cls(worksheet, worksheet.get_all_values(), **kwargs)
+
+    def _pad(self, row):
+        row = [cell_text(value) for value in row]
+        return row + [""] * (len(self.header) - len(row))
+
+    def _remember(self, row_number, values):
+        values = self._pad(values)
+        self.rows[row_number] = values
+        self.versions[row_number] = row_version(values)
+
+    def row_numbers(self):
+        return sorted(self.rows)
+
+    def nbytes(self, sample=100):
+        """Approximate memory held by the remembered rows, from a sample."""
+        rows = list(self.rows.values())[:sample]
+        if not rows:
+            return 0
+        per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows) / len(rows)
+        # Each row also has a 16-character version hash
+        return int(len(self.rows) * (per_row + sys.getsizeof("0" * 16)))
+
+    def frame(self):
+        """The remembered rows as a DataFrame of text, in sheet order."""
+        return pd.DataFrame([self.rows[row] for row in self.row_numbers()], columns=self.header)
+
+    def value(self, row_number, column):
+        return self.rows[row_number][self._columns[column]]
+
+    def _student(self, values):
+        # (key, name) of the student in the row, as the event log takes them
+        return (student_key(dict(zip(self.header, values))),
+                student_name(*(values[index] for index in self._identity)))
+
+    def _events(self, written, deleted, added):
+        sheet = getattr(self.worksheet, 'title', '')
+        events = [(sheet, *self._student(row), column, old, new, self.source)
+                  for row, column, old, new in written if old != new]
+        events += [(sheet, *self._student(row), DELETED, None, None, self.source) for row in deleted]
+        for row in added:
+            events.append((sheet, *self._student(row), CREATED, None, None, self.source))
+            if STAGE_FIELD in self._columns and row[self._columns[STAGE_FIELD]]:
+                events.append((sheet, *self._student(row), STAGE_FIELD, None,
+                               row[self._columns[STAGE_FIELD]], self.source))
+        return events
+
+    def _same_row(self, a, b):
+        return all(a[index] == b[index] for index in self._identity)
+
+    def _fetch(self, row_numbers):
+        last_column = rowcol_to_a1(1, max(1, len(self.header)))[:-1]
+        ranges = [f"A{row}:{last_column}{row}" for row in row_numbers]
+        fetched = self.worksheet.batch_get(ranges)
+        return {row: self._pad(values[0] if values else []) for row, values in zip(row_numbers, fetched)}
+
+    @tracing.traced("sheets.save_rows")
+    def save(self, changes, additions=(), deletions=()):
+        """Write ``changes`` ({row number: {column: value}}), append
+        ``additions`` (dicts by column) and delete ``deletions`` (row numbers)."""
+        result = SaveResult()
+        changes = {
+            row: {column: cell_text(value) for column, value in cells.items() if column in self._columns}
+            for row, cells in changes.items()
+        }
+        changes = {row: cells for row, cells in changes.items() if cells}
+        touched = sorted(set(changes) | set(deletions))
+        current = self._fetch(touched) if touched else {}
+
+        updates = []
+        written = []
+        merged_rows = {}
+        deletable = []
+        for row in touched:
+            base = self.rows.get(row)
+            theirs_row = current[row]
+            if base is None or not self._same_row(base, theirs_row):
+                result.moved_rows.append(row)
+                continue
+            untouched = row_version(theirs_row) == self.versions[row]
+            if row in deletions:
+                if untouched:
+                    deletable.append(row)
+                else:
+                    result.conflicts.append(Conflict(row, ROW_DELETED, "", "row was edited", "delete"))
+                    merged_rows[row] = theirs_row
+                continue
+            merged = list(theirs_row)
+            for column, mine in changes[row].items():
+                index = self._columns[column]
+                theirs, original = theirs_row[index], base[index]
+                if untouched or theirs == original:
+                    updates.append({'range': rowcol_to_a1(row, index + 1), 'values': [[mine]]})
+                    written.append((theirs_row, column, theirs, mine))
+                    merged[index] = mine
+                elif theirs != mine:
+                    result.conflicts.append(Conflict(row, column, original, theirs, mine))
+            merged_rows[row] = merged
+
+        if updates:
+            self.worksheet.batch_update(updates)
+            result.cells_written = len(updates)
+        # Remember what the sheet holds now, so a retry compares against it
+        for row, merged in merged_rows.items():
+            self._remember(row, merged)
+
+        deleted = []
+        if deletable:
+            # One request for every delete, so a quota error cannot leave it half done
+            self.worksheet.spreadsheet.batch_update({'requests': [
+                {'deleteDimension': {'range': {'sheetId': self.worksheet.id, 'dimension': 'ROWS',
+                                               'startIndex': first - 1, 'endIndex': last}}}
+                for first, last in _row_runs(deletable)
+            ]})
+        for row in sorted(deletable, reverse=True):
+            deleted.append(self.rows[row])
+            self._forget(row)
+            result.rows_deleted += 1
+            # Keep reported row numbers pointing at the same students
+            for conflict in result.conflicts:
+                if conflict.row > row:
+                    conflict.row -= 1
+            result.moved_rows = [moved - 1 if moved > row else moved for moved in result.moved_rows]
+
+        rows = []
+        if additions:
+            rows = [self._pad([addition.get(column, "") for column in self.header]) for addition in additions]
+            response = self.worksheet.append_rows(rows)
+            first = _first_updated_row(response) or (max(self.rows, default=FIRST_DATA_ROW - 1) + 1)
+            for offset, row in enumerate(rows):
+                self._remember(first + offset, row)
+            result.rows_appended = len(rows)
+        safe_record(self.event_log, self._events(written, deleted, rows), actor=self.actor)
+        return result
+
+    def _forget(self, row_number):
+        # Rows below a deleted row move up by one
+        del self.rows[row_number]
+        del self.versions[row_number]
+        for row in sorted(r for r in self.rows if r > row_number):
+            self.rows[row - 1] = self.rows.pop(row)
+            self.versions[row - 1] = self.versions.pop(row)
+
+
+def _row_runs(rows):
+    """(first, last) runs of consecutive row numbers, bottom run first so
+    deleting one run does not move the rows of the next."""
+    runs = []
+    for row in sorted(rows, reverse=True):
+        if runs and runs[-1][0] == row + 1:
+            runs[-1][0] = row
+        else:
+            runs.append([row, row])
+    return [tuple(run) for run in runs]
+
+
+def _first_updated_row(response):
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
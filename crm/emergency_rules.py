@@ -0,0 +1,109 @@
+"""The Emergency dashboard rules, usable without Streamlit.
+
+``evaluate`` takes the 'ALL' sheet of the emergency spreadsheet as a
+DataFrame and returns the students each rule flags. The Emergency page
+renders the results, and ``crm.alerts`` evaluates the same rules on a
+schedule. With a ``DeadlineIndex`` the date-window rules first narrow to
+the rows that have a deadline in their window.
+"""
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from crm.deadlines import INTERVIEW, SCHOOL_PAYMENT
+
+SPREADSHEET_ID = "1os1G3ri4xMmJdQSNsVSNx6VJttyM8JsPNbmH0DCFUiI"
+SHEET_NAME = "ALL"
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+DATE_COLUMNS = ['DATE', 'School Entry Date', 'EMBASSY ITW. DATE']
+# Every column the rules, the duplicate check and the dashboard read
+COLUMNS = ['First Name', 'Last Name', 'Phone N°', 'E-mail', 'DATE', 'School Entry Date', 'EMBASSY ITW. DATE',
+           'Stage', 'Agent', 'School Paid', 'Sevis payment ?', 'Visa Result']
+
+DS_160_STAGES = ['PAYMENT & MAIL', 'APPLICATION', 'SCAN & SEND', 'ARAMEX & RDV', 'DS-160', 'ITW Prep', 'CLIENTS']
+
+# Rule key -> title, as used for the dashboard cards and the alert digests
+RULES = {
+    'school_payment': "School Payment Due",
+    'ds160': "DS-160 Due",
+    'interview_prep': "Upcoming Interviews",
+    'sevis': "Need SEVIS Payment",
+    'i20': "I-20",
+    'aramex': "ARAMEX",
+    'visa_result': "Visa Result Needed",
+    'unassigned': "Unassigned Students",
+}
+
+
+def parse_dates(data):
+    """Parse the date columns in place; unparseable values become NaT."""
+    for column in DATE_COLUMNS:
+        data[column] = pd.to_datetime(data[column], format=DATE_FORMAT, errors='coerce')
+    return data
+
+
+def evaluate(data, today=None, deadlines=None):
+    """{rule key: flagged rows} for ``data`` with parsed dates.
+
+    Adds the 'School Payment Due' and 'DS-160 Due' columns to ``data``.
+    ``deadlines`` is a ``DeadlineIndex``; it is synced with ``data`` on each
+    lookup.
+    """
+    today = today or datetime.now()
+
+    def rows_with(kind, start=None, end=None):
+        # Narrow to the rows with a deadline in the day range; the rules keep their exact checks
+        if deadlines is None:
+            return data
+        return data.iloc[deadlines.rows_between(kind, start, end, frame=data)]
+
+    results = {}
+
+    # Rule 1: School payment 50 days before school entry, exclude students with Visa Denied
+    data['School Payment Due'] = data['School Entry Date'] - timedelta(days=50)
+    candidates = rows_with(SCHOOL_PAYMENT, start=today)
+    results['school_payment'] = candidates[(candidates['School Paid'] != 'Yes') & (candidates['School Payment Due'] > today) & (candidates['Visa Result'] != 'Visa Denied')].sort_values(by='DATE').reset_index(drop=True)
+
+    # Rule 2: DS-160 step within 30 days before embassy interview
+    data['DS-160 Due'] = data['EMBASSY ITW. DATE'] - timedelta(days=30)
+    candidates = rows_with(INTERVIEW, start=today, end=today + timedelta(days=30))
+    results['ds160'] = candidates[(candidates['Stage'].isin(DS_160_STAGES[:5])) & (candidates['EMBASSY ITW. DATE'] > today) & (candidates['EMBASSY ITW. DATE'] <= today + timedelta(days=30))].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
+
+    # Rule 3: Embassy interview in less than 14 days and stage is not CLIENT or SEVIS payment is NO
+    candidates = rows_with(INTERVIEW, start=today, end=today + timedelta(days=14))
+    results['interview_prep'] = candidates[(candidates['EMBASSY ITW. DATE'] > today) & (candidates['EMBASSY ITW. DATE'] <= today + timedelta(days=14)) & (candidates['Stage'] != 'CLIENT') & (candidates['Stage'] != 'CLIENTS')].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
+    results['sevis'] = candidates[(candidates['EMBASSY ITW. DATE'] > today) & (candidates['EMBASSY ITW. DATE'] <= today + timedelta(days=14)) & (candidates['Sevis payment ?'] == 'NO')].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
+
+    # Rule 4: One week after DATE and School Entry Date is still empty, exclude clients with stage 'CLIENTS'
+    results['i20'] = data[(data['DATE'] <= today - timedelta(days=14)) & (data['School Entry Date'].isna()) & (data['Stage'] != 'CLIENTS')].sort_values(by='DATE').reset_index(drop=True)
+
+    # Rule 5: Two weeks after DATE and EMBASSY ITW. DATE is still empty, exclude clients with stage 'CLIENTS'
+    results['aramex'] = data[(data['DATE'] <= today - timedelta(days=14)) & (data['EMBASSY ITW. DATE'].isna()) & (data['Stage'] != 'CLIENTS')].sort_values(by='DATE').reset_index(drop=True)
+
+    # Rule 6: EMBASSY ITW. DATE is passed today and Visa Result is empty
+    candidates = rows_with(INTERVIEW, end=today)
+    results['visa_result'] = candidates[(candidates['EMBASSY ITW. DATE'] < today) & (candidates['Visa Result'].isna())].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
+
+    # Rule 7: Unassigned students
+    results['unassigned'] = data[
+        (
+            (data['Agent'].isna()) |
+            (data['Agent'].str.strip() == '') |
+            (data['Agent'].str.lower() == 'nan')
+        ) &
+        (data['Stage'].str.strip().str.upper() != 'CLIENT') &
+        (data['Stage'].str.strip().str.upper() != 'CLIENTS')
+    ].sort_values(by='DATE').reset_index(drop=True)
+
+    return results
+
+
+def find_duplicates(df):
+    # Combine First Name and Last Name
+    df['Full Name'] = df['First Name'] + ' ' + df['Last Name']
+
+    # Find duplicates based on Full Name, Phone N°, or E-mail
+    duplicates = df[df.duplicated(subset=['Full Name', 'Phone N°', 'E-mail'], keep=False)]
+
+    # Sort the duplicates for better readability
+    return duplicates.sort_values(by=['Full Name', 'Phone N°', 'E-mail'])
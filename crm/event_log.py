@@ -0,0 +1,215 @@
+"""Append-only log of the changes saved to the student sheets.
+
+The sheet only holds each student's current values. Every cell written
+through an ``EditSession`` and every student added through the
+``StudentTable`` is recorded here as an event (who made it, which student
+and field, old and new value, when) in a local SQLite file. "Who" is the
+``actor`` the page passes in, the logged-in username. A student is keyed by
+``crm.identity.student_key`` (their phone, e-mail or name), kept apart from
+the name shown, so namesakes have their own history and a rename keeps it.
+Stage changes also maintain a table of stage spans (entered, left) and
+running per-stage totals, so time-in-stage reports read a handful of rows
+instead of replaying the log.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+DB_PATH = os.environ.get("CRM_EVENT_LOG", "crm_events.sqlite3")
+STAGE_FIELD = "Stage"
+CREATED = "(created)"
+DELETED = "(deleted)"
+# Edits to the same field closer together than this are one change in a compact timeline
+COMPACT_SECONDS = 15 * 60
+DAY_SECONDS = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    sheet TEXT NOT NULL,
+    student_key TEXT,
+    student TEXT NOT NULL,
+    field TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    source TEXT,
+    actor TEXT
+);
+CREATE INDEX IF NOT EXISTS events_field ON events (field, ts);
+CREATE TABLE IF NOT EXISTS stage_spans (
+    id INTEGER PRIMARY KEY,
+    student TEXT NOT NULL,  -- student key; the name for spans opened before events had one
+    stage TEXT NOT NULL,
+    entered REAL NOT NULL,
+    left REAL
+);
+CREATE INDEX IF NOT EXISTS stage_spans_open ON stage_spans (student, left);
+CREATE INDEX IF NOT EXISTS stage_spans_stage ON stage_spans (stage, left);
+CREATE TABLE IF NOT EXISTS stage_totals (
+    stage TEXT PRIMARY KEY,
+    completed INTEGER NOT NULL DEFAULT 0,
+    seconds REAL NOT NULL DEFAULT 0
+);
+"""
+# Created once the columns they cover exist, in logs from before those columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS events_student ON events (student, ts);
+CREATE INDEX IF NOT EXISTS events_student_key ON events (student_key, ts);
+"""
+
+EVENT_COLUMNS = ['ts', 'sheet', 'student_key', 'student', 'field', 'old', 'new', 'source', 'actor']
+
+log = logging.getLogger(__name__)
+
+
+def student_name(first, last):
+    return f"{first or ''} {last or ''}".strip()
+
+
+class EventLog:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        # Shared by the sessions of the server process, which run on different threads
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(events)")}
+        if 'actor' not in columns:
+            # Logs created before events had an actor
+            self._connection.execute("ALTER TABLE events ADD COLUMN actor TEXT")
+        if 'student_key' not in columns:
+            # Logs created before events had a student key; those rows keep it NULL
+            self._connection.execute("ALTER TABLE events ADD COLUMN student_key TEXT")
+        self._connection.executescript(INDEXES)
+        self.lock = threading.Lock()
+
+    def record(self, events, actor=None):
+        """Append ``events``: (sheet, student key, student name, field, old,
+        new, source) tuples, all made by ``actor`` and stamped with the
+        current time."""
+        if not events:
+            return 0
+        ts = time.time()
+        with self.lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany(
+                    "INSERT INTO events (ts, sheet, student_key, student, field, old, new, source, actor) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(ts, *event, actor) for event in events])
+                for sheet, key, student, field, old, new, source in events:
+                    if field == STAGE_FIELD and old != new:
+                        self._move(cursor, key, student, new, ts)
+                    elif field == DELETED:
+                        self._move(cursor, key, student, None, ts)
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+        return len(events)
+
+    def _move(self, cursor, key, student, stage, ts):
+        # Close the student's open span (keyed by name if opened before keys),
+        # add it to the totals, then open the next one
+        for span_id, previous, entered in cursor.execute(
+                "SELECT id, stage, entered FROM stage_spans WHERE student IN (?, ?) AND left IS NULL",
+                (key, student)).fetchall():
+            cursor.execute("UPDATE stage_spans SET left = ? WHERE id = ?", (ts, span_id))
+            cursor.execute(
+                "INSERT INTO stage_totals (stage, completed, seconds) VALUES (?, 1, ?) "
+                "ON CONFLICT (stage) DO UPDATE SET completed = completed + 1, seconds = seconds + excluded.seconds",
+                (previous, ts - entered))
+        if stage:
+            cursor.execute("INSERT INTO stage_spans (student, stage, entered) VALUES (?, ?, ?)",
+                           (key, stage, ts))
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return pd.read_sql_query(sql, self._connection, params=params)
+
+    def events(self, student_key=None, field=None, since=None, student=None):
+        """Events oldest first. With ``student_key`` and ``student`` (a
+        name), the student's events logged before keys are included."""
+        clauses, params = [], []
+        if student_key is not None and student is not None:
+            clauses.append("(student_key = ? OR (student_key IS NULL AND student = ?))")
+            params += [student_key, student]
+            student_key = student = None
+        for clause, value in (("student_key = ?", student_key), ("student = ?", student), ("field = ?", field),
+                              ("ts >= ?", since)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._query(f"SELECT {', '.join(EVENT_COLUMNS)} FROM events {where} ORDER BY ts, id", params)
+
+    def timeline(self, student_key, student=None, compact=True):
+        """The changes of the student keyed ``student_key`` (and named
+        ``student``, for events logged before keys), oldest first.
+        Compacted, a burst of edits to one field becomes a single old -> new
+        change and edits that end where they started are dropped."""
+        events = self.events(student_key=student_key, student=student)
+        if not compact or events.empty:
+            return events
+        events = events.sort_values(['field', 'ts'], kind='stable')
+        gap = events['ts'].diff().gt(COMPACT_SECONDS) | events['field'].ne(events['field'].shift())
+        burst = gap.cumsum()
+        compacted = events.groupby(burst).agg(
+            ts=('ts', 'last'), sheet=('sheet', 'last'), student_key=('student_key', 'last'),
+            student=('student', 'last'), field=('field', 'first'),
+            old=('old', 'first'), new=('new', 'last'), source=('source', 'last'), actor=('actor', 'last'))
+        markers = compacted['field'].isin([CREATED, DELETED])
+        compacted = compacted[markers | compacted['old'].fillna("").ne(compacted['new'].fillna(""))]
+        return compacted.sort_values('ts').reset_index(drop=True)
+
+    def stage_durations(self, now=None):
+        """Per stage: completed spans with their mean length, and students
+        currently in the stage with how long they have been there."""
+        now = now or time.time()
+        completed = self._query("SELECT stage, completed, seconds / completed / ? AS mean_days FROM stage_totals",
+                                (DAY_SECONDS,))
+        current = self._query(
+            "SELECT stage, COUNT(*) AS current, (? - AVG(entered)) / ? AS mean_days_current, "
+            "(? - MIN(entered)) / ? AS max_days_current FROM stage_spans WHERE left IS NULL GROUP BY stage",
+            (now, DAY_SECONDS, now, DAY_SECONDS))
+        table = completed.merge(current, on='stage', how='outer')
+        table = table.fillna({'completed': 0, 'current': 0}).astype({'completed': 'int64', 'current': 'int64'})
+        return table.round(1)
+
+    def stage_spans(self, stage=None):
+        where, params = ("WHERE stage = ?", (stage,)) if stage else ("", ())
+        return self._query(f"SELECT student, stage, entered, left FROM stage_spans {where} ORDER BY entered", params)
+
+    def close(self):
+        with self.lock:
+            self._connection.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_log():
+    """The process-wide log at ``DB_PATH``."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = EventLog()
+        return _default
+
+
+def safe_record(event_log, events, actor=None):
+    """Record ``events`` without letting a logging failure undo a save that
+    already reached the sheet."""
+    if event_log is None or not events:
+        return
+    try:
+        event_log.record(events, actor=actor)
+    except sqlite3.Error as e:
+        log.warning("Could not record %d event(s): %s", len(events), e)
@@ -0,0 +1,135 @@
+"""Tuition fees in one currency, and range queries over them.
+
+The catalogue quotes each programme's tuition in its own currency
+(``Tuition Currency``), so comparing raw ``Tuition Price`` values mixes
+dollars, pounds and euros. ``normalize_tuition`` adds ``tuition_usd`` and
+``tuition_cad`` columns converted with a local FX table: the built-in
+``DEFAULT_RATES``, overridden by the ``[usd_per_unit]`` table of the TOML
+file at ``FX_PATH`` when there is one. ``PriceIndex`` keeps a column sorted
+once, so a price range is two binary searches instead of a scan.
+"""
+import logging
+import os
+import tomllib
+
+import numpy as np
+import pandas as pd
+
+FX_PATH = os.environ.get("CRM_FX_RATES", "fx_rates.toml")
+
+# US dollars per unit of each currency
+DEFAULT_RATES = {
+    "USD": 1.0,
+    "CAD": 0.73,
+    "EUR": 1.08,
+    "GBP": 1.27,
+    "AUD": 0.66,
+    "NZD": 0.60,
+    "CHF": 1.12,
+    "SGD": 0.74,
+    "MYR": 0.21,
+    "TRY": 0.031,
+    "AED": 0.27,
+    "DZD": 0.0074,
+}
+
+# Symbols and spellings found in the sheet for the currency codes above
+CURRENCY_ALIASES = {
+    "$": "USD",
+    "US$": "USD",
+    "US": "USD",
+    "C$": "CAD",
+    "CA$": "CAD",
+    "CAN$": "CAD",
+    "€": "EUR",
+    "EURO": "EUR",
+    "EUROS": "EUR",
+    "£": "GBP",
+    "A$": "AUD",
+    "DA": "DZD",
+}
+
+PRICE_COLUMN = 'Tuition Price'
+CURRENCY_COLUMN = 'Tuition Currency'
+
+log = logging.getLogger(__name__)
+
+
+def load_rates(path=FX_PATH):
+    """The FX table: ``DEFAULT_RATES`` updated with the file at ``path``."""
+    rates = dict(DEFAULT_RATES)
+    try:
+        with open(path, "rb") as f:
+            configured = tomllib.load(f).get("usd_per_unit", {})
+    except FileNotFoundError:
+        return rates
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        log.warning("Could not read FX rates from %s: %s", path, e)
+        return rates
+    rates.update({code.upper(): float(rate) for code, rate in configured.items()})
+    return rates
+
+
+def currency_code(value):
+    if pd.isna(value):
+        return None
+    code = str(value).strip().upper()
+    return CURRENCY_ALIASES.get(code, code) or None
+
+
+def usd_factors(currencies, rates):
+    """US dollars per unit for each of ``currencies`` (NaN when unknown)."""
+    # A catalogue has a handful of distinct currencies; look each up once
+    codes, uniques = pd.factorize(currencies, use_na_sentinel=False)
+    factors = np.array([rates.get(currency_code(value), np.nan) for value in uniques], dtype=float)
+    return factors[codes]
+
+
+def normalize_tuition(df, rates=None):
+    """Add ``tuition_usd`` and ``tuition_cad`` to ``df``. Rows with an
+    unknown currency get NaN, so no price range matches them."""
+    rates = rates or load_rates()
+    usd = pd.to_numeric(df[PRICE_COLUMN], errors='coerce').to_numpy(dtype=float) \
+        * usd_factors(df[CURRENCY_COLUMN], rates)
+    unknown = df.loc[np.isnan(usd) & df[PRICE_COLUMN].notna().to_numpy(), CURRENCY_COLUMN].unique()
+    if len(unknown):
+        log.warning("No FX rate for tuition currencies %s", ", ".join(map(str, unknown)))
+    df['tuition_usd'] = usd
+    df['tuition_cad'] = usd / rates["CAD"]
+    return df
+
+
+class PriceIndex:
+    """The non-missing values of a column, sorted once, with the row
+    positions they come from."""
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        present = np.flatnonzero(~np.isnan(values))
+        order = np.argsort(values[present], kind='stable')
+        self.positions = present[order]
+        self.values = values[self.positions]
+        self.size = len(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def min(self):
+        return self.values[0] if len(self.values) else np.nan
+
+    @property
+    def max(self):
+        return self.values[-1] if len(self.values) else np.nan
+
+    def between(self, low, high):
+        """Row positions with ``low <= value <= high``, in price order."""
+        start = np.searchsorted(self.values, low, side='left')
+        stop = np.searchsorted(self.values, high, side='right')
+        return self.positions[start:stop]
+
+    def mask(self, low, high):
+        """A boolean array over all rows, True where the value is in range."""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.between(low, high)] = True
+        return mask
@@ -0,0 +1,38 @@
+"""Normalized keys that identify a student.
+
+The duplicate checks of ``crm.students`` and the event log
+(``crm.event_log``) both match students on these, so "+213 555 12 34 56"
+and "0555123456", or "Élise" and "elise", are the same student.
+"""
+import re
+import unicodedata
+
+
+def normalize_phone(value):
+    digits = re.sub(r'\D', '', str(value or ''))
+    # Compare on the national number so +213 5.. and 05.. match
+    return digits[-9:] if len(digits) >= 9 else digits
+
+
+def normalize_email(value):
+    return str(value or '').strip().lower()
+
+
+def normalize_name(value):
+    text = unicodedata.normalize('NFKD', str(value or ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def student_key(record):
+    """Stable key of a student row (a dict by sheet column): the phone
+    number, else the e-mail, else the name. Renames and moved rows keep the
+    key; changing the value it was taken from starts a new one."""
+    phone = normalize_phone(record.get("Phone N°"))
+    if phone:
+        return f"phone:{phone}"
+    email = normalize_email(record.get("E-mail"))
+    if email:
+        return f"e-mail:{email}"
+    name = f"{record.get('First Name') or ''} {record.get('Last Name') or ''}"
+    return f"name:{normalize_name(name)}"
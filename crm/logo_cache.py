@@ -0,0 +1,148 @@
+"""Local thumbnails of the university logos.
+
+The catalogue links each programme to a full-size logo on a third-party
+host. ``LogoCache`` downloads each logo once, with the logos missing from a
+page fetched in parallel, and shrinks it to a 50x50 WebP of a few
+kilobytes. Thumbnails are stored on disk under a hash of their URL (so a
+logo shared by many programmes is fetched once) and kept in an LRU of at
+most ``max_entries``; evicted thumbnails are deleted. Cards embed them as
+data URIs, or as ``/app/static/...`` paths when the cache directory is
+served by Streamlit's static file serving. A logo that cannot be fetched
+falls back to its original URL and is not retried for ``FAILURE_TTL``
+seconds.
+"""
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+from crm import tracing
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "crm-logos")
+LOGO_SIZE = 50
+MAX_ENTRIES = 5000
+MAX_WORKERS = 8
+TIMEOUT = 5
+FAILURE_TTL = 60 * 60
+WEBP_QUALITY = 80
+
+
+def url_key(url):
+    return hashlib.blake2b(url.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def fetch_image(url, timeout=TIMEOUT):
+    response = requests.get(url, timeout=timeout, headers={'User-Agent': "Mozilla/5.0"})
+    response.raise_for_status()
+    return response.content
+
+
+def thumbnail(content, size=LOGO_SIZE):
+    """WebP bytes of the image in ``content``, fitted into a transparent
+    ``size`` x ``size`` square."""
+    with Image.open(io.BytesIO(content)) as image:
+        image = image.convert("RGBA")
+        image.thumbnail((size, size), Image.LANCZOS)
+        square = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+        square.paste(image, ((size - image.width) // 2, (size - image.height) // 2))
+    output = io.BytesIO()
+    square.save(output, format="WEBP", quality=WEBP_QUALITY, method=6)
+    return output.getvalue()
+
+
+class LogoCache:
+    def __init__(self, directory=CACHE_DIR, max_entries=MAX_ENTRIES, static_prefix=None,
+                 max_workers=MAX_WORKERS):
+        self.directory = directory
+        self.max_entries = max_entries
+        # e.g. "app/static/logos" when ``directory`` is ./static/logos
+        self.static_prefix = static_prefix
+        self.max_workers = max_workers
+        os.makedirs(directory, exist_ok=True)
+        self._entries = OrderedDict()  # key -> data URI, least recently used first
+        self._failures = {}            # url -> time of the failed fetch
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.webp")
+
+    def _source(self, key, data):
+        if self.static_prefix:
+            return f"{self.static_prefix}/{key}.webp"
+        return "data:image/webp;base64," + base64.b64encode(data).decode("ascii")
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        try:
+            with open(self._path(key), "rb") as f:
+                source = self._source(key, f.read())
+        except OSError:
+            return None
+        self._store(key, source)
+        return source
+
+    def _store(self, key, source):
+        self._entries[key] = source
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            try:
+                os.remove(self._path(evicted))
+            except OSError:
+                pass
+
+    def _fetch(self, url):
+        try:
+            return url, thumbnail(fetch_image(url))
+        except Exception:
+            return url, None
+
+    @tracing.traced("logos.sources")
+    def sources(self, urls):
+        """{url: image source} for ``urls``, fetching the missing logos in
+        parallel. Empty URLs are skipped."""
+        now = time.time()
+        result, missing = {}, []
+        with self.lock:
+            for url in dict.fromkeys(url for url in urls if isinstance(url, str) and url.strip()):
+                source = self._lookup(url_key(url))
+                if source is not None:
+                    result[url] = source
+                elif now - self._failures.get(url, 0) < FAILURE_TTL:
+                    result[url] = url
+                else:
+                    missing.append(url)
+        if missing:
+            with tracing.span("logos.fetch", logos=len(missing)):
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                    fetched = list(executor.map(self._fetch, missing))
+            with self.lock:
+                for url, data in fetched:
+                    if data is None:
+                        self._failures[url] = now
+                        result[url] = url
+                        continue
+                    key = url_key(url)
+                    # Write then rename so a reader never sees half a file
+                    temporary = f"{self._path(key)}.{threading.get_ident()}.tmp"
+                    with open(temporary, "wb") as f:
+                        f.write(data)
+                    os.replace(temporary, self._path(key))
+                    source = self._source(key, data)
+                    self._store(key, source)
+                    result[url] = source
+        return result
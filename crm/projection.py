@@ -0,0 +1,113 @@
+"""Column-projected reads of a worksheet.
+
+Most pages use a handful of the 'ALL' sheet's columns, yet
+``get_all_records`` downloads every one of them, passwords, notes and
+addresses included. A ``ColumnStore`` fetches only the columns asked for,
+each as its own A1 range (``C2:C``) of a single ``batch_get``, and caches
+every column on its own, so a subset of columns another caller already
+read is served without a request. A frame is only ever built from columns
+of the same fetch: when any requested column is missing, older than
+``max_age`` or from another fetch, all of them are fetched again together,
+so rows inserted or deleted in between cannot shift one column against
+another. Each fetch re-reads the header row in the same request, so a
+column that was moved or inserted in the sheet drops the cache instead of
+being read from the wrong place. Values are text, as the sheet shows them.
+"""
+import logging
+import threading
+import time
+
+import pandas as pd
+from gspread.utils import rowcol_to_a1
+
+from crm import tracing
+
+MAX_AGE_SECONDS = 10 * 60
+HEADER_RANGE = '1:1'
+FIRST_DATA_ROW = 2
+
+log = logging.getLogger(__name__)
+
+
+def column_range(position):
+    """A1 range of the data cells of the 1-based column ``position``."""
+    start = rowcol_to_a1(FIRST_DATA_ROW, position)
+    return f"{start}:{start.rstrip('0123456789')}"
+
+
+class ColumnStore:
+    def __init__(self, worksheet, max_age=MAX_AGE_SECONDS):
+        self.worksheet = worksheet
+        self.max_age = max_age
+        self.header = None
+        self._columns = {}  # name -> (fetch number, fetched at, values)
+        self.fetches = 0
+        self.cells = 0
+        # One store is shared by every session of the server process
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.header = None
+            self._columns.clear()
+
+    def _positions(self):
+        positions = {}
+        for index, name in enumerate(self.header):
+            positions.setdefault(name, index + 1)
+        return positions
+
+    def _fetch(self, names, retry=True):
+        # Caller holds the lock
+        if self.header is None:
+            self.header = self.worksheet.row_values(1)
+        positions = self._positions()
+        missing = [name for name in names if name not in positions]
+        if missing:
+            log.warning("Columns not in the sheet: %s", ", ".join(missing))
+        present = [name for name in names if name in positions]
+        with tracing.span("sheets.batch_get_columns", columns=len(present)):
+            header, *columns = self.worksheet.batch_get(
+                [HEADER_RANGE] + [column_range(positions[name]) for name in present])
+        self.fetches += 1
+        header = list(header[0]) if header else []
+        if header != self.header and retry:
+            # Columns moved since the header was read; these may be the wrong ones
+            log.info("Sheet header changed, dropping %d cached columns", len(self._columns))
+            self.header = header
+            self._columns.clear()
+            # Every requested column, placed by the new header
+            return self._fetch(names, retry=False)
+        fetched_at = time.time()
+        columns = [[row[0] if row else "" for row in rows] for rows in columns]
+        # Trailing empty cells are not returned; every column of one read has the same rows
+        length = max(map(len, columns), default=0)
+        for name, values in zip(present, columns):
+            values += [""] * (length - len(values))
+            self._columns[name] = (self.fetches, fetched_at, values)
+            self.cells += len(values)
+
+    def frame(self, names):
+        """The columns ``names`` as a new DataFrame of text. Columns the sheet
+        does not have are left out."""
+        with self.lock:
+            if not self._consistent(names):
+                self._fetch(names)
+            columns = {name: self._columns[name][2] for name in names if name in self._columns}
+            if len({len(values) for values in columns.values()}) > 1:
+                raise ValueError("Columns of different lengths: %s" % sorted(columns))
+        return pd.DataFrame(columns)
+
+    def _consistent(self, names):
+        # Caller holds the lock; True when every column of the sheet among
+        # ``names`` is cached, fresh and from the same fetch
+        if self.header is None:
+            return False
+        names = [name for name in names if name in self._positions()]
+        if any(name not in self._columns for name in names):
+            return False
+        entries = [self._columns[name] for name in names]
+        now = time.time()
+        return (len({fetch for fetch, _, _ in entries}) <= 1
+                and all(now - fetched_at < self.max_age for _, fetched_at, _ in entries)
+                and len({len(values) for _, _, values in entries}) <= 1)
@@ -0,0 +1,141 @@
+"""Indexed, typed table for filter / sort / page queries.
+
+Filtering intersects precomputed value -> row-position arrays instead of
+re-scanning the frame, sorting reuses a precomputed order per column, and
+only the requested page is materialized. Positions are row numbers in
+``table.frame`` (a RangeIndex), so they double as stable row ids for
+tracking edits.
+"""
+import numpy as np
+import pandas as pd
+
+EMPTY = np.array([], dtype=np.int64)
+
+
+class IndexedTable:
+    def __init__(self, frame, index_columns, categorical=True):
+        frame = frame.reset_index(drop=True)
+        if categorical:
+            frame = frame.astype({column: 'category' for column in index_columns if column in frame.columns})
+        self.frame = frame
+        self._indexes = {}
+        for column in index_columns:
+            if column in frame.columns:
+                groups = frame.groupby(column, sort=False, observed=True).indices
+                self._indexes[column] = {value: np.asarray(positions, dtype=np.int64)
+                                         for value, positions in groups.items()}
+        self._ranks = {}
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def nbytes(self):
+        positions = sum(array.nbytes for index in self._indexes.values() for array in index.values())
+        return int(self.frame.memory_usage(deep=True).sum()) + positions + sum(
+            rank.nbytes for rank in self._ranks.values())
+
+    def options(self, column):
+        return sorted(self._indexes[column], key=str)
+
+    def filter(self, selections):
+        """Row positions matching every ``{column: [values]}`` selection.
+
+        An empty selection (or one containing "All") does not filter.
+        """
+        positions = None
+        for column, values in selections.items():
+            if not values or "All" in values:
+                continue
+            index = self._indexes[column]
+            matched = np.concatenate([index.get(value, EMPTY) for value in values])
+            positions = matched if positions is None else np.intersect1d(positions, matched, assume_unique=True)
+        if positions is None:
+            return np.arange(len(self.frame), dtype=np.int64)
+        return np.sort(positions)
+
+    def _rank(self, column):
+        # rank[position] = place of the row when the whole table is sorted
+        if column not in self._ranks:
+            order = np.argsort(self.frame[column].to_numpy(), kind='stable')
+            if self.frame[column].isna().any():
+                # Keep missing values last, like sort_values
+                missing = self.frame[column].isna().to_numpy()[order]
+                order = np.concatenate([order[~missing], order[missing]])
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            self._ranks[column] = rank
+        return self._ranks[column]
+
+    def sort(self, positions, column, ascending=True):
+        rank = self._rank(column)[positions]
+        order = np.argsort(rank if ascending else -rank, kind='stable')
+        return positions[order]
+
+    def page(self, positions, page, page_size):
+        """Materialize one page of ``positions`` (1-based page number)."""
+        start = (page - 1) * page_size
+        return self.frame.iloc[positions[start:start + page_size]]
+
+
+def page_count(total, page_size):
+    return max(1, -(-total // page_size))
+
+
+def apply_deltas(frame, edited_rows, deleted_rows=(), added_rows=()):
+    """Return a copy of ``frame`` with row-level deltas applied.
+
+    ``edited_rows`` maps row positions to ``{column: value}``.
+    """
+    frame = frame.copy()
+    for position, changes in edited_rows.items():
+        for column, value in changes.items():
+            if column not in frame.columns:
+                continue
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].astype(object)
+            try:
+                frame.at[position, column] = value
+            except (TypeError, ValueError):
+                # Edited values come back as text; widen typed columns
+                frame[column] = frame[column].astype(object)
+                frame.at[position, column] = value
+    if deleted_rows:
+        frame = frame.drop(index=list(deleted_rows))
+    if added_rows:
+        frame = pd.concat([frame, pd.DataFrame(list(added_rows))], ignore_index=True)
+    return frame
+
+
+class PendingAdds:
+    """Rows added in data editors and not saved yet.
+
+    A data editor holds its added rows in its widget state, which is reset
+    when the editor is given other data (a row deleted or edited on its page)
+    and dropped when it is not rendered (another page or filter). Rows are
+    tracked per editor instance (its key and data); rows of an instance that
+    is no longer the one shown are kept apart, so they are still saved.
+    """
+
+    def __init__(self):
+        self.kept = []
+        self.live = {}  # editor instance -> its added rows
+
+    def __len__(self):
+        return len(self.kept) + sum(len(rows) for rows in self.live.values())
+
+    def sync(self, instance, added_rows):
+        """Record the rows the editor ``instance`` shown now reports as
+        added; rows it no longer reports were removed in it."""
+        for other in [key for key in self.live if key != instance]:
+            self.kept.extend(self.live.pop(other))
+        if added_rows:
+            self.live[instance] = list(added_rows)
+        else:
+            self.live.pop(instance, None)
+
+    def discard_kept(self):
+        self.kept = []
+
+    def rows(self):
+        return self.kept + [row for rows in self.live.values() for row in rows]
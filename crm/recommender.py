@@ -0,0 +1,131 @@
+"""Programme recommendations for a student's profile.
+
+A ``Recommender`` is built once per catalogue snapshot. The subject text of
+each programme (field, major and speciality) is reduced to the distinct
+subjects of the catalogue, and each subject is vectorized as TF-IDF
+weighted character trigrams (``crm.taxonomy.TrigramIndex``), so "Computer
+Sci." still matches "Computer Science". Scoring a student is then a few
+posting lists for their ``Specialite``, one lookup from subjects to
+programmes, and vectorized budget and level terms over the catalogue's
+arrays, followed by a partial sort for the top ``k``.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from crm.taxonomy import TrigramIndex, words
+
+SUBJECT_COLUMNS = ['Field', 'Major', 'Adjusted Speciality', 'Speciality']
+RESULT_COLUMNS = ['University Name', 'Speciality', 'Level', 'Country', 'City',
+                  'Tuition Price', 'Tuition Currency', 'tuition_cad', 'score']
+TOP_K = 20
+SUBJECT_WEIGHT = 0.6
+BUDGET_WEIGHT = 0.25
+LEVEL_WEIGHT = 0.15
+
+# ``Specialite`` is often written in French
+SUBJECT_SYNONYMS = {
+    "informatique": "computer science information technology",
+    "gestion": "business management",
+    "commerce": "business",
+    "comptabilite": "accounting finance",
+    "infirmier": "nursing",
+    "infirmiere": "nursing",
+    "medecine": "medicine health",
+    "pharmacie": "pharmacy",
+    "genie": "engineering",
+    "anglais": "english",
+    "langue": "language",
+}
+
+
+def expand_synonyms(text):
+    return " ".join(SUBJECT_SYNONYMS.get(word, word) for word in words(text))
+
+
+def _normalized(values):
+    return pd.Series(values).fillna("").astype(str).str.strip().str.casefold().to_numpy(dtype=object)
+
+
+class Recommender:
+    def __init__(self, frame, version=None):
+        self.frame = frame
+        self.version = version or frame.attrs.get('version')
+        columns = [column for column in SUBJECT_COLUMNS if column in frame.columns]
+        subject = frame[columns].fillna("").astype(str)
+        # Programme -> subject; a catalogue has far fewer subjects than programmes
+        self.subject_of = subject.groupby(columns, sort=False).ngroup().to_numpy()
+        subjects = subject.drop_duplicates().agg(" ".join, axis=1)
+        self.index = TrigramIndex(subjects)
+        self.levels = _normalized(frame['Level'])
+        self.countries = _normalized(frame['Country'])
+        self.tuition = frame['tuition_cad'].to_numpy(dtype=float)
+
+    def subject_scores(self, text):
+        """Cosine similarity of ``text`` to every subject of the catalogue."""
+        return self.index.scores(expand_synonyms(text))
+
+    def scores(self, specialite="", budget=None, level=None):
+        """A score in [0, 1] for every programme of the catalogue."""
+        score = SUBJECT_WEIGHT * self.subject_scores(specialite or "")[self.subject_of]
+        if budget:
+            # Full marks within budget, falling to nothing at twice the budget
+            affordability = np.clip(2 - self.tuition / budget, 0, 1)
+            score += BUDGET_WEIGHT * np.nan_to_num(affordability)
+        if level:
+            score += LEVEL_WEIGHT * (self.levels == level.strip().casefold())
+        return score
+
+    def recommend(self, specialite="", budget=None, level=None, country=None, k=TOP_K):
+        """The ``k`` best programmes as rows of the catalogue, best first,
+        cheaper first among equal scores. ``country`` restricts the search."""
+        score = self.scores(specialite, budget, level)
+        candidates = np.arange(len(score))
+        if country:
+            candidates = np.flatnonzero(self.countries == country.strip().casefold())
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+        tuition = np.nan_to_num(self.tuition[candidates], nan=np.inf)
+        candidates = candidates[np.lexsort((tuition, -score[candidates]))]
+        result = self.frame.iloc[candidates].assign(score=score[candidates].round(3))
+        return result[[column for column in RESULT_COLUMNS if column in result.columns]]
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def recommender_for(snapshot):
+    """The ``Recommender`` of a ``crm.catalogue.Snapshot``, rebuilt when a
+    newer snapshot is passed in."""
+    global _recommender
+    with _recommender_lock:
+        if _recommender is None or _recommender.version != snapshot.version:
+            _recommender = Recommender(snapshot.frame, snapshot.version)
+        return _recommender
+
+
+def render_recommendations(recommender, student, key="recommend"):
+    """Profile inputs seeded from ``student`` (a Students row) and the
+    programmes recommended for them."""
+    import streamlit as st
+
+    levels = ["Any"] + sorted(pd.unique(recommender.frame['Level'].dropna()).tolist())
+    countries = ["Any"] + sorted(pd.unique(recommender.frame['Country'].dropna()).tolist())
+    specialite_col, budget_col, level_col, country_col = st.columns(4)
+    with specialite_col:
+        specialite = st.text_input("Specialite", str(student.get('Specialite', '') or ''), key=f"{key}_specialite")
+    with budget_col:
+        budget = st.number_input("Budget (CAD / year, 0 = any)", min_value=0, value=0, step=1000,
+                                 key=f"{key}_budget")
+    with level_col:
+        level = st.selectbox("Target level", levels, key=f"{key}_level")
+    with country_col:
+        country = st.selectbox("Country", countries, key=f"{key}_country")
+    results = recommender.recommend(specialite, budget or None,
+                                    None if level == "Any" else level,
+                                    None if country == "Any" else country)
+    st.dataframe(results.round({'tuition_cad': 0}), hide_index=True, use_container_width=True,
+                 column_config={'tuition_cad': "Tuition (CAD)", 'score': "Match"})
+    st.markdown("[🔎 Search the full catalogue](/universities)")
@@ -0,0 +1,271 @@
+"""Per-session state with a memory budget, and tables shared between sessions.
+
+Every browser tab is a session with its own ``st.session_state``, so a
+frame kept there is paid for once per open tab. Two things keep that in
+check:
+
+* ``SharedTables`` holds immutable tables (the universities catalogue, for
+  instance) once per process. Sessions keep only a reference or, for a
+  filtered subset, a ``View``: the table's version and an array of row
+  positions, a few bytes per row instead of a copy of the rows.
+* ``SessionState`` is the per-session store for everything else. Each
+  entry is sized when it is stored. When a session goes over its budget
+  (``BUDGET_MB``), its least recently used entries are evicted.
+  Entries stored with a ``loader`` are rebuilt by it on their next
+  access. Pinned entries (unsaved work, say) are counted but never evicted.
+
+Hits, misses, evictions and sizes are kept per session and across the
+process (``memory_report``), and shown to admins by ``render_panel``.
+"""
+import logging
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from crm import tracing
+
+BUDGET_MB = float(os.environ.get("CRM_SESSION_BUDGET_MB", "256"))
+SESSION_KEY = "_crm_session_state"
+
+log = logging.getLogger(__name__)
+
+
+def size_of(value):
+    """Approximate bytes held by ``value``. Objects can report their own
+    size with an ``nbytes`` attribute or method."""
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, View):
+        return value.rows.nbytes
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes() if callable(nbytes) else nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(k) + size_of(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class View:
+    """Rows of a shared table, by position, for one version of it."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def of(self, frame):
+        return frame.iloc[self.rows]
+
+
+class SharedTables:
+    """Immutable tables kept once per process, latest version per key."""
+
+    def __init__(self):
+        self._tables = {}  # key -> (version, table, bytes)
+        self.lock = threading.Lock()
+
+    def publish(self, key, table, version):
+        with self.lock:
+            current = self._tables.get(key)
+            if current is not None and current[0] == version:
+                return current[1]
+            self._tables[key] = (version, table, size_of(table))
+            return table
+
+    def get(self, key, version=None):
+        with self.lock:
+            current = self._tables.get(key)
+        if current is None or (version is not None and current[0] != version):
+            return None
+        return current[1]
+
+    def report(self):
+        with self.lock:
+            return [{'table': str(key), 'version': version, 'bytes': nbytes}
+                    for key, (version, _, nbytes) in self._tables.items()]
+
+
+class _Entry:
+    __slots__ = ('value', 'nbytes', 'loader', 'pinned')
+
+    def __init__(self, value, nbytes, loader, pinned):
+        self.value = value
+        self.nbytes = nbytes
+        self.loader = loader
+        self.pinned = pinned
+
+
+class SessionState:
+    def __init__(self, budget_mb=BUDGET_MB):
+        self.budget = int(budget_mb * 2 ** 20)
+        self._entries = OrderedDict()  # name -> _Entry, least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def put(self, name, value, loader=None, pinned=False, nbytes=None):
+        """Store ``value`` as ``name`` and evict other entries if that puts
+        the session over its budget. Returns ``value``."""
+        nbytes = size_of(value) if nbytes is None else nbytes
+        with self.lock:
+            self._remove(name)
+            self._entries[name] = _Entry(value, nbytes, loader, pinned)
+            self.nbytes += nbytes
+            self._enforce(keep=name)
+        return value
+
+    def get(self, name, loader=None, default=None):
+        """The value of ``name``. A missing or evicted entry is rebuilt with
+        ``loader`` (or the loader it was stored with) when there is one."""
+        with self.lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.value is not None:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+            loader = loader or (entry.loader if entry is not None else None)
+            pinned = entry.pinned if entry is not None else False
+        if loader is None:
+            return default
+        with tracing.span("session_state.reload", entry=name):
+            value = loader()
+        return self.put(name, value, loader=loader, pinned=pinned)
+
+    def pop(self, name, default=None):
+        with self.lock:
+            entry = self._remove(name)
+        return default if entry is None else entry.value
+
+    def put_view(self, name, version, rows):
+        return self.put(name, View(version, rows))
+
+    def view(self, name, version):
+        """The rows stored as ``name`` if they were taken from ``version``
+        of their table, else None."""
+        value = self.get(name)
+        if isinstance(value, View) and value.version == version:
+            return value
+        return None
+
+    def resize(self, name):
+        """Size ``name`` again after it was modified in place."""
+        with self.lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.value is None:
+                return
+            nbytes = size_of(entry.value)
+            self.nbytes += nbytes - entry.nbytes
+            entry.nbytes = nbytes
+            self._enforce(keep=name)
+
+    def _remove(self, name):
+        # Caller holds the lock
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+        return entry
+
+    def _enforce(self, keep):
+        # Caller holds the lock; least recently used first, never pinned entries
+        for name in list(self._entries):
+            if self.nbytes <= self.budget:
+                break
+            entry = self._entries[name]
+            if name == keep or entry.pinned or entry.value is None:
+                continue
+            log.info("Evicting %s (%.1f MB) from a session over its %.0f MB budget",
+                     name, entry.nbytes / 2 ** 20, self.budget / 2 ** 20)
+            self.nbytes -= entry.nbytes
+            self.evictions += 1
+            self.evicted_bytes += entry.nbytes
+            if entry.loader is not None:
+                # Keep the loader so the next get() rebuilds it
+                entry.value, entry.nbytes = None, 0
+            else:
+                del self._entries[name]
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'entries': sum(1 for entry in self._entries.values() if entry.value is not None),
+                'bytes': self.nbytes,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+    def sizes(self):
+        with self.lock:
+            return {name: entry.nbytes for name, entry in self._entries.items() if entry.value is not None}
+
+
+_shared = SharedTables()
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+
+
+def shared_tables():
+    return _shared
+
+
+def session_state():
+    """This session's ``SessionState``, created on first use."""
+    import streamlit as st
+
+    state = st.session_state.get(SESSION_KEY)
+    if state is None:
+        state = st.session_state[SESSION_KEY] = SessionState()
+        with _sessions_lock:
+            _sessions.add(state)
+    return state
+
+
+def memory_report():
+    """(per-session metrics, shared tables) of the whole process, as frames."""
+    with _sessions_lock:
+        sessions = list(_sessions)
+    per_session = pd.DataFrame([state.metrics() for state in sessions],
+                               columns=['entries', 'bytes', 'budget', 'hits', 'misses',
+                                        'evictions', 'evicted_bytes'])
+    return per_session, pd.DataFrame(_shared.report(), columns=['table', 'version', 'bytes'])
+
+
+def render_panel():
+    """Admin panel with this session's entries and the process totals."""
+    import streamlit as st
+
+    megabytes = 2 ** 20
+    with st.expander("🧠 Session memory", expanded=False):
+        sessions, tables = memory_report()
+        total_col, sessions_col, shared_col, evictions_col = st.columns(4)
+        total_col.metric("Session state", f"{sessions['bytes'].sum() / megabytes:.1f} MB")
+        sessions_col.metric("Sessions", len(sessions))
+        shared_col.metric("Shared tables", f"{tables['bytes'].sum() / megabytes:.1f} MB")
+        evictions_col.metric("Evictions", int(sessions['evictions'].sum()))
+        sizes = pd.Series(session_state().sizes(), name='bytes', dtype='int64')
+        st.markdown("**This session**")
+        st.dataframe((sizes / megabytes).round(2).rename("MB").to_frame(), use_container_width=True)
+        st.markdown("**Shared tables**")
+        st.dataframe(tables.assign(MB=(tables['bytes'] / megabytes).round(1)).drop(columns='bytes'),
+                     hide_index=True, use_container_width=True)
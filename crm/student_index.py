@@ -0,0 +1,123 @@
+"""Name and filter lookups over the loaded students, without copying rows.
+
+The Students page loads every worksheet into one frame. ``StudentIndex`` is
+built once per load: a hash index from each ``Student Name`` to its row
+position and, for each filter column, value -> row-position arrays (as in
+``crm.query_table``). A filter bar selection is then a cached ``View`` of
+row positions, keyed by the selected values, and selecting a student is one
+dict lookup and one ``iloc``. Rows patched in place after a save are
+re-indexed with ``update``, which drops the cached views.
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+from crm.session_state import View
+
+FILTER_COLUMNS = ['Stage', 'Agent', 'Chosen School', 'Attempts']
+NAME_COLUMN = 'Student Name'
+ALL = "All"
+MAX_VIEWS = 64
+
+EMPTY = np.array([], dtype=np.int64)
+
+
+class StudentIndex:
+    def __init__(self, frame, filter_columns=FILTER_COLUMNS):
+        # Not copied: saves patch ``frame`` in place and call update()
+        self.frame = frame
+        self.version = 0
+        self.names = frame[NAME_COLUMN].astype(str).to_numpy(dtype=object)
+        self._positions = {}
+        for position, name in enumerate(self.names):
+            # Same row as the first match of a scan
+            self._positions.setdefault(name, position)
+        self._values = {}
+        self._indexes = {}
+        for column in filter_columns:
+            if column in frame.columns:
+                self._values[column] = frame[column].to_numpy(dtype=object)
+                groups = frame.groupby(column, sort=False).indices
+                self._indexes[column] = {value: np.asarray(positions, dtype=np.int64)
+                                         for value, positions in groups.items()}
+        self._views = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    @property
+    def nbytes(self):
+        positions = sum(array.nbytes for index in self._indexes.values() for array in index.values())
+        views = sum(view.rows.nbytes for view in self._views.values())
+        values = sum(array.nbytes for array in self._values.values())
+        return positions + views + values + self.names.nbytes + sys.getsizeof(self._positions)
+
+    def options(self, column):
+        """Values of ``column`` in order of first appearance."""
+        return list(self._indexes.get(column, {}))
+
+    def view(self, selections):
+        """The ``View`` of rows matching every ``{column: value}`` selection,
+        "All" matching anything. Positions are in frame order."""
+        key = tuple((column, value) for column, value in selections.items()
+                    if value != ALL and column in self._indexes)
+        view = self._views.get(key)
+        if view is None:
+            rows = None
+            for column, value in key:
+                matched = self._indexes[column].get(value, EMPTY)
+                rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+            if rows is None:
+                rows = np.arange(len(self.names), dtype=np.int64)
+            if len(self._views) >= MAX_VIEWS:
+                self._views.pop(next(iter(self._views)))
+            view = self._views[key] = View(self.version, rows)
+        return view
+
+    def names_of(self, view):
+        return self.names[view.rows].tolist()
+
+    def position(self, name):
+        return self._positions.get(name)
+
+    def locate(self, name, view):
+        """Place of ``name`` among the rows of ``view``, or None."""
+        position = self._positions.get(name)
+        if position is None:
+            return None
+        place = int(np.searchsorted(view.rows, position))
+        return place if place < len(view.rows) and view.rows[place] == position else None
+
+    def row(self, name):
+        """The frame row of ``name`` as a Series, or None."""
+        position = self._positions.get(name)
+        return None if position is None else self.frame.iloc[position]
+
+    def update(self, positions):
+        """Re-index rows whose filter values were changed in place."""
+        changed = False
+        for column, values in self._values.items():
+            index = self._indexes[column]
+            for position in positions:
+                old, new = values[position], self.frame[column].iat[position]
+                if pd.isna(old) or pd.isna(new):
+                    if pd.isna(old) and pd.isna(new):
+                        continue
+                elif old == new:
+                    continue
+                if not pd.isna(old) and old in index:
+                    index[old] = index[old][index[old] != position]
+                    if not len(index[old]):
+                        del index[old]
+                if not pd.isna(new):
+                    rows = index.get(new, EMPTY)
+                    index[new] = np.insert(rows, np.searchsorted(rows, position), position)
+                values[position] = new
+                changed = True
+        if changed:
+            self.version += 1
+            self._views.clear()
@@ -0,0 +1,215 @@
+"""Shared in-memory copy of the students 'ALL' worksheet.
+
+One ``StudentTable`` is kept per server process (``st.cache_resource``) and
+shared by every session. It holds the worksheet handle, the rows and hash
+indexes on phone, e-mail and name, so new students can be checked for
+duplicates in O(1), appended with a single API call and patched into the
+table without refetching the sheet. Added students are recorded in the
+event log (``crm.event_log``).
+"""
+import re
+import threading
+import time
+
+import gspread
+import pandas as pd
+import streamlit as st
+from google.oauth2.service_account import Credentials
+
+from crm import tracing
+from crm.event_log import CREATED, STAGE_FIELD, default_log, safe_record, student_name
+from crm.identity import normalize_email, normalize_name, normalize_phone, student_key
+
+SPREADSHEET_ID = "1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew"
+SHEET_NAME = "ALL"
+SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
+
+# Reload from the sheet at most this often to pick up edits made elsewhere
+MAX_AGE_SECONDS = 10 * 60
+# Before a duplicate check that guards a write, so students added from
+# another process or straight in the sheet are seen
+DUPLICATE_CHECK_MAX_AGE_SECONDS = 5
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+PHONE_PATTERN = re.compile(r'^\+?[0-9]+$')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Values every new student starts with
+STUDENT_DEFAULTS = {
+    "BANK": "",
+    "Sevis payment ?": "NO",
+    "Application payment ?": "NO",
+    "DS-160 maker": "",
+    "Password DS-160": "",
+    "Secret Q.": "",
+    "School Entry Date": "",
+    "Entry Date in the US": "",
+    "ADDRESS in the U.S": "",
+    "E-MAIL RDV": "",
+    "PASSWORD RDV": "",
+    "EMBASSY ITW. DATE": "",
+    "Attempts": "1st Try",
+    "Visa Result": "",
+    "Prep ITW": "NO",
+    "School Paid": "NO",
+    "Note": "",
+    "Stage": "PAYMENT & MAIL",
+}
+
+
+def new_student_record(fields):
+    """Fill in the defaults and derived columns for a new student."""
+    record = dict(STUDENT_DEFAULTS)
+    record.update(fields)
+    record["Student Name"] = f"{record.get('First Name', '')} {record.get('Last Name', '')}".strip()
+    return record
+
+
+def validate_student(record):
+    """Return a list of problems with ``record``; empty when it can be saved."""
+    errors = []
+    if not str(record.get("First Name", "")).strip():
+        errors.append("First name is required")
+    if not str(record.get("Last Name", "")).strip():
+        errors.append("Last name is required")
+    for column in ["Phone N°", "Emergency contact N°"]:
+        value = str(record.get(column, "")).replace(" ", "")
+        if value and not PHONE_PATTERN.match(value):
+            errors.append(f"{column} should only contain digits, and optionally start with a '+'")
+    email = str(record.get("E-mail", "")).strip()
+    if email and not EMAIL_PATTERN.match(email):
+        errors.append("E-mail is not a valid address")
+    return errors
+
+
+class DuplicateStudentError(Exception):
+    def __init__(self, field, row):
+        self.field = field
+        self.row = row
+        super().__init__(f"A student with the same {field} already exists: {row.get('Student Name', '')}")
+
+
+class StudentTable:
+    _KEYS = [
+        ('phone', "Phone N°", normalize_phone),
+        ('e-mail', "E-mail", normalize_email),
+        ('name', "Student Name", normalize_name),
+    ]
+
+    def __init__(self, worksheet, event_log=None):
+        self.worksheet = worksheet
+        self.event_log = event_log
+        self.lock = threading.RLock()
+        self.version = 0
+        self._frame = None
+        self._frame_version = -1
+        self.reload()
+
+    @tracing.traced("sheets.load_students")
+    def reload(self):
+        with self.lock:
+            values = self.worksheet.get_all_values()
+            self.header = values[0] if values else []
+            self.rows = [self._pad(row) for row in values[1:]]
+            self._indexes = {key: {} for key, _, _ in self._KEYS}
+            for position, row in enumerate(self.rows):
+                self._index_row(position, row)
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def refresh_if_stale(self, max_age=MAX_AGE_SECONDS):
+        with self.lock:
+            if time.time() - self.loaded_at > max_age:
+                self.reload()
+
+    def _pad(self, row):
+        return list(row) + [''] * (len(self.header) - len(row))
+
+    def _values(self, row):
+        record = dict(zip(self.header, row))
+        if not record.get("Student Name"):
+            record["Student Name"] = f"{record.get('First Name', '')} {record.get('Last Name', '')}".strip()
+        return record
+
+    def _index_row(self, position, row):
+        record = self._values(row)
+        for key, column, normalize in self._KEYS:
+            value = normalize(record.get(column))
+            if value:
+                self._indexes[key].setdefault(value, position)
+
+    def find_duplicate(self, record):
+        """Return (field, existing row) for the first matching key, else None."""
+        with self.lock:
+            for key, column, normalize in self._KEYS:
+                value = normalize(record.get(column))
+                if value and value in self._indexes[key]:
+                    return key, self._values(self.rows[self._indexes[key][value]])
+        return None
+
+    def to_row(self, record):
+        # Order values by the sheet header rather than by dict order
+        return [record.get(column, "") for column in self.header]
+
+    def _record_created(self, rows, source, actor):
+        events = []
+        for row in rows:
+            record = dict(zip(self.header, row))
+            student = (student_key(record), student_name(record.get("First Name"), record.get("Last Name")))
+            events.append((self.worksheet.title, *student, CREATED, None, None, source))
+            if record.get(STAGE_FIELD):
+                events.append((self.worksheet.title, *student, STAGE_FIELD, None, record[STAGE_FIELD], source))
+        safe_record(self.event_log, events, actor=actor)
+
+    @tracing.traced("sheets.append_student")
+    def append(self, record, allow_duplicate=False, source="New Student", actor=None):
+        with self.lock:
+            if not allow_duplicate:
+                self.refresh_if_stale(DUPLICATE_CHECK_MAX_AGE_SECONDS)
+                duplicate = self.find_duplicate(record)
+                if duplicate:
+                    raise DuplicateStudentError(*duplicate)
+            row = self.to_row(record)
+            # RAW: stored as typed, so phone numbers keep their leading zero and "+"
+            self.worksheet.append_row(row, value_input_option='RAW')
+            self._add_rows([row])
+            self._record_created([row], source, actor)
+            return len(self.rows) - 1
+
+    @tracing.traced("sheets.append_students")
+    def append_many(self, records, source="Bulk import", actor=None):
+        """Append already validated and deduplicated records in one call."""
+        if not records:
+            return 0
+        with self.lock:
+            rows = [self.to_row(record) for record in records]
+            self.worksheet.append_rows(rows, value_input_option='RAW')
+            self._add_rows(rows)
+            self._record_created(rows, source, actor)
+            return len(rows)
+
+    def _add_rows(self, rows):
+        for row in rows:
+            self.rows.append(row)
+            self._index_row(len(self.rows) - 1, row)
+        self.version += 1
+
+    def tail(self, n=5):
+        with self.lock:
+            return pd.DataFrame(self.rows[-n:], columns=self.header)
+
+    def frame(self):
+        # Materialized lazily and reused until the table changes
+        with self.lock:
+            if self._frame_version != self.version:
+                self._frame = pd.DataFrame(self.rows, columns=self.header)
+                self._frame_version = self.version
+            return self._frame
+
+
+@st.cache_resource
+def get_student_table():
+    creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=SCOPES)
+    client = gspread.authorize(creds)
+    worksheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
+    return StudentTable(worksheet, event_log=default_log())
@@ -0,0 +1,344 @@
+"""The field and major taxonomy, and a persisted specialty -> (field, major) store.
+
+``FIELDS_AND_MAJORS`` is the taxonomy both the catalogue and the Gemini
+prompt in ``convert.py`` classify into. A ``TaxonomyStore`` remembers every
+specialty it has classified in a local SQLite file, keyed by its
+normalized text (case, accents and punctuation folded). ``resolve`` then
+classifies a batch in three steps and stops as soon as one answers:
+
+1. a hash lookup of the normalized specialty;
+2. the nearest known specialty by cosine of TF-IDF character trigrams,
+   accepted above ``NEIGHBOUR_THRESHOLD``;
+3. the ``classify`` callable (the LLM), called only for what is left.
+
+Answers from steps 2 and 3 are stored, so a specialty the LLM has
+classified never reaches it again. The catalogue loader uses the first two
+steps only, to fill the rows left unclassified.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+STORE_PATH = os.environ.get("CRM_TAXONOMY", "crm_taxonomy.sqlite3")
+UNCLASSIFIED = "Unclassified"
+NEIGHBOUR_THRESHOLD = 0.8
+MAX_WORKERS = 5
+
+# Where each answer came from
+SEED = "taxonomy"
+LEARNED = "catalogue"
+EXACT = "lookup"
+NEIGHBOUR = "neighbour"
+LLM = "llm"
+
+FIELDS_AND_MAJORS = {
+    "Computer Science and Information Technology": [
+        "Computer Science Fundamentals", "Software Engineering",
+        "Artificial Intelligence and Machine Learning", "Data Science and Analytics",
+        "Cybersecurity", "Information Systems and Management", "Networking and Telecommunications",
+        "Web Development and Internet Technologies", "Human-Computer Interaction",
+        "Database Systems and Big Data", "Information Systems"
+    ],
+    "Business and Management": [
+        "Business Administration", "Marketing", "Finance and Accounting",
+        "Human Resource Management", "Entrepreneurship", "Operations Management",
+        "International Business", "Supply Chain Management", "Economics", "Strategic Management",
+        "Management", "Digital Marketing"
+    ],
+    "Engineering and Technology": [
+        "Mechanical Engineering", "Electrical Engineering", "Civil Engineering",
+        "Chemical Engineering", "Aerospace Engineering", "Biomedical Engineering",
+        "Environmental Engineering", "Industrial Engineering",
+        "Materials Science and Engineering", "Robotics and Automation", "General Engineering"
+    ],
+    "Natural Sciences": [
+        "Physics", "Chemistry", "Biology", "Earth Sciences (Geology, Meteorology)",
+        "Environmental Science", "Astronomy and Astrophysics", "Mathematics",
+        "Statistics", "Ecology and Evolution", "Oceanography"
+    ],
+    "Social Sciences": [
+        "Psychology", "Sociology", "Anthropology", "Political Science",
+        "Economics", "Geography", "Criminology and Criminal Justice",
+        "Linguistics", "International Relations", "Gender Studies"
+    ],
+    "Arts and Humanities": [
+        "History", "Philosophy", "Literature", "Languages and Linguistics",
+        "Art History", "Religious Studies", "Cultural Studies", "Music",
+        "Theatre and Performing Arts", "Visual Arts (Painting, Sculpture)"
+    ],
+    "Health and Medicine": [
+        "Medicine and Surgery", "Nursing", "Pharmacy", "Public Health",
+        "Dentistry", "Veterinary Science", "Biomedical Sciences",
+        "Nutrition and Dietetics", "Physical Therapy", "Occupational Therapy",
+        "Health Sciences"
+    ],
+    "Education": [
+        "Early Childhood Education", "Primary Education", "Secondary Education",
+        "Special Education", "Higher Education", "Educational Technology",
+        "Curriculum and Instruction", "Educational Psychology",
+        "Adult Education", "Physical Education"
+    ],
+    "Law and Legal Studies": [
+        "Law", "International Law", "Corporate Law", "Criminal Law",
+        "Environmental Law", "Intellectual Property Law", "Human Rights Law",
+        "Tax Law", "Family Law", "Labor and Employment Law"
+    ],
+    "Miscellaneous and Emerging Fields": [
+        "Environmental Sustainability", "Sports Management",
+        "Media and Communication Studies", "Journalism",
+        "Library and Information Science", "Urban Planning",
+        "Fashion Design", "Culinary Arts", "Hospitality Management",
+        "Ethics and Social Responsibility", "Digital Media"
+    ],
+    "English and ESL": [
+        "English Language Studies", "ESL (English as a Second Language)"
+    ],
+    "Tourism and Hospitality": [
+        "Tourism Management", "Hospitality Management"
+    ],
+    "Foundation Year": [
+        "Foundation Studies", "Pathway Programs"
+    ]
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mappings (
+    key TEXT PRIMARY KEY,
+    specialty TEXT NOT NULL,
+    field TEXT NOT NULL,
+    major TEXT NOT NULL,
+    source TEXT NOT NULL,
+    score REAL,
+    updated REAL NOT NULL
+);
+"""
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+log = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """``text`` casefolded, without accents and with runs of punctuation
+    and spaces collapsed to one space."""
+    text = unicodedata.normalize("NFKD", str(text).casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def words(text):
+    return normalize(text).split()
+
+
+def trigrams(text):
+    """Character trigrams of each word of ``text``, padded at the edges."""
+    grams = []
+    for word in words(text):
+        padded = f" {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def is_valid(field, major, taxonomy=FIELDS_AND_MAJORS):
+    return field in taxonomy and major in taxonomy[field]
+
+
+class TrigramIndex:
+    """Cosine similarity of TF-IDF character trigrams, as an inverted index
+    from trigram to (document ids, weights)."""
+
+    def __init__(self, texts):
+        counts = [Counter(trigrams(text)) for text in texts]
+        frequency = Counter(gram for count in counts for gram in count)
+        total = len(counts)
+        self.idf = {gram: np.log((1 + total) / (1 + df)) + 1 for gram, df in frequency.items()}
+        postings = defaultdict(lambda: ([], []))
+        for document, count in enumerate(counts):
+            for gram, weight in self._weights(count).items():
+                postings[gram][0].append(document)
+                postings[gram][1].append(weight)
+        self.postings = {gram: (np.array(ids, dtype=np.int64), np.array(weights))
+                         for gram, (ids, weights) in postings.items()}
+        self.size = total
+
+    def _weights(self, count):
+        weights = {gram: n * self.idf[gram] for gram, n in count.items() if gram in self.idf}
+        norm = np.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        return {gram: weight / norm for gram, weight in weights.items()}
+
+    def scores(self, text):
+        """Similarity of ``text`` to every document."""
+        scores = np.zeros(self.size)
+        for gram, weight in self._weights(Counter(trigrams(text))).items():
+            ids, document_weights = self.postings[gram]
+            scores[ids] += weight * document_weights
+        return scores
+
+
+class TaxonomyStore:
+    def __init__(self, path=STORE_PATH, taxonomy=FIELDS_AND_MAJORS):
+        self.path = path
+        self.taxonomy = taxonomy
+        # Shared by the sessions of the server process, which run on different threads
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self.lock = threading.RLock()
+        self._mappings = {}   # normalized specialty -> (field, major)
+        self._index = None    # TrigramIndex over the keys of _mappings, rebuilt after additions
+        self._keys = []
+        for key, field, major in self._connection.execute("SELECT key, field, major FROM mappings"):
+            self._mappings[key] = (field, major)
+        self.sources = Counter()  # answers given per source since creation
+        self._seed()
+
+    def __len__(self):
+        return len(self._mappings)
+
+    def _seed(self):
+        # Each major is its own best answer
+        self.add_many([(major, field, major) for field, majors in self.taxonomy.items() for major in majors],
+                      SEED, replace=False)
+
+    def add_many(self, mappings, source, scores=None, replace=True):
+        """Store (specialty, field, major) triples. Pairs outside the
+        taxonomy are ignored. Returns how many were stored."""
+        now = time.time()
+        rows = []
+        for position, (specialty, field, major) in enumerate(mappings):
+            key = normalize(specialty)
+            if not key or not is_valid(field, major, self.taxonomy):
+                continue
+            rows.append((key, str(specialty), field, major, source,
+                         scores[position] if scores is not None else None, now))
+        if not rows:
+            return 0
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self.lock:
+            self._connection.executemany(
+                f"{verb} INTO mappings (key, specialty, field, major, source, score, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            for key, _, field, major, *_ in rows:
+                if replace or key not in self._mappings:
+                    self._mappings[key] = (field, major)
+            self._index = None
+        return len(rows)
+
+    def add(self, specialty, field, major, source=LLM, score=None):
+        return self.add_many([(specialty, field, major)], source, [score]) == 1
+
+    def learn(self, frame, specialty_column='Adjusted Speciality'):
+        """Store the classified rows of a catalogue frame, keeping answers
+        already in the store."""
+        classified = frame.loc[frame['Field'].ne(UNCLASSIFIED) & frame['Field'].notna(),
+                               [specialty_column, 'Field', 'Major']].drop_duplicates(specialty_column)
+        return self.add_many(classified.itertuples(index=False, name=None), LEARNED, replace=False)
+
+    def lookup(self, specialty):
+        """(field, major) of a known specialty, or None."""
+        with self.lock:
+            return self._mappings.get(normalize(specialty))
+
+    def nearest(self, specialty):
+        """(field, major, similarity) of the most similar known specialty."""
+        with self.lock:
+            if self._index is None:
+                self._keys = list(self._mappings)
+                self._index = TrigramIndex(self._keys)
+            index, keys = self._index, self._keys
+        scores = index.scores(specialty)
+        if not len(scores):
+            return None
+        best = int(scores.argmax())
+        return (*self._mappings[keys[best]], float(scores[best]))
+
+    def resolve(self, specialties, classify=None, max_workers=MAX_WORKERS, progress=None):
+        """{specialty: (field, major, source)} for the distinct non-empty
+        ``specialties``. ``classify(specialty)`` returns a (field, major)
+        pair and is only called for specialties neither the lookup nor a
+        close enough neighbour answers; without it they come back as
+        ``UNCLASSIFIED``. ``progress(done, total)`` is called after each."""
+        specialties = [s for s in dict.fromkeys(specialties) if isinstance(s, str) and s.strip()]
+        resolved, misses, neighbours = {}, [], []
+        for specialty in specialties:
+            found = self.lookup(specialty)
+            if found:
+                resolved[specialty] = (*found, EXACT)
+            else:
+                misses.append(specialty)
+        remaining = []
+        for specialty in misses:
+            near = self.nearest(specialty)
+            if near and near[2] >= NEIGHBOUR_THRESHOLD:
+                resolved[specialty] = (near[0], near[1], NEIGHBOUR)
+                neighbours.append((specialty, near[0], near[1], near[2]))
+            else:
+                remaining.append(specialty)
+        if neighbours:
+            self.add_many([n[:3] for n in neighbours], NEIGHBOUR, [n[3] for n in neighbours])
+        done = len(resolved)
+        if progress:
+            progress(done, len(specialties))
+        if remaining and classify is not None:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(classify, specialty): specialty for specialty in remaining}
+                for future in as_completed(futures):
+                    specialty = futures[future]
+                    field, major = future.result()
+                    # Stored as soon as answered, so an interrupted batch keeps its answers
+                    if self.add(specialty, field, major, LLM):
+                        resolved[specialty] = (field, major, LLM)
+                    done += 1
+                    if progress:
+                        progress(done, len(specialties))
+        for specialty in specialties:
+            resolved.setdefault(specialty, (UNCLASSIFIED, specialty, None))
+        self.sources.update(source for _, _, source in resolved.values() if source)
+        return resolved
+
+    def fill(self, frame, specialty_column='Adjusted Speciality'):
+        """Fill ``Field`` and ``Major`` of the unclassified rows of
+        ``frame`` from the store, without calling any LLM. Returns how many
+        rows were filled."""
+        missing = frame['Field'].isna() | frame['Field'].isin([UNCLASSIFIED, ""])
+        if not missing.any():
+            return 0
+        resolved = self.resolve(frame.loc[missing, specialty_column])
+        answers = frame.loc[missing, specialty_column].map(
+            lambda specialty: resolved.get(specialty, (UNCLASSIFIED, specialty, None)))
+        found = answers.map(lambda answer: answer[2] is not None)
+        rows = answers.index[found.to_numpy()]
+        frame.loc[rows, 'Field'] = [answers[row][0] for row in rows]
+        frame.loc[rows, 'Major'] = [answers[row][1] for row in rows]
+        return len(rows)
+
+    def mappings(self):
+        with self.lock:
+            return pd.read_sql_query("SELECT specialty, field, major, source, score, updated FROM mappings "
+                                     "ORDER BY field, major, specialty", self._connection)
+
+    def close(self):
+        with self.lock:
+            self._connection.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_store():
+    """The process-wide store at ``STORE_PATH``."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = TaxonomyStore()
+        return _default
@@ -0,0 +1,237 @@
+"""Lightweight span tracing for the Streamlit pages.
+
+Pages call ``start_rerun(page)`` at the top of the script, then wrap hot
+paths with the ``traced`` decorator or the ``span`` context manager. Spans
+are kept per session (in ``st.session_state``) for the last few reruns and
+can be exported as OpenTelemetry-style JSON. Outside a Streamlit script run
+(background threads, CLI tools) spans go to a process-wide store.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MAX_RERUNS = 20
+SESSION_KEY = "_trace_store"
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_unix_ns = time.time_ns()
+        self._start = time.perf_counter_ns()
+        self.duration_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration_ns = time.perf_counter_ns() - self._start
+
+    @property
+    def duration_ms(self):
+        return (self.duration_ns or 0) / 1e6
+
+
+class RerunTrace:
+    def __init__(self, page):
+        self.page = page
+        self.trace_id = os.urandom(16).hex()
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        # Aggregate finished spans by name: call count, total and max time
+        rows = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            row = rows.setdefault(span.name, {'span': span.name, 'calls': 0, 'total_ms': 0.0,
+                                              'max_ms': 0.0, 'errors': 0})
+            row['calls'] += 1
+            row['total_ms'] += span.duration_ms
+            row['max_ms'] = max(row['max_ms'], span.duration_ms)
+            row['errors'] += 1 if span.error else 0
+        return sorted(rows.values(), key=lambda row: row['total_ms'], reverse=True)
+
+
+class TraceStore:
+    def __init__(self, max_reruns=MAX_RERUNS):
+        self.reruns = deque(maxlen=max_reruns)
+        self._lock = threading.Lock()
+
+    def start_rerun(self, page):
+        trace = RerunTrace(page)
+        with self._lock:
+            self.reruns.append(trace)
+        return trace
+
+    def current(self):
+        with self._lock:
+            if self.reruns:
+                return self.reruns[-1]
+        return self.start_rerun("unknown")
+
+    def clear(self):
+        with self._lock:
+            self.reruns.clear()
+
+
+_PROCESS_STORE = TraceStore()
+_local = threading.local()
+
+
+def _store():
+    store = getattr(_local, 'store', None)
+    if store is not None:
+        return store
+    try:
+        import streamlit as st
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return _PROCESS_STORE
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return _PROCESS_STORE
+    if SESSION_KEY not in st.session_state:
+        st.session_state[SESSION_KEY] = TraceStore()
+    return st.session_state[SESSION_KEY]
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def start_rerun(page):
+    """Begin a new trace for this script run of ``page``."""
+    _stack().clear()
+    return _store().start_rerun(page)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    trace = _store().current()
+    stack = _stack()
+    current = Span(name, trace.trace_id, stack[-1].span_id if stack else None, attributes)
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as e:
+        # st.rerun() and st.stop() raise control-flow exceptions; only
+        # genuine failures count as errors
+        if isinstance(e, Exception) and type(e).__module__.split('.')[0] != 'streamlit':
+            current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.finish()
+        stack.pop()
+        trace.add(current)
+
+
+def traced(name=None, **attributes):
+    """Decorator recording a span around every call of the function."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(func):
+    """Bind ``func`` to the caller's trace so calls made from worker threads
+    (e.g. a ThreadPoolExecutor) are recorded under the current rerun."""
+    store = _store()
+    parent = list(_stack()[-1:])
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous_store = getattr(_local, 'store', None)
+        _local.store = store
+        _local.stack = list(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.store = previous_store
+            _local.stack = []
+    return wrapper
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def to_otlp(reruns, service_name="us-house-crm"):
+    """Export reruns in the OTLP/JSON trace layout (resourceSpans)."""
+    spans = []
+    for trace in reruns:
+        for item in list(trace.spans):
+            spans.append({
+                'traceId': item.trace_id,
+                'spanId': item.span_id,
+                'parentSpanId': item.parent_id or '',
+                'name': item.name,
+                'kind': 1,
+                'startTimeUnixNano': str(item.start_unix_ns),
+                'endTimeUnixNano': str(item.start_unix_ns + (item.duration_ns or 0)),
+                'attributes': [_attribute('crm.page', trace.page)]
+                              + [_attribute(k, v) for k, v in item.attributes.items()],
+                'status': {'code': 2, 'message': item.error} if item.error else {'code': 1},
+            })
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', service_name)]},
+            'scopeSpans': [{'scope': {'name': 'crm.tracing'}, 'spans': spans}],
+        }]
+    }
+
+
+def render_panel():
+    """Admin panel listing span timings and call counts per rerun."""
+    import pandas as pd
+    import streamlit as st
+
+    store = _store()
+    reruns = [trace for trace in store.reruns if trace.spans]
+    with st.expander("⏱️ Rerun profiling", expanded=False):
+        if not reruns:
+            st.info("No traced reruns yet. Open a page to collect timings.")
+            return
+        labels = [f"{time.strftime('%H:%M:%S', time.localtime(trace.started_at))} · {trace.page}"
+                  for trace in reruns]
+        choice = st.selectbox("Rerun", range(len(reruns)), index=len(reruns) - 1,
+                              format_func=lambda i: labels[i], key="trace_panel_rerun")
+        summary = pd.DataFrame(reruns[choice].summary())
+        st.dataframe(summary.round(2), use_container_width=True, hide_index=True)
+        st.download_button(
+            "Export OpenTelemetry JSON",
+            data=json.dumps(to_otlp(reruns), indent=2),
+            file_name="crm_traces.json",
+            mime="application/json",
+        )
+        if st.button("Clear traces"):
+            store.clear()
+            st.rerun()
@@ -0,0 +1,125 @@
+"""Keyword search over the word timings of a session's transcripts.
+
+Every transcript added to a ``TranscriptIndex`` keeps its words with start
+and end times. An inverted index maps each normalized word to the word
+offsets where it occurs, per transcript. A phrase matches where the
+offsets of its words line up, which is a few array intersections per
+transcript, not a scan of the text. Hits carry the time window of the
+match, so the page can play exactly that part of the recording.
+"""
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from crm.audio_ingest import extract_audio_chunk
+from crm.transcription_queue import WORD_COLUMNS
+
+SESSION_KEY = "transcript_index"
+CONTEXT_WORDS = 8
+PADDING_SECONDS = 1.0
+MAX_PLAYED_HITS = 10
+
+_PUNCTUATION = re.compile(r"[^\w']+")
+
+
+def normalize_word(word):
+    return _PUNCTUATION.sub("", str(word).casefold())
+
+
+class Hit:
+    def __init__(self, document, offset, length):
+        words = document['words']
+        self.name = document['name']
+        self.audio_path = document['audio_path']
+        self.start = float(words['Start'].iat[offset])
+        self.end = float(words['End'].iat[offset + length - 1])
+        self.speaker = words['Speaker'].iat[offset]
+        before = words['Word'].iloc[max(0, offset - CONTEXT_WORDS):offset]
+        match = words['Word'].iloc[offset:offset + length]
+        after = words['Word'].iloc[offset + length:offset + length + CONTEXT_WORDS]
+        self.context = (" ".join(before), " ".join(match), " ".join(after))
+
+
+class TranscriptIndex:
+    def __init__(self):
+        self.documents = {}                    # key -> {'name', 'audio_path', 'words'}
+        self._postings = defaultdict(dict)     # word -> {key: sorted offsets}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, key, name, words, audio_path=None):
+        """Index ``words`` (a DataFrame with ``WORD_COLUMNS``), replacing any
+        earlier transcript with the same ``key``."""
+        self.remove(key)
+        words = pd.DataFrame(words, columns=WORD_COLUMNS).reset_index(drop=True)
+        self.documents[key] = {'name': name, 'audio_path': audio_path, 'words': words}
+        tokens = words['Word'].map(normalize_word)
+        for token, offsets in tokens.groupby(tokens, sort=False).indices.items():
+            if token:
+                self._postings[token][key] = np.asarray(offsets, dtype=np.int64)
+
+    def remove(self, key):
+        if self.documents.pop(key, None) is None:
+            return
+        for token in [token for token, postings in self._postings.items() if key in postings]:
+            del self._postings[token][key]
+            if not self._postings[token]:
+                del self._postings[token]
+
+    def search(self, query, limit=None):
+        """Hits for ``query`` (a word or phrase), in transcript then time order."""
+        tokens = [token for token in (normalize_word(word) for word in query.split()) if token]
+        if not tokens:
+            return []
+        postings = [self._postings.get(token, {}) for token in tokens]
+        hits = []
+        for key in postings[0]:
+            offsets = postings[0][key]
+            for shift, posting in enumerate(postings[1:], start=1):
+                if key not in posting:
+                    offsets = offsets[:0]
+                    break
+                offsets = np.intersect1d(offsets, posting[key] - shift, assume_unique=True)
+            document = self.documents[key]
+            for offset in offsets:
+                hits.append(Hit(document, int(offset), len(tokens)))
+                if limit and len(hits) >= limit:
+                    return hits
+        return hits
+
+
+def session_index():
+    if SESSION_KEY not in st.session_state:
+        st.session_state[SESSION_KEY] = TranscriptIndex()
+    return st.session_state[SESSION_KEY]
+
+
+def show_search(index, key="transcript_search"):
+    """Search box over ``index``; the first hits play their audio window."""
+    if not len(index):
+        return
+    query = st.text_input(f"Search {len(index)} transcript(s)", key=key,
+                          placeholder="Word or phrase, e.g. bank statement")
+    if not query:
+        return
+    hits = index.search(query)
+    st.caption(f"{len(hits)} matches")
+    for hit in hits[:MAX_PLAYED_HITS]:
+        before, match, after = hit.context
+        st.markdown(f"**{hit.name}** · Speaker {hit.speaker} · {hit.start:.2f}s – {hit.end:.2f}s  \n"
+                    f"…{before} **{match}** {after}…")
+        if not (hit.audio_path and hit.audio_path.lower().endswith(".wav")):
+            continue
+        if not os.path.exists(hit.audio_path):
+            # Uploading the next file deletes the previous one's audio
+            st.caption("Audio no longer available for this transcript.")
+            continue
+        st.audio(extract_audio_chunk(hit.audio_path, max(0.0, hit.start - PADDING_SECONDS),
+                                     hit.end + PADDING_SECONDS), format="audio/wav")
+    if len(hits) > MAX_PLAYED_HITS:
+        st.caption(f"Showing the first {MAX_PLAYED_HITS}; refine the search to see the rest.")
@@ -0,0 +1,243 @@
+"""Batch transcription of many recordings.
+
+A ``TranscriptionQueue`` runs one scheduler thread per batch. The thread
+hashes every recording and takes finished transcripts from a disk cache
+keyed by content hash and settings. It transcodes large files
+(``crm.audio_ingest``) and submits the rest concurrently with
+``Transcriber.submit``, which returns as soon as the job is queued. It then
+polls every open job with ``Transcript.get_by_id`` in one loop until all
+are done; a job still open ``job_timeout`` seconds after it was queued is
+marked as an error, so the loop always ends. The page only reads ``queue.table()``, so it never blocks on
+AssemblyAI.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import assemblyai as aai
+import pandas as pd
+
+from crm.audio_ingest import TRANSCODE_ABOVE, transcode_to_opus
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "crm-transcripts")
+# Server folders of recordings can only be read below this directory; unset, none can
+AUDIO_ROOT = os.environ.get("CRM_AUDIO_ROOT")
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".opus", ".flac", ".aac", ".webm")
+MAX_WORKERS = 4
+POLL_SECONDS = 5
+# Longest wait for one queued transcript, a few times a long recording's run
+JOB_TIMEOUT_SECONDS = 60 * 60
+
+UTTERANCE_COLUMNS = ["Speaker", "Text", "Start", "End", "Confidence"]
+WORD_COLUMNS = ["Word", "Start", "End", "Speaker", "Confidence"]
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_key(speakers_expected=None, word_boost=None, boost_param="default"):
+    settings = json.dumps([speakers_expected, sorted(word_boost or []), boost_param])
+    return hashlib.blake2b(settings.encode("utf-8"), digest_size=4).hexdigest()
+
+
+def transcript_records(transcript):
+    """(utterances, words) of a completed transcript, times in seconds."""
+    utterances = [(u.speaker, u.text, u.start / 1000, u.end / 1000, u.confidence)
+                  for u in (transcript.utterances or [])]
+    words = [(w.text, w.start / 1000, w.end / 1000, getattr(w, 'speaker', None), w.confidence)
+             for w in (transcript.words or [])]
+    return utterances, words
+
+
+class TranscriptCache:
+    """Finished transcripts on disk, one JSON file per content hash and settings."""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        # Write then rename so a crash never leaves half a file behind
+        temporary = self._path(key) + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temporary, self._path(key))
+
+
+class Job:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.key = None
+        self.status = "waiting"
+        self.transcript_id = None
+        self.error = None
+        self.started = time.time()
+        self.queued_at = None
+        self.finished = None
+        self.utterances = None
+        self.words = None
+
+    @property
+    def done(self):
+        return self.status in ("completed", "cached", "error")
+
+    def frame(self):
+        return pd.DataFrame(self.utterances or [], columns=UTTERANCE_COLUMNS)
+
+    def words_frame(self):
+        return pd.DataFrame(self.words or [], columns=WORD_COLUMNS)
+
+
+class TranscriptionQueue:
+    def __init__(self, files, speakers_expected=None, word_boost=None, boost_param="default",
+                 cache=None, max_workers=MAX_WORKERS, poll_seconds=POLL_SECONDS,
+                 job_timeout=JOB_TIMEOUT_SECONDS):
+        self.jobs = [Job(name, path) for name, path in files]
+        self.config = aai.TranscriptionConfig(
+            speaker_labels=True,
+            speakers_expected=speakers_expected,
+            word_boost=word_boost,
+            boost_param=boost_param,
+        )
+        self.settings = settings_key(speakers_expected, word_boost, boost_param)
+        self.cache = cache or TranscriptCache()
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        self.job_timeout = job_timeout
+        self.lock = threading.Lock()
+        # Transcoded copies go here, never next to recordings in a server folder
+        self.workdir = tempfile.mkdtemp(prefix="crm-batch-")
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="transcription-queue", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def finished(self):
+        return all(job.done for job in self.jobs)
+
+    def _set(self, job, **changes):
+        with self.lock:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            if job.done and job.finished is None:
+                job.finished = time.time()
+
+    def _submit(self, job):
+        try:
+            self._set(job, status="hashing")
+            job.key = f"{file_hash(job.path)}-{self.settings}"
+            entry = self.cache.get(job.key)
+            if entry is not None:
+                self._set(job, status="cached", transcript_id=entry.get('id'),
+                          utterances=entry['utterances'], words=entry['words'])
+                return
+            upload_path = job.path
+            if os.path.getsize(job.path) > TRANSCODE_ABOVE:
+                self._set(job, status="transcoding")
+                upload_path = transcode_to_opus(job.path, self.workdir) or job.path
+            self._set(job, status="uploading")
+            transcript = aai.Transcriber().submit(upload_path, config=self.config)
+            self._set(job, status="queued", transcript_id=transcript.id, queued_at=time.time())
+        except Exception as e:
+            self._set(job, status="error", error=str(e))
+
+    def _poll(self, job):
+        try:
+            transcript = aai.Transcript.get_by_id(job.transcript_id)
+        except Exception as e:
+            # A failed poll is retried on the next round
+            self._set(job, error=str(e))
+            return
+        if transcript.status == aai.TranscriptStatus.completed:
+            utterances, words = transcript_records(transcript)
+            self.cache.put(job.key, {'id': transcript.id, 'name': job.name,
+                                     'utterances': utterances, 'words': words})
+            self._set(job, status="completed", utterances=utterances, words=words, error=None)
+        elif transcript.status == aai.TranscriptStatus.error:
+            self._set(job, status="error", error=transcript.error)
+        else:
+            self._set(job, status=str(getattr(transcript.status, 'value', transcript.status)), error=None)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self._submit, self.jobs))
+            while True:
+                open_jobs = [job for job in self.jobs if not job.done and job.transcript_id]
+                if not open_jobs:
+                    break
+                time.sleep(self.poll_seconds)
+                list(executor.map(self._poll, open_jobs))
+                now = time.time()
+                for job in open_jobs:
+                    if not job.done and now - job.queued_at > self.job_timeout:
+                        reason = job.error or job.status
+                        self._set(job, status="error",
+                                  error=f"No transcript after {self.job_timeout / 60:.0f} minutes ({reason})")
+
+    def table(self):
+        now = time.time()
+        with self.lock:
+            rows = [{
+                'File': job.name,
+                'Status': job.status,
+                'Utterances': len(job.utterances) if job.utterances is not None else None,
+                'Elapsed (s)': round((job.finished or now) - job.started),
+                'Transcript ID': job.transcript_id,
+                'Error': job.error,
+            } for job in self.jobs]
+        return pd.DataFrame(rows)
+
+
+def _inside(path, root):
+    return os.path.commonpath([path, root]) == root
+
+
+def resolve_folder(folder, root=AUDIO_ROOT):
+    """The real path of ``folder``, taken relative to ``root``. Raises
+    ValueError when there is no root or the path leaves it."""
+    if not root:
+        raise ValueError("Reading folders on the server is not enabled")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, folder))
+    if not _inside(path, root):
+        raise ValueError(f"Folder is outside {root}: {folder}")
+    if not os.path.isdir(path):
+        raise ValueError(f"Folder not found: {folder}")
+    return path
+
+
+def audio_files_in(folder, root=AUDIO_ROOT):
+    """(name, path) of the recordings directly inside ``folder``, a folder
+    below ``root``. Links pointing outside ``root`` are skipped."""
+    folder = resolve_folder(folder, root)
+    root = os.path.realpath(root)
+    files = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.realpath(os.path.join(folder, name))
+        if name.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(path) and _inside(path, root):
+            files.append((name, path))
+    return files
@@ -0,0 +1,255 @@
+"""Speaker identification and rendering for long transcripts.
+
+The utterance table is split into windows that fit a token budget. Each
+window goes to the model on its own (in parallel with ``chain.batch``) to
+name the speakers it has evidence for, and the per-window guesses are
+merged by vote. Only speakers the windows disagree on go to one short
+reduce call, which sees the candidate names and their evidence rather than
+the transcript. Token usage of every call is summed into a ``TokenUsage``.
+
+The transcript viewer builds the HTML of a whole page of utterances with
+vectorized string operations and sends it as one element. Rendered pages
+are cached by transcript hash and speaker-name mapping.
+"""
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from langchain_core.prompts import ChatPromptTemplate
+
+from crm import tracing
+
+WINDOW_TOKENS = 3000
+MAX_CONCURRENCY = 4
+TRANSCRIPT_PAGE_SIZE = 200
+
+UNKNOWN = "unknown"
+
+MAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant that identifies speakers based on the context of a conversation."),
+    ("human", "This is one part of a longer transcript. For every speaker in it, give the name the "
+              "conversation suggests, or Unknown if this part has no clue. Answer with one line per "
+              "speaker in the format 'Speaker A: [name] | [short evidence]' and nothing else.\n\n"
+              "{transcript}"),
+])
+
+REDUCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant that identifies speakers based on the context of a conversation."),
+    ("human", "Different parts of a transcript suggested these names for the same speakers, with the "
+              "number of parts and the evidence for each. Pick the most likely name for each speaker. "
+              "Answer with one line per speaker in the format 'Speaker A: [name]' and nothing else.\n\n"
+              "{candidates}"),
+])
+
+_SPEAKER_LINE = re.compile(r"^\s*\**\s*Speaker\s+([\w-]+)\s*\**\s*:\s*(.+?)\s*$", re.MULTILINE)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+
+def count_tokens(texts):
+    """Token count of each text; roughly four characters per token when
+    tiktoken is not available."""
+    if _ENCODING is not None:
+        return [len(tokens) for tokens in _ENCODING.encode_ordinary_batch(list(texts))]
+    return [len(text) // 4 + 1 for text in texts]
+
+
+def utterance_lines(df):
+    return ("Speaker " + df['Speaker'].astype(str) + ": " + df['Text'].astype(str)).tolist()
+
+
+def split_windows(df, max_tokens=WINDOW_TOKENS):
+    """Join utterances into transcript windows of at most ``max_tokens``
+    (an utterance longer than that gets a window of its own)."""
+    lines = utterance_lines(df)
+    windows, current, size = [], [], 0
+    for line, tokens in zip(lines, count_tokens(lines)):
+        if current and size + tokens > max_tokens:
+            windows.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += tokens
+    if current:
+        windows.append("\n".join(current))
+    return windows
+
+
+def parse_speaker_lines(text):
+    """{speaker label: (name, evidence)} from 'Speaker A: name | evidence' lines."""
+    parsed = {}
+    for label, rest in _SPEAKER_LINE.findall(text or ""):
+        name, _, evidence = rest.partition("|")
+        name = name.strip().strip("[]*").strip()
+        if name and name.casefold() != UNKNOWN:
+            parsed[label] = (name, evidence.strip())
+    return parsed
+
+
+class TokenUsage:
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, message):
+        self.calls += 1
+        usage = getattr(message, 'usage_metadata', None)
+        if usage:
+            self.input_tokens += usage.get('input_tokens', 0)
+            self.output_tokens += usage.get('output_tokens', 0)
+            return
+        # Older chat model wrappers only report OpenAI's own usage block
+        token_usage = (getattr(message, 'response_metadata', None) or {}).get('token_usage') or {}
+        self.input_tokens += token_usage.get('prompt_tokens', 0)
+        self.output_tokens += token_usage.get('completion_tokens', 0)
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def summary(self):
+        return (f"{self.calls} model calls, {self.input_tokens:,} input + "
+                f"{self.output_tokens:,} output = {self.total_tokens:,} tokens")
+
+
+class SpeakerSuggestions:
+    def __init__(self, names, usage, windows, failed_windows=0):
+        self.names = names
+        self.usage = usage
+        self.windows = windows
+        self.failed_windows = failed_windows
+
+    def as_text(self):
+        """The 'Speaker A: name' lines the diarization pages parse."""
+        return "\n".join(f"Speaker {label}: {name}" for label, name in self.names.items())
+
+
+def merge_votes(hypotheses):
+    """Merge per-window {label: (name, evidence)} guesses.
+
+    Returns (names decided by a strict majority, {label: candidates} for
+    the rest), where candidates are (name, votes, evidence) tuples.
+    """
+    votes = defaultdict(Counter)
+    spelling = {}
+    evidence = defaultdict(list)
+    for hypothesis in hypotheses:
+        for label, (name, reason) in hypothesis.items():
+            key = " ".join(name.casefold().split())
+            spelling.setdefault(key, name)
+            votes[label][key] += 1
+            if reason:
+                evidence[(label, key)].append(reason)
+
+    decided, disputed = {}, {}
+    for label, counter in votes.items():
+        ranked = counter.most_common()
+        total = sum(counter.values())
+        if len(ranked) == 1 or ranked[0][1] * 2 > total:
+            decided[label] = spelling[ranked[0][0]]
+        else:
+            disputed[label] = [(spelling[key], count, evidence[(label, key)][:2]) for key, count in ranked]
+    return decided, disputed
+
+
+def _candidates_text(disputed):
+    lines = []
+    for label, candidates in disputed.items():
+        lines.append(f"Speaker {label}:")
+        for name, count, reasons in candidates:
+            detail = f" ({'; '.join(reasons)})" if reasons else ""
+            lines.append(f"- {name}: {count} parts{detail}")
+    return "\n".join(lines)
+
+
+@tracing.traced("llm.identify_speakers")
+def identify_speakers(llm, transcript_df, max_tokens=WINDOW_TOKENS, max_concurrency=MAX_CONCURRENCY):
+    """Suggest a name for every speaker label of ``transcript_df``."""
+    usage = TokenUsage()
+    windows = split_windows(transcript_df, max_tokens)
+
+    with tracing.span("llm.speaker_map", windows=len(windows)):
+        responses = (MAP_PROMPT | llm).batch(
+            [{"transcript": window} for window in windows],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+    hypotheses = []
+    failed = 0
+    for response in responses:
+        if isinstance(response, Exception):
+            failed += 1
+            continue
+        usage.add(response)
+        hypotheses.append(parse_speaker_lines(response.content))
+
+    names, disputed = merge_votes(hypotheses)
+    if disputed:
+        with tracing.span("llm.speaker_reduce", speakers=len(disputed)):
+            response = (REDUCE_PROMPT | llm).invoke({"candidates": _candidates_text(disputed)})
+        usage.add(response)
+        for label, (name, _) in parse_speaker_lines(response.content).items():
+            if label in disputed:
+                names[label] = name
+        for label, candidates in disputed.items():
+            # Fall back to the most voted name if the reduce answer skipped a speaker
+            names.setdefault(label, candidates[0][0])
+
+    # Keep the speakers in the order they appear in the transcript
+    order = {str(label): position for position, label in enumerate(transcript_df['Speaker'].astype(str).unique())}
+    names = dict(sorted(names.items(), key=lambda item: order.get(item[0], len(order))))
+    return SpeakerSuggestions(names, usage, len(windows), failed)
+
+
+def transcript_hash(df):
+    return format(int(pd.util.hash_pandas_object(df, index=False).sum()) & (2 ** 64 - 1), "016x")
+
+
+def _escape(series):
+    return (series.str.replace("&", "&amp;", regex=False)
+                  .str.replace("<", "&lt;", regex=False)
+                  .str.replace(">", "&gt;", regex=False))
+
+
+def _seconds(values):
+    return pd.Series(np.char.mod("%.2f", values.to_numpy(dtype=float)), index=values.index)
+
+
+def transcript_html(df, speaker_names=None):
+    """HTML of every utterance of ``df``, built column-wise in one pass."""
+    if df.empty:
+        return ""
+    names = {str(label): name for label, name in (speaker_names or {}).items() if name}
+    speaker = df['Speaker'].astype(str)
+    label = speaker.map(names).fillna("Speaker " + speaker)
+    lines = ("<div class='transcript-line'><strong>" + _escape(label) + ":</strong> "
+             + _escape(df['Text'].astype(str)) + "<br>"
+             + "<span class='timestamp'>Time: " + _seconds(df['Start']) + "s - " + _seconds(df['End']) + "s</span> | "
+             + "<span class='confidence'>Confidence: " + _seconds(df['Confidence'].fillna(0)) + "</span></div>")
+    return "".join(lines.tolist())
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _render_page(transcript_key, names, page, page_size, _df):
+    # _df is not hashed; transcript_key identifies it
+    start = (page - 1) * page_size
+    return transcript_html(_df.iloc[start:start + page_size], dict(names))
+
+
+def show_transcript(df, speaker_names=None, key="transcript", page_size=TRANSCRIPT_PAGE_SIZE):
+    """Paged transcript viewer: one markdown element per page of utterances."""
+    total_pages = max(1, -(-len(df) // page_size))
+    page = 1
+    if total_pages > 1:
+        page = st.number_input(f"Transcript page (of {total_pages})", min_value=1, max_value=total_pages,
+                               value=1, step=1, key=f"{key}_page")
+    names = tuple(sorted((str(label), name) for label, name in (speaker_names or {}).items() if name))
+    with tracing.span("transcript.render", utterances=len(df), page=page):
+        html = _render_page(transcript_hash(df), names, page, page_size, df)
+    st.markdown(f"<div class='transcript-page'>{html}</div>", unsafe_allow_html=True)
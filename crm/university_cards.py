@@ -0,0 +1,97 @@
+"""Batched HTML rendering of the university result cards.
+
+The markup of every programme card is built once per catalogue version,
+column by column rather than row by row, and kept as an array of
+fragments aligned with the catalogue. A page of results is then a lookup of
+its rows' fragments, the page's logo sources dropped in, and one join into
+a single CSS-grid block, so paging, filtering and larger pages don't
+rebuild any card.
+"""
+import hashlib
+import html
+
+import numpy as np
+import pandas as pd
+
+from crm import tracing
+
+PRIME_COLUMNS = [f'prime {k}' for k in range(2, 6)]
+LOGO_SLOT = "\x00logo\x00"
+GRID_COLUMNS = 4
+
+GRID_CSS = """
+<style>
+.university-grid {
+    display: grid;
+    grid-template-columns: repeat(%d, minmax(0, 1fr));
+    gap: 1rem;
+}
+</style>
+"""
+
+
+def catalogue_version(df):
+    """A short hash of the catalogue's contents."""
+    hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return hashlib.blake2b(hashes.tobytes(), digest_size=8).hexdigest()
+
+
+def _each_unique(values, render):
+    # Catalogue columns repeat a few values many times; render each once
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    rendered = np.array([render(value) for value in uniques], dtype=object)
+    return rendered[codes]
+
+
+def _text(values):
+    return _each_unique(values, lambda value: "" if pd.isna(value) else html.escape(str(value)))
+
+
+def _amount(values):
+    return _each_unique(values, lambda value: html.escape(f"{value:,.0f}"))
+
+
+def _prime_tag(value):
+    if pd.isna(value) or not str(value).strip():
+        return ""
+    return f'<span class="prime-tag">{html.escape(str(value))}</span>'
+
+
+def _prime_tags(df):
+    return [_each_unique(df[column], _prime_tag) for column in PRIME_COLUMNS if column in df.columns]
+
+
+@tracing.traced("universities.build_fragments")
+def build_fragments(df):
+    """The card markup of every row of ``df``, with ``LOGO_SLOT`` where the
+    logo source goes."""
+    name = _text(df['University Name'])
+    parts = [
+        '<div class="university-card"><div class="university-header">'
+        '<img src="' + LOGO_SLOT + '" class="university-logo" alt="', name, ' logo">'
+        '<div class="university-name">', name, '</div></div>'
+        '<div class="speciality-name">', _text(df['Speciality']), '</div>'
+        '<div class="prime-tags">', *_prime_tags(df), '</div>'
+        '<div class="info-container"><div>'
+        '<div class="info-row"><span>Location:</span><span>', _text(df['City']), ', ', _text(df['Country']), '</span></div>'
+        '<div class="info-row"><span>Tuition:</span><span>$', _amount(df['Tuition Price']), ' ',
+        _text(df['Tuition Currency']), '/Year</span></div>'
+        '<div class="info-row"><span>Application fee:</span><span>$', _amount(df['Application Fee Price']), ' ',
+        _text(df['Application Fee Currency']), '</span></div>'
+        '<div class="info-row"><span>Duration:</span><span>', _text(df['Duration']), '</span></div>'
+        '<div class="info-row"><span>Level:</span><span>', _text(df['Level']), '</span></div>'
+        '<div class="info-row"><span>Field:</span><span>', _text(df['Field']), '</span></div>'
+        '</div></div></div>',
+    ]
+    # One join per card instead of growing every card once per column
+    columns = [np.broadcast_to(np.asarray(part, dtype=object), len(df)) for part in parts]
+    return pd.Series(["".join(card) for card in zip(*columns)], index=df.index, dtype=object)
+
+
+def grid_html(fragments, logos=None, columns=GRID_COLUMNS):
+    """One HTML block for the cards in ``fragments`` (a Series of card
+    markup, with its ``Picture`` URLs in ``logos`` order)."""
+    cards = fragments.tolist()
+    for position, source in enumerate(logos if logos is not None else [""] * len(cards)):
+        cards[position] = cards[position].replace(LOGO_SLOT, html.escape(source or "", quote=True), 1)
+    return (GRID_CSS % columns) + '<div class="university-grid">' + "".join(cards) + '</div>'
@@ -0,0 +1,86 @@
+"""Every worksheet of a spreadsheet, read in one request.
+
+``load_workbook`` lists the worksheets and fetches all of them with a
+single ``values_batch_get`` instead of one read per worksheet. Each sheet
+becomes an ``EditSession`` (``crm.edit_session``), so saves still send only
+the changed cells. ``Workbook.frame`` turns the sheets into one DataFrame
+with a single concat, tagging each row with the worksheet and sheet row it
+came from, so load time grows with the total number of rows rather than
+rows × sheets. The frames are built row-wise from the sessions' rows rather
+than column-wise from the response: the sessions keep those rows (and
+their versions) as the base of every save anyway, so this reuses them
+instead of holding a second, columnar copy of the payload.
+
+Per-sheet timings are kept in ``Workbook.timings`` and recorded as trace
+spans. The fetch is one request for all the sheets and cannot be timed per
+sheet; ``est_fetch_ms`` is an estimate, the request's time shared out in
+proportion to each sheet's cells. ``fetch_ms`` is the request's own time.
+"""
+import logging
+
+import pandas as pd
+from gspread.utils import absolute_range_name
+
+from crm import tracing
+from crm.edit_session import EditSession
+
+SHEET_COLUMN = '_sheet'
+ROW_COLUMN = '_row'
+
+log = logging.getLogger(__name__)
+
+
+class Workbook:
+    def __init__(self, sessions, timings, fetch_ms):
+        self.sessions = sessions  # worksheet title -> EditSession, in sheet order
+        self.timings = timings
+        self.fetch_ms = fetch_ms
+
+    def frame(self):
+        """All the rows as text, with ``_sheet`` and ``_row`` columns, in
+        sheet order. Empty worksheets are left out."""
+        frames = []
+        for title, session in self.sessions.items():
+            with tracing.span("sheets.frame", sheet=title) as span:
+                df = session.frame()
+                if not df.empty:
+                    df[SHEET_COLUMN] = title
+                    df[ROW_COLUMN] = session.row_numbers()
+                    frames.append(df)
+            self._timing(title)['frame_ms'] = round(span.duration_ms, 1)
+        with tracing.span("sheets.concat", sheets=len(frames)):
+            return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _timing(self, title):
+        return next(timing for timing in self.timings if timing['sheet'] == title)
+
+    def timings_frame(self):
+        return pd.DataFrame(self.timings)
+
+
+@tracing.traced("sheets.load_workbook")
+def load_workbook(spreadsheet, **session_kwargs):
+    """A ``Workbook`` of every worksheet of ``spreadsheet``. Keyword
+    arguments are passed to each ``EditSession``."""
+    worksheets = spreadsheet.worksheets()
+    ranges = [absolute_range_name(worksheet.title) for worksheet in worksheets]
+    with tracing.span("sheets.values_batch_get", sheets=len(ranges)) as span:
+        value_ranges = spreadsheet.values_batch_get(ranges).get('valueRanges', []) if ranges else []
+    fetch_ms = span.duration_ms
+    cells = [sum(len(row) for row in value_range.get('values', [])) for value_range in value_ranges]
+    total_cells = sum(cells) or 1
+
+    sessions, timings = {}, []
+    for worksheet, value_range, n_cells in zip(worksheets, value_ranges, cells):
+        values = value_range.get('values', [])
+        with tracing.span("sheets.parse", sheet=worksheet.title, rows=max(len(values) - 1, 0)) as parse:
+            sessions[worksheet.title] = EditSession(worksheet, values, **session_kwargs)
+        timings.append({
+            'sheet': worksheet.title,
+            'rows': max(len(values) - 1, 0),
+            'est_fetch_ms': round(fetch_ms * n_cells / total_cells, 1),
+            'parse_ms': round(parse.duration_ms, 1),
+        })
+    log.info("Loaded %d worksheets (%d rows) in one request of %.0f ms",
+             len(sessions), sum(timing['rows'] for timing in timings), fetch_ms)
+    return Workbook(sessions, timings, round(fetch_ms, 1))
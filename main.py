@@ -1,6 +1,7 @@
 
 import streamlit as st
 from streamlit_option_menu import option_menu
+from crm import session_state, tracing
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="Login", page_icon="🔒", layout="centered")
@@ -40,7 +41,12 @@ else:  # --- APP CONTENT ---
         with st.sidebar:
             selected = option_menu("Main Menu", ["Home", "Analytics", "Settings"], 
                 icons=['house', 'graph-up-arrow', 'gear'], menu_icon="cast", default_index=0)
-            
+
+        # Per-rerun span timings collected by the pages (admin only)
+        tracing.render_panel()
+        # Memory held per session and by the shared tables
+        session_state.render_panel()
+
     else:  # --- APP CONTENT ---
         with st.sidebar:
             role = st.session_state["role"]
@@ -0,0 +1,120 @@
+import io
+import os
+import zipfile
+
+import assemblyai as aai
+import streamlit as st
+
+from crm import tracing
+from crm.audio_ingest import save_stream, session_dir
+from crm.transcription_queue import AUDIO_EXTENSIONS, AUDIO_ROOT, TranscriptionQueue, audio_files_in, resolve_folder
+from crm.transcript_search import session_index, show_search
+from crm.transcripts import show_transcript
+
+# Set page configuration
+st.set_page_config(page_title="Batch Transcription", layout="wide")
+tracing.start_rerun("Batch Transcription")
+
+# Set AssemblyAI API key
+aai.settings.api_key = st.secrets["aai"]
+
+st.title("Batch Transcription")
+st.write("Transcribe many recordings at once. Jobs run in the background; "
+         "recordings transcribed before with the same settings are taken from the cache.")
+
+
+def collect_files(uploaded_files, folder):
+    """(name, path) of every recording in the uploads (including zips) and the server folder."""
+    directory = session_dir()
+    files = []
+    for uploaded in uploaded_files or []:
+        if uploaded.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(uploaded) as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or not name.lower().endswith(AUDIO_EXTENSIONS):
+                        continue
+                    with archive.open(member) as source:
+                        files.append((name, save_stream(source, directory, name)))
+        else:
+            files.append((uploaded.name, save_stream(uploaded, directory, uploaded.name)))
+    if folder:
+        files.extend(audio_files_in(folder))
+    return files
+
+
+with st.form("batch_form"):
+    uploaded_files = st.file_uploader("Recordings or zip archives", accept_multiple_files=True,
+                                      type=[ext.lstrip(".") for ext in AUDIO_EXTENSIONS] + ["zip"])
+    folder = None
+    if AUDIO_ROOT:
+        folder = st.text_input("Or a folder on the server",
+                               help=f"A folder inside {AUDIO_ROOT}; every recording directly inside it is transcribed")
+    col1, col2 = st.columns(2)
+    with col1:
+        speakers = st.number_input("Speakers expected (0 = detect)", min_value=0, max_value=10, value=0)
+    with col2:
+        boost_param = st.selectbox("Custom vocabulary weight", ["low", "default", "high"], index=1)
+    word_boost_input = st.text_input("Custom vocabulary (comma-separated)")
+    start = st.form_submit_button("Start batch")
+
+if start:
+    try:
+        if folder:
+            resolve_folder(folder)
+    except ValueError as e:
+        st.error(str(e))
+    else:
+        with st.spinner("Collecting recordings..."):
+            files = collect_files(uploaded_files, folder)
+        if not files:
+            st.warning("No recordings found.")
+        else:
+            word_boost = [word.strip() for word in word_boost_input.split(',') if word.strip()] or None
+            st.session_state.batch_queue = TranscriptionQueue(
+                files, speakers_expected=speakers or None, word_boost=word_boost, boost_param=boost_param
+            ).start()
+
+
+@st.fragment(run_every=3)
+def job_table():
+    queue = st.session_state.get('batch_queue')
+    if queue is None:
+        return
+    table = queue.table()
+    finished = table['Status'].isin(["completed", "cached", "error"]).sum()
+    st.progress(finished / len(table), text=f"{finished} of {len(table)} recordings done")
+    st.dataframe(table, hide_index=True, use_container_width=True)
+    if queue.finished and not st.session_state.get('batch_shown'):
+        # Show the results section once, when the last job finishes
+        st.session_state.batch_shown = True
+        st.rerun()
+
+
+job_table()
+
+queue = st.session_state.get('batch_queue')
+if queue is not None and queue.finished:
+    st.session_state.batch_shown = True
+    done = [job for job in queue.jobs if job.utterances is not None]
+    if done:
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for job in done:
+                zf.writestr(os.path.splitext(job.name)[0] + ".csv", job.frame().to_csv(index=False))
+        st.download_button("Download all transcripts (CSV)", archive.getvalue(),
+                           file_name="transcripts.zip", mime="application/zip")
+
+        names = [job.name for job in done]
+        selected = st.selectbox("View transcript", names)
+        job = done[names.index(selected)]
+        show_transcript(job.frame(), key=f"batch_{selected}")
+
+        # Finished recordings join the session's keyword search
+        index = session_index()
+        for job in done:
+            if job.key not in index.documents:
+                index.add(job.key, job.name, job.words, job.path)
+        show_search(index, key="batch_search")
+elif queue is not None:
+    st.session_state.batch_shown = False
@@ -2,8 +2,10 @@ import streamlit as st
 import pandas as pd
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import os
+from crm import tracing
+from crm.taxonomy import EXACT, FIELDS_AND_MAJORS, LLM, NEIGHBOUR, default_store
+
+tracing.start_rerun("Convert")
 
 # Retrieve the API key from Streamlit secrets
 api_key = st.secrets.get("api_key")
@@ -18,77 +20,7 @@ except Exception as e:
     st.error(f"Failed to initialize Google Gemini model: {e}")
     st.stop()
 
-fields_and_majors = {
-    "Computer Science and Information Technology": [
-        "Computer Science Fundamentals", "Software Engineering", 
-        "Artificial Intelligence and Machine Learning", "Data Science and Analytics", 
-        "Cybersecurity", "Information Systems and Management", "Networking and Telecommunications", 
-        "Web Development and Internet Technologies", "Human-Computer Interaction", 
-        "Database Systems and Big Data", "Information Systems"
-    ],
-    "Business and Management": [
-        "Business Administration", "Marketing", "Finance and Accounting", 
-        "Human Resource Management", "Entrepreneurship", "Operations Management", 
-        "International Business", "Supply Chain Management", "Economics", "Strategic Management",
-        "Management", "Digital Marketing"
-    ],
-    "Engineering and Technology": [
-        "Mechanical Engineering", "Electrical Engineering", "Civil Engineering", 
-        "Chemical Engineering", "Aerospace Engineering", "Biomedical Engineering", 
-        "Environmental Engineering", "Industrial Engineering", 
-        "Materials Science and Engineering", "Robotics and Automation", "General Engineering"
-    ],
-    "Natural Sciences": [
-        "Physics", "Chemistry", "Biology", "Earth Sciences (Geology, Meteorology)", 
-        "Environmental Science", "Astronomy and Astrophysics", "Mathematics", 
-        "Statistics", "Ecology and Evolution", "Oceanography"
-    ],
-    "Social Sciences": [
-        "Psychology", "Sociology", "Anthropology", "Political Science", 
-        "Economics", "Geography", "Criminology and Criminal Justice", 
-        "Linguistics", "International Relations", "Gender Studies"
-    ],
-    "Arts and Humanities": [
-        "History", "Philosophy", "Literature", "Languages and Linguistics", 
-        "Art History", "Religious Studies", "Cultural Studies", "Music", 
-        "Theatre and Performing Arts", "Visual Arts (Painting, Sculpture)"
-    ],
-    "Health and Medicine": [
-        "Medicine and Surgery", "Nursing", "Pharmacy", "Public Health", 
-        "Dentistry", "Veterinary Science", "Biomedical Sciences", 
-        "Nutrition and Dietetics", "Physical Therapy", "Occupational Therapy",
-        "Health Sciences"
-    ],
-    "Education": [
-        "Early Childhood Education", "Primary Education", "Secondary Education", 
-        "Special Education", "Higher Education", "Educational Technology", 
-        "Curriculum and Instruction", "Educational Psychology", 
-        "Adult Education", "Physical Education"
-    ],
-    "Law and Legal Studies": [
-        "Law", "International Law", "Corporate Law", "Criminal Law", 
-        "Environmental Law", "Intellectual Property Law", "Human Rights Law", 
-        "Tax Law", "Family Law", "Labor and Employment Law"
-    ],
-    "Miscellaneous and Emerging Fields": [
-        "Environmental Sustainability", "Sports Management", 
-        "Media and Communication Studies", "Journalism", 
-        "Library and Information Science", "Urban Planning", 
-        "Fashion Design", "Culinary Arts", "Hospitality Management", 
-        "Ethics and Social Responsibility", "Digital Media"
-    ],
-    "English and ESL": [
-        "English Language Studies", "ESL (English as a Second Language)"
-    ],
-    "Tourism and Hospitality": [
-        "Tourism Management", "Hospitality Management"
-    ],
-    "Foundation Year": [
-        "Foundation Studies", "Pathway Programs"
-    ]
-}
-
-
+@tracing.traced("llm.reclassify_specialty")
 def reclassify_specialty(specialty, max_retries=3):
     # Construct the full prompt text including the list of fields and majors
     prompt_text = (
@@ -98,7 +30,7 @@ def reclassify_specialty(specialty, max_retries=3):
         "Fields and Majors:\n"
     )
     
-    for field, majors in fields_and_majors.items():
+    for field, majors in FIELDS_AND_MAJORS.items():
         majors_list = ", ".join(majors)
         prompt_text += f"{field}: {majors_list}\n"
     
@@ -113,7 +45,7 @@ def reclassify_specialty(specialty, max_retries=3):
             # Split the result into field and major
             if " - " in result:
                 field, major = result.split(" - ", 1)
-                if field in fields_and_majors and major in fields_and_majors[field]:
+                if field in FIELDS_AND_MAJORS and major in FIELDS_AND_MAJORS[field]:
                     return field, major
                 else:
                     return "Unclassified", specialty
@@ -148,29 +80,25 @@ if uploaded_file:
             # Initialize progress bar and status text
             progress_bar = st.progress(0)
             status_text = st.empty()
-            num_unclassified = len(unclassified_df)
-            checkpoint_interval = max(1, num_unclassified // 10)
-            checkpoint_file = "reclassification_checkpoint.csv"
-
-            # Multitasking using ThreadPoolExecutor
-            with ThreadPoolExecutor(max_workers=5) as executor:  # Adjust max_workers based on your environment's capabilities
-                futures = {executor.submit(reclassify_specialty, unclassified_df.at[i, 'Adjusted Speciality']): i for i in unclassified_df.index}
-
-                for future in as_completed(futures):
-                    i = futures[future]
-                    field, major = future.result()
-                    df.at[i, 'Field'] = field
-                    df.at[i, 'Major'] = major
-
-                    # Update progress bar and status text
-                    num_processed = len(unclassified_df) - df[df['Field'] == "Unclassified"].shape[0]
-                    progress_percentage = num_processed / num_unclassified if num_unclassified > 0 else 1
-                    progress_bar.progress(progress_percentage)
-                    status_text.text(f"Reclassifying row {i + 1}/{num_unclassified}")  # Show the current row number being processed
-
-                    # Save checkpoint every 10% or at the last row
-                    if num_processed % checkpoint_interval == 0 or i == unclassified_df.index[-1]:
-                        df.to_csv(checkpoint_file, index=False)
+
+            def show_progress(done, total):
+                progress_bar.progress(done / total if total > 0 else 1)
+                status_text.text(f"Classified {done}/{total} distinct specialties")
+
+            # Known specialties and close neighbours are answered locally; only the
+            # rest go to Gemini, and every answer is kept for the next upload
+            store = default_store()
+            resolved = store.resolve(unclassified_df['Adjusted Speciality'],
+                                     classify=tracing.propagate(reclassify_specialty),
+                                     progress=show_progress)
+            for i in unclassified_df.index:
+                field, major, _ = resolved.get(unclassified_df.at[i, 'Adjusted Speciality'],
+                                               ("Unclassified", unclassified_df.at[i, 'Adjusted Speciality'], None))
+                df.at[i, 'Field'] = field
+                df.at[i, 'Major'] = major
+            sources = pd.Series([source for _, _, source in resolved.values()]).value_counts()
+            st.write(f"Answered by lookup: {sources.get(EXACT, 0)}, by nearest known specialty: "
+                     f"{sources.get(NEIGHBOUR, 0)}, by Gemini: {sources.get(LLM, 0)}")
 
             st.write("Reclassification Results:")
             st.dataframe(df)
@@ -184,10 +112,6 @@ if uploaded_file:
                 mime='text/csv'
             )
 
-            # Clear the checkpoint after successful completion
-            if os.path.exists(checkpoint_file):
-                os.remove(checkpoint_file)
-
         # Display count of fields and majors
         st.write("### Count of Classified and Unclassified Entries")
         total_classified = df[df['Field'] != "Unclassified"].shape[0]
@@ -3,15 +3,17 @@ import assemblyai as aai
 import time
 import pandas as pd
 from httpx import RemoteProtocolError
-import wave
-import io
-import os
-import zipfile
 from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
+from crm import tracing
+from crm.audio_ingest import extract_audio_chunk, ingest
+from crm.session_state import session_state
+from crm.transcript_search import session_index, show_search
+from crm.transcription_queue import UTTERANCE_COLUMNS, transcript_records
+from crm.transcripts import identify_speakers, show_transcript
 
 # Set page configuration
 st.set_page_config(page_title="Audio Transcription App", layout="wide")
+tracing.start_rerun("Diarization")
 
 # Custom CSS for modern look
 st.markdown("""
@@ -62,6 +64,10 @@ st.markdown("""
         font-style: italic;
         margin-bottom: 0.5rem;
     }
+    .transcript-page {
+        max-height: 600px;
+        overflow-y: auto;
+    }
     .transcript-line {
         margin-bottom: 0.5rem;
     }
@@ -94,12 +100,10 @@ st.markdown("</div>", unsafe_allow_html=True)
 # Initialize session state
 if 'transcript_generated' not in st.session_state:
     st.session_state.transcript_generated = False
-if 'df' not in st.session_state:
-    st.session_state.df = None
 if 'file_path' not in st.session_state:
     st.session_state.file_path = None
-if 'compressed_file_path' not in st.session_state:
-    st.session_state.compressed_file_path = None
+if 'upload_path' not in st.session_state:
+    st.session_state.upload_path = None
 if 'ai_suggestions' not in st.session_state:
     st.session_state.ai_suggestions = None
 if 'speaker_names' not in st.session_state:
@@ -108,33 +112,8 @@ if 'speaker_names' not in st.session_state:
 # Set AssemblyAI API key
 aai.settings.api_key = st.secrets["aai"] # Replace with your actual AssemblyAI API key
 
-# Function to extract audio chunk
-def extract_audio_chunk(file_path, start_time, end_time):
-    with wave.open(file_path, 'rb') as wav_file:
-        framerate = wav_file.getframerate()
-        start_frame = int(start_time * framerate)
-        end_frame = int(end_time * framerate)
-        wav_file.setpos(start_frame)
-        chunk_frames = wav_file.readframes(end_frame - start_frame)
-        
-    chunk_io = io.BytesIO()
-    with wave.open(chunk_io, 'wb') as chunk_wav:
-        chunk_wav.setnchannels(wav_file.getnchannels())
-        chunk_wav.setsampwidth(wav_file.getsampwidth())
-        chunk_wav.setframerate(framerate)
-        chunk_wav.writeframes(chunk_frames)
-    
-    chunk_io.seek(0)
-    return chunk_io
-
-# Function to compress audio file if it exceeds 200MB
-def compress_audio(file_path):
-    compressed_path = "compressed_audio.zip"
-    with zipfile.ZipFile(compressed_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        zipf.write(file_path, os.path.basename(file_path))
-    return compressed_path
-
 # Function to transcribe audio
+@tracing.traced("assemblyai.transcribe_audio")
 def transcribe_audio(file_path, num_speakers=None, word_boost=None, boost_param="default"):
     transcriber = aai.Transcriber()
     
@@ -163,21 +142,17 @@ def transcribe_audio(file_path, num_speakers=None, word_boost=None, boost_param=
     return None
 
 # Function to get AI suggestions for speaker names using LangChain
+@tracing.traced("llm.speaker_suggestions")
 def get_ai_suggestions(transcript):
     llm = ChatOpenAI(model="gpt-4o", temperature=0, api_key=st.secrets["gpt4o"])  # Replace with your OpenAI API key
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are an AI assistant that can identify speakers based on the context of a conversation."),
-        ("human", "Based on the following transcript, can you identify the speakers and give them names? Please provide the response in the format 'Speaker A: [suggested name]'. Here's the transcript:\n\n{transcript}")
-    ])
-    
-    chain = prompt | llm
+    # Long transcripts are split into windows and the per-window guesses merged
+    suggestions = identify_speakers(llm, transcript)
+    st.session_state.ai_usage = suggestions.usage.summary() + f" over {suggestions.windows} transcript windows"
+    if suggestions.failed_windows:
+        st.warning(f"{suggestions.failed_windows} of {suggestions.windows} transcript windows could not be analysed.")
     
-    full_transcript = "\n".join([f"Speaker {row['Speaker']}: {row['Text']}" for _, row in transcript.iterrows()])
-    
-    result = chain.invoke({"transcript": full_transcript})
-    
-    return result.content
+    return suggestions.as_text()
 
 # Main app layout
 col1, col2 = st.columns([1, 2])
@@ -204,30 +179,14 @@ with col1:
             index=1
         )
         
-        # Check if the file size exceeds 200MB
-        if uploaded_file.size > 200 * 1024 * 1024:
-            st.warning("The file size exceeds 200MB. Compressing...")
-            # Save the file and compress it
-            with open("temp_audio.wav", "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            compressed_file_path = compress_audio("temp_audio.wav")
-            
-            # Save compressed path in session state
-            st.session_state.compressed_file_path = compressed_file_path
-            
-            # Show the compressed file size
-            compressed_file_size = os.path.getsize(compressed_file_path) / (1024 * 1024)  # Convert to MB
-            st.success(f"File compressed to {compressed_file_size:.2f} MB")
-            
-            # Unzip and play the compressed audio file
-            with zipfile.ZipFile(compressed_file_path, 'r') as zip_ref:
-                zip_ref.extractall(".")
-                extracted_file_path = zip_ref.namelist()[0]
-                st.audio(extracted_file_path, format="audio/wav")
-        else:
-            st.session_state.file_path = "temp_audio.wav"
-            with open(st.session_state.file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+        # Save once per upload to this session's folder; large files are transcoded for upload
+        with st.spinner("Preparing audio..."):
+            audio = ingest(uploaded_file)
+        st.session_state.file_path = audio.original_path
+        st.session_state.upload_path = audio.upload_path
+        if audio.compressed:
+            st.success(f"File compressed from {audio.original_size / (1024 * 1024):.2f} MB "
+                       f"to {audio.upload_size / (1024 * 1024):.2f} MB for upload")
         
         set_speakers = st.checkbox("Specify the number of speakers")
         if set_speakers:
@@ -239,7 +198,7 @@ with col1:
             with st.spinner("Transcribing audio..."):
                 # Transcribe the uploaded file with custom vocabulary and boost settings
                 transcript = transcribe_audio(
-                    st.session_state.file_path,
+                    st.session_state.upload_path,
                     num_speakers=num_speakers,
                     word_boost=word_boost_list,
                     boost_param=boost_param
@@ -249,11 +208,15 @@ with col1:
                     st.success("Transcription Successful!")
                     
                     # Process transcript data
-                    data = [(u.speaker, u.text, u.start / 1000, u.end / 1000, u.confidence) for u in transcript.utterances]
-                    st.session_state.df = pd.DataFrame(data, columns=["Speaker", "Text", "Start", "End", "Confidence"])
+                    utterances, words = transcript_records(transcript)
+                    # The only copy of the transcript, so it counts against the budget but is never evicted
+                    transcript_df = session_state().put('diarization.transcript',
+                                                        pd.DataFrame(utterances, columns=UTTERANCE_COLUMNS), pinned=True)
+                    # Word timings feed the search box; hits play from the original WAV
+                    session_index().add(transcript.id, uploaded_file.name, words, st.session_state.file_path)
                     
                     # Get AI suggestions
-                    st.session_state.ai_suggestions = get_ai_suggestions(st.session_state.df)
+                    st.session_state.ai_suggestions = get_ai_suggestions(transcript_df)
                     
                     st.session_state.transcript_generated = True
                 else:
@@ -261,22 +224,19 @@ with col1:
 
 with col2:
     if st.session_state.transcript_generated:
+        transcript_df = session_state().get('diarization.transcript')
         st.markdown("<h2 class='section-title'>Full Transcript</h2>", unsafe_allow_html=True)
-        for _, row in st.session_state.df.iterrows():
-            st.markdown(
-                f"<div class='transcript-line'>"
-                f"<strong>Speaker {row['Speaker']}:</strong> {row['Text']}<br>"
-                f"<span class='timestamp'>Time: {row['Start']:.2f}s - {row['End']:.2f}s</span> | "
-                f"<span class='confidence'>Confidence: {row['Confidence']:.2f}</span>"
-                f"</div>",
-                unsafe_allow_html=True
-            )
+        # One element per page of utterances, cached per transcript and speaker names
+        show_transcript(transcript_df, st.session_state.speaker_names)
+        show_search(session_index())
         
         if st.button("Save Transcript", key="save_transcript"):
-            st.session_state.df.to_csv("transcript_data.csv", index=False)
+            transcript_df.to_csv("transcript_data.csv", index=False)
             st.success("Transcript saved as 'transcript_data.csv'")
         
         st.markdown("<h2 class='section-title'>Speaker Identification</h2>", unsafe_allow_html=True)
+        if st.session_state.get('ai_usage'):
+            st.caption(st.session_state.ai_usage)
         
         # Process AI suggestions
         ai_suggestions_dict = {}
@@ -286,7 +246,7 @@ with col2:
                 ai_suggestions_dict[speaker.strip()] = name.strip()
         
         # Group utterances by speaker
-        speaker_utterances = st.session_state.df.groupby("Speaker")
+        speaker_utterances = transcript_df.groupby("Speaker")
         
         for speaker, utterances in speaker_utterances:
             with st.expander(f"Speaker {speaker}", expanded=True):
@@ -309,8 +269,8 @@ with col2:
                 st.markdown("</div>", unsafe_allow_html=True)
         
         if st.button("Apply Speaker Names", key="apply_names"):
-            st.session_state.df['Speaker'] = st.session_state.df['Speaker'].map(st.session_state.speaker_names)
+            transcript_df['Speaker'] = transcript_df['Speaker'].map(st.session_state.speaker_names)
             st.success("Speaker names applied to the transcript!")
             
             st.markdown("<h2 class='section-title'>Final Transcript with Identified Speakers</h2>", unsafe_allow_html=True)
-            st.dataframe(st.session_state.df)
+            st.dataframe(transcript_df)
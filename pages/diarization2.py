@@ -3,17 +3,18 @@ import assemblyai as aai
 import time
 import pandas as pd
 from httpx import RemoteProtocolError
-import io
-import os
-import uuid
-from pydub import AudioSegment
 from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
 import re
+from crm import tracing
+from crm.audio_ingest import extract_audio_chunk, ingest
+from crm.session_state import session_state
+from crm.transcript_search import session_index, show_search
+from crm.transcription_queue import UTTERANCE_COLUMNS, transcript_records
+from crm.transcripts import identify_speakers, show_transcript
 
 # Set page configuration
 st.set_page_config(page_title="Audio Transcription App", layout="wide")
+tracing.start_rerun("Diarization 2")
 
 # Custom CSS for modern look
 st.markdown("""
@@ -64,6 +65,10 @@ st.markdown("""
         font-style: italic;
         margin-bottom: 0.5rem;
     }
+    .transcript-page {
+        max-height: 600px;
+        overflow-y: auto;
+    }
     .transcript-line {
         margin-bottom: 0.5rem;
     }
@@ -96,10 +101,10 @@ st.markdown("</div>", unsafe_allow_html=True)
 # Initialize session state
 if 'transcript_generated' not in st.session_state:
     st.session_state.transcript_generated = False
-if 'df' not in st.session_state:
-    st.session_state.df = None
 if 'file_path' not in st.session_state:
     st.session_state.file_path = None
+if 'upload_path' not in st.session_state:
+    st.session_state.upload_path = None
 if 'ai_suggestions' not in st.session_state:
     st.session_state.ai_suggestions = None
 if 'speaker_names' not in st.session_state:
@@ -110,25 +115,8 @@ if 'ai_suggestions_generated' not in st.session_state:
 # Set AssemblyAI API key
 aai.settings.api_key = st.secrets["aai"]  # Replace with your actual AssemblyAI API key
 
-# Function to extract audio chunk
-def extract_audio_chunk(file_path, start_time, end_time):
-    audio = AudioSegment.from_file(file_path)
-    chunk = audio[start_time * 1000:end_time * 1000]  # pydub works in milliseconds
-    chunk_io = io.BytesIO()
-    chunk.export(chunk_io, format="wav")
-    chunk_io.seek(0)
-    return chunk_io
-
-# Function to compress audio file if it exceeds 200MB
-def compress_audio(file_path):
-    audio = AudioSegment.from_file(file_path)
-    compressed_path = f"{uuid.uuid4()}_compressed.wav"
-    # Reduce the frame rate and sample width to compress the audio
-    audio = audio.set_frame_rate(16000).set_sample_width(2)
-    audio.export(compressed_path, format="wav", bitrate="128k")
-    return compressed_path
-
 # Function to transcribe audio
+@tracing.traced("assemblyai.transcribe_audio")
 def transcribe_audio(file_path, num_speakers=None, word_boost=None, boost_param="default"):
     transcriber = aai.Transcriber()
 
@@ -155,6 +143,7 @@ def transcribe_audio(file_path, num_speakers=None, word_boost=None, boost_param=
     return None
 
 # Function to get AI suggestions for speaker names using LangChain
+@tracing.traced("llm.speaker_suggestions")
 def get_ai_suggestions(transcript_df):
     try:
         llm = ChatOpenAI(
@@ -163,32 +152,12 @@ def get_ai_suggestions(transcript_df):
             openai_api_key=st.secrets["gpt40"]
         )
 
-        prompt_template = """
-You are an AI assistant that identifies speakers based on the context of a conversation.
-Based on the following transcript, identify and name the speakers.
-**Use the same speaker numbers as in the transcript when providing your suggestions.**
-
-Provide the response in this exact format:
-
-Speaker 1: [Suggested Name]
-Speaker 2: [Suggested Name]
-...
-
-**Do not include any extra text or explanations.just the number of the speaker and the suggested name **
-
-Transcript:
-{transcript}
-"""
-        prompt = ChatPromptTemplate.from_template(prompt_template)
-
-        chain = LLMChain(llm=llm, prompt=prompt)
-
-        full_transcript = "\n".join([
-            f"Speaker {row['Speaker']}: {row['Text']}"
-            for _, row in transcript_df.iterrows()
-        ])
-
-        result = chain.run(transcript=full_transcript)
+        # Long transcripts are split into windows and the per-window guesses merged
+        suggestions = identify_speakers(llm, transcript_df)
+        st.session_state.ai_usage = suggestions.usage.summary() + f" over {suggestions.windows} transcript windows"
+        if suggestions.failed_windows:
+            st.warning(f"{suggestions.failed_windows} of {suggestions.windows} transcript windows could not be analysed.")
+        result = suggestions.as_text()
 
         # Display the AI's response for debugging
         st.write("AI's Response:")
@@ -224,13 +193,13 @@ with col1:
     uploaded_file = st.file_uploader("Choose a WAV file", type=["wav"])
 
     if uploaded_file is not None:
-        # Generate a unique filename
-        unique_filename = f"{uuid.uuid4()}_audio.wav"
-        with open(unique_filename, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        st.session_state.file_path = unique_filename
+        # Save once per upload to this session's folder; large files are transcoded for upload
+        with st.spinner("Preparing audio..."):
+            audio = ingest(uploaded_file)
+        st.session_state.file_path = audio.original_path
+        st.session_state.upload_path = audio.upload_path
 
-        st.audio(unique_filename, format="audio/wav")
+        st.audio(audio.original_path, format="audio/wav")
 
         # Custom vocabulary input
         st.markdown("<h2 class='section-title'>Custom Vocabulary</h2>", unsafe_allow_html=True)
@@ -243,24 +212,9 @@ with col1:
             index=1
         )
 
-        # Check if the file size exceeds 200MB
-        if os.path.getsize(unique_filename) > 200 * 1024 * 1024:
-            st.warning("The file size exceeds 200MB. Compressing...")
-
-            # Compress the audio file
-            compressed_file_path = compress_audio(unique_filename)
-
-            # Update the file path in session state
-            st.session_state.file_path = compressed_file_path
-
-            # Show the compressed file size
-            compressed_file_size = os.path.getsize(compressed_file_path) / (1024 * 1024)  # Convert to MB
-            st.success(f"File compressed to {compressed_file_size:.2f} MB")
-
-            # Play the compressed audio file
-            st.audio(compressed_file_path, format="audio/wav")
-        else:
-            st.session_state.file_path = unique_filename
+        if audio.compressed:
+            st.success(f"File compressed from {audio.original_size / (1024 * 1024):.2f} MB "
+                       f"to {audio.upload_size / (1024 * 1024):.2f} MB for upload")
 
         set_speakers = st.checkbox("Specify the number of speakers")
         if set_speakers:
@@ -272,7 +226,7 @@ with col1:
             with st.spinner("Transcribing audio..."):
                 # Transcribe the uploaded file with custom vocabulary and boost settings
                 transcript = transcribe_audio(
-                    st.session_state.file_path,
+                    st.session_state.upload_path,
                     num_speakers=num_speakers,
                     word_boost=word_boost_list,
                     boost_param=boost_param
@@ -282,8 +236,12 @@ with col1:
                     st.success("Transcription Successful!")
 
                     # Process transcript data
-                    data = [(u.speaker, u.text, u.start / 1000, u.end / 1000, u.confidence) for u in transcript.utterances]
-                    st.session_state.df = pd.DataFrame(data, columns=["Speaker", "Text", "Start", "End", "Confidence"])
+                    utterances, words = transcript_records(transcript)
+                    # The only copy of the transcript, so it counts against the budget but is never evicted
+                    transcript_df = session_state().put('diarization.transcript',
+                                                        pd.DataFrame(utterances, columns=UTTERANCE_COLUMNS), pinned=True)
+                    # Word timings feed the search box; hits play from the original WAV
+                    session_index().add(transcript.id, uploaded_file.name, words, st.session_state.file_path)
 
                     st.session_state.transcript_generated = True
                 else:
@@ -291,32 +249,36 @@ with col1:
 
 with col2:
     if st.session_state.transcript_generated:
+        transcript_df = session_state().get('diarization.transcript')
         st.markdown("<h2 class='section-title'>Full Transcript</h2>", unsafe_allow_html=True)
 
-        # Display the transcript using st.dataframe for efficiency
-        st.dataframe(st.session_state.df)
+        # One element per page of utterances, cached per transcript and speaker names
+        show_transcript(transcript_df, st.session_state.speaker_names)
+        show_search(session_index())
 
         if st.button("Save Transcript", key="save_transcript"):
-            st.session_state.df.to_csv("transcript_data.csv", index=False)
+            transcript_df.to_csv("transcript_data.csv", index=False)
             st.success("Transcript saved as 'transcript_data.csv'")
 
         # Add a button to get AI suggestions
         if st.button("Get AI Suggestions", key="get_ai_suggestions"):
             with st.spinner("Fetching AI suggestions..."):
                 # Get AI suggestions
-                ai_suggestions_response = get_ai_suggestions(st.session_state.df)
+                ai_suggestions_response = get_ai_suggestions(transcript_df)
                 st.session_state.ai_suggestions = ai_suggestions_response
                 st.session_state.ai_suggestions_generated = True
                 st.success("AI suggestions fetched successfully!")
 
     if st.session_state.ai_suggestions_generated:
         st.markdown("<h2 class='section-title'>Speaker Identification</h2>", unsafe_allow_html=True)
+        if st.session_state.get('ai_usage'):
+            st.caption(st.session_state.ai_usage)
 
         # Parse AI suggestions
         ai_suggestions_dict = parse_ai_suggestions(st.session_state.ai_suggestions)
 
         # Group utterances by speaker
-        speaker_utterances = st.session_state.df.groupby("Speaker")
+        speaker_utterances = transcript_df.groupby("Speaker")
 
         for speaker, utterances in speaker_utterances:
             with st.expander(f"Speaker {speaker}", expanded=True):
@@ -345,12 +307,12 @@ with col2:
 
         if st.button("Apply Speaker Names", key="apply_names"):
             # Map the speaker numbers to names
-            st.session_state.df['Speaker'] = st.session_state.df['Speaker'].map(st.session_state.speaker_names)
+            transcript_df['Speaker'] = transcript_df['Speaker'].map(st.session_state.speaker_names)
             st.success("Speaker names applied to the transcript!")
 
             st.markdown("<h2 class='section-title'>Final Transcript with Identified Speakers</h2>", unsafe_allow_html=True)
-            st.dataframe(st.session_state.df)
+            st.dataframe(transcript_df)
 
             if st.button("Save Final Transcript", key="save_final_transcript"):
-                st.session_state.df.to_csv("final_transcript_data.csv", index=False)
+                transcript_df.to_csv("final_transcript_data.csv", index=False)
                 st.success("Final transcript saved as 'final_transcript_data.csv'")
@@ -1,9 +1,15 @@
 import streamlit as st
 import gspread
-import pandas as pd
 from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
 from difflib import get_close_matches
 import math
+import numpy as np
+from crm import tracing
+from crm.catalogue import shared_catalogue
+from crm.logo_cache import LogoCache
+from crm.session_state import session_state
+from crm.university_cards import grid_html
 
 # Use your service account info from Streamlit secrets
 SERVICE_ACCOUNT_INFO = st.secrets["gcp_service_account"]
@@ -11,25 +17,25 @@ SERVICE_ACCOUNT_INFO = st.secrets["gcp_service_account"]
 # Define the scopes
 SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
 
-# Authenticate and build the Google Sheets service
-@st.cache_resource
-def get_google_sheet_client():
+# The catalogue is downloaded again only when the sheet changes on Drive
+def connect():
     creds = Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO, scopes=SCOPES)
-    return gspread.authorize(creds)
+    return gspread.authorize(creds), build('drive', 'v3', credentials=creds)
 
-# Function to load data from Google Sheets
-@st.cache_data
-def load_data(spreadsheet_id, sheet_name):
-    client = get_google_sheet_client()
-    sheet = client.open_by_key(spreadsheet_id).worksheet(sheet_name)
-    data = sheet.get_all_records()
-    df = pd.DataFrame(data)
-    
-    # Clean Tuition Price and Application Fee Price columns
-    df['Tuition Price'] = pd.to_numeric(df['Tuition Price'], errors='coerce')
-    df['Application Fee Price'] = pd.to_numeric(df['Application Fee Price'], errors='coerce')
-    
-    return df
+# Catalogue column -> key in st.session_state.filters
+FILTER_COLUMNS = {
+    'Major': 'major',
+    'Country': 'country',
+    'Level': 'program_level',
+    'Field': 'field',
+    'Adjusted Speciality': 'specialty',
+    'Institution Type': 'institution_type',
+}
+
+# Logo thumbnails are shared by every session of the server process
+@st.cache_resource
+def get_logo_cache():
+    return LogoCache()
 
 # Function to implement fuzzy matching
 def fuzzy_search(term, options):
@@ -38,6 +44,7 @@ def fuzzy_search(term, options):
 
 def main():
     st.set_page_config(layout="wide", page_title="University Search Tool")
+    tracing.start_rerun("Universities")
     
     # Updated Custom CSS for styling
     st.markdown("""
@@ -228,8 +235,11 @@ def main():
 
 
     # Load the data
-    # Load the data
-    df = load_data(SPREADSHEET_ID, SHEET_NAME)
+    with tracing.span("sheets.load_catalogue"):
+        catalogue = shared_catalogue(SPREADSHEET_ID, SHEET_NAME, connect).current()
+    df = catalogue.frame
+    prices = catalogue.prices
+    tuition_min, tuition_max = math.floor(prices.min), math.ceil(prices.max)
 
     # Initialize session state for filters and reset flag
     if 'filters' not in st.session_state:
@@ -240,8 +250,8 @@ def main():
             'field': 'All',
             'specialty': 'All',
             'institution_type': 'All',
-            'tuition_min': int(df['Tuition Price'].min()),
-            'tuition_max': int(df['Tuition Price'].max())
+            'tuition_min': tuition_min,
+            'tuition_max': tuition_max
         }
     if 'reset_filters' not in st.session_state:
         st.session_state.reset_filters = False
@@ -257,8 +267,8 @@ def main():
             'field': 'All',
             'specialty': 'All',
             'institution_type': 'All',
-            'tuition_min': int(df['Tuition Price'].min()),
-            'tuition_max': int(df['Tuition Price'].max())
+            'tuition_min': tuition_min,
+            'tuition_max': tuition_max
         }
         st.session_state.reset_filters = False
         st.session_state.apply_after_reset = True
@@ -271,7 +281,7 @@ def main():
             return 0
 
     # Major filter (search tool)
-    major_options = ["All"] + sorted(df['Major'].unique().tolist())
+    major_options = ["All"] + catalogue.options['Major']
     st.session_state.filters['major'] = st.selectbox(
         "Search by Major", 
         options=major_options,
@@ -283,7 +293,7 @@ def main():
     with st.container():
         col1, col2, col3 = st.columns(3)
         with col1:
-            country_options = ["All"] + sorted(df['Country'].unique().tolist())
+            country_options = ["All"] + catalogue.options['Country']
             st.session_state.filters['country'] = st.selectbox(
                 "Country", 
                 options=country_options,
@@ -291,7 +301,7 @@ def main():
                 index=get_index(country_options, st.session_state.filters['country'])
             )
         with col2:
-            level_options = ["All"] + sorted(df['Level'].unique().tolist())
+            level_options = ["All"] + catalogue.options['Level']
             st.session_state.filters['program_level'] = st.selectbox(
                 "Program level", 
                 options=level_options,
@@ -299,7 +309,7 @@ def main():
                 index=get_index(level_options, st.session_state.filters['program_level'])
             )
         with col3:
-            field_options = ["All"] + sorted(df['Field'].unique().tolist())
+            field_options = ["All"] + catalogue.options['Field']
             st.session_state.filters['field'] = st.selectbox(
                 "Field", 
                 options=field_options,
@@ -309,7 +319,7 @@ def main():
 
         col4, col5 = st.columns(2)
         with col4:
-            specialty_options = ["All"] + sorted(df['Adjusted Speciality'].unique().tolist())
+            specialty_options = ["All"] + catalogue.options['Adjusted Speciality']
             st.session_state.filters['specialty'] = st.selectbox(
                 "Specialty", 
                 options=specialty_options,
@@ -317,7 +327,7 @@ def main():
                 index=get_index(specialty_options, st.session_state.filters['specialty'])
             )
         with col5:
-            institution_options = ["All"] + sorted(df['Institution Type'].unique().tolist())
+            institution_options = ["All"] + catalogue.options['Institution Type']
             st.session_state.filters['institution_type'] = st.selectbox(
                 "Institution Type", 
                 options=institution_options,
@@ -327,8 +337,8 @@ def main():
 
     st.session_state.filters['tuition_min'], st.session_state.filters['tuition_max'] = st.slider(
         "Tuition fee range (CAD)",
-        min_value=int(df['Tuition Price'].min()),
-        max_value=int(df['Tuition Price'].max()),
+        min_value=tuition_min,
+        max_value=tuition_max,
         value=(st.session_state.filters['tuition_min'], st.session_state.filters['tuition_max']),
         key='tuition_filter'
     )
@@ -341,100 +351,41 @@ def main():
             st.session_state.reset_filters = True
             st.rerun()
 
-    if apply_filters or st.session_state.apply_after_reset or 'filtered_df' not in st.session_state:
-        filtered_df = df.copy()
-        
-        if st.session_state.filters['major'] != "All":
-            filtered_df = filtered_df[filtered_df['Major'] == st.session_state.filters['major']]
-
-        if st.session_state.filters['country'] != "All":
-            filtered_df = filtered_df[filtered_df['Country'] == st.session_state.filters['country']]
-        
-        if st.session_state.filters['program_level'] != "All":
-            filtered_df = filtered_df[filtered_df['Level'] == st.session_state.filters['program_level']]
-        
-        if st.session_state.filters['field'] != "All":
-            filtered_df = filtered_df[filtered_df['Field'] == st.session_state.filters['field']]
-        
-        if st.session_state.filters['specialty'] != "All":
-            filtered_df = filtered_df[filtered_df['Adjusted Speciality'] == st.session_state.filters['specialty']]
-        
-        if st.session_state.filters['institution_type'] != "All":
-            filtered_df = filtered_df[filtered_df['Institution Type'] == st.session_state.filters['institution_type']]
-        
-        filtered_df = filtered_df[
-            (filtered_df['Tuition Price'] >= st.session_state.filters['tuition_min']) & 
-            (filtered_df['Tuition Price'] <= st.session_state.filters['tuition_max'])
-        ]
-        
-        st.session_state.filtered_df = filtered_df
+    # The session keeps only the row positions of its results, over the shared catalogue
+    state = session_state()
+    results = state.view('universities.results', catalogue.version)
+    # Results filtered from an older catalogue point at rows that may have moved
+    if apply_filters or st.session_state.apply_after_reset or results is None:
+        # Tuition range first: two binary searches over the sorted CAD prices
+        mask = prices.mask(st.session_state.filters['tuition_min'], st.session_state.filters['tuition_max'])
+        for column, name in FILTER_COLUMNS.items():
+            if st.session_state.filters[name] != "All":
+                mask &= (df[column] == st.session_state.filters[name]).to_numpy()
+        results = state.put_view('universities.results', catalogue.version, np.flatnonzero(mask))
         st.session_state.current_page = 1  # Reset to first page when new filter is applied
         st.session_state.apply_after_reset = False  # Reset the flag
-    else:
-        filtered_df = st.session_state.filtered_df
 
     # Display results
-    st.subheader(f"Showing {len(filtered_df)} results")
+    st.subheader(f"Showing {len(results)} results")
     
     # Pagination
-    items_per_page = 16  # Changed to 16 for a 4x4 grid
-    total_pages = math.ceil(len(filtered_df) / items_per_page)
+    items_per_page = st.selectbox("Results per page", [16, 32, 64], key="items_per_page")
+    total_pages = math.ceil(len(results) / items_per_page)
     
     if 'current_page' not in st.session_state:
         st.session_state.current_page = 1
+    st.session_state.current_page = max(1, min(st.session_state.current_page, total_pages))
     
     start_idx = (st.session_state.current_page - 1) * items_per_page
     end_idx = start_idx + items_per_page
     
-    # Display university cards with a consistent layout
-    for i in range(0, min(items_per_page, len(filtered_df) - start_idx), 4):
-        cols = st.columns(4)  # Create a grid layout with four columns
-        for j in range(4):
-            if i + j < len(filtered_df[start_idx:end_idx]):
-                row = filtered_df.iloc[start_idx + i + j]
-                with cols[j]:
-                    prime_tags = [row[f'prime {k}'] for k in range(2, 6) if pd.notna(row[f'prime {k}'])]
-                    prime_tags_html = ''.join([f'<span class="prime-tag">{tag}</span>' for tag in prime_tags])
-
-                    st.markdown(f'''
-                    <div class="university-card">
-                        <div class="university-header">
-                            <img src="{row['Picture']}" class="university-logo" alt="{row['University Name']} logo">
-                            <div class="university-name">{row['University Name']}</div>
-                        </div>
-                        <div class="speciality-name">{row['Speciality']}</div>
-                        <div class="prime-tags">{prime_tags_html}</div>
-                        <div class="info-container">
-                            <div>
-                                <div class="info-row">
-                                    <span>Location:</span>
-                                    <span>{row['City']}, {row['Country']}</span>
-                                </div>
-                                <div class="info-row">
-                                    <span>Tuition:</span>
-                                    <span>${row['Tuition Price']:,.0f} {row['Tuition Currency']}/Year</span>
-                                </div>
-                                <div class="info-row">
-                                    <span>Application fee:</span>
-                                    <span>${row['Application Fee Price']:,.0f} {row['Application Fee Currency']}</span>
-                                </div>
-                                <div class="info-row">
-                                    <span>Duration:</span>
-                                    <span>{row['Duration']}</span>
-                                </div>
-                                <div class="info-row">
-                                    <span>Level:</span>
-                                    <span>{row['Level']}</span>
-                                </div>
-                                <div class="info-row">
-                                    <span>Field:</span>
-                                    <span>{row['Field']}</span>
-                                </div>
-                            </div>
-                            <!-- Removed Apply Now button -->
-                        </div>
-                    </div>
-                    ''', unsafe_allow_html=True)
+    # Display university cards as one grid built from the cached per-row cards
+    with tracing.span("universities.render_cards"):
+        page = df.iloc[results.rows[start_idx:end_idx]]
+        # Small local thumbnails instead of the full-size logos on their hosts
+        logos = get_logo_cache().sources(page['Picture'])
+        fragments = catalogue.fragments.loc[page.index]
+        st.markdown(grid_html(fragments, [logos.get(url, url) for url in page['Picture']]), unsafe_allow_html=True)
     
     # Pagination controls
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -1,45 +1,53 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-import gspread
-import time
-
-# Use Streamlit secrets for service account info
-SERVICE_ACCOUNT_INFO = st.secrets["gcp_service_account"]
-
-# Define the scopes
-SCOPES = ['https://www.googleapis.com/auth/drive', 'https://www.googleapis.com/auth/spreadsheets']
-
-# Authenticate and build the Google Sheets service
-@st.cache_resource
-def get_google_sheet_client():
-    creds = Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO, scopes=SCOPES)
-    return gspread.authorize(creds)
+from crm import tracing
+from crm.bulk_import import import_students
+from crm.students import DuplicateStudentError, get_student_table, new_student_record, validate_student
 
 # Function to add a new student to the Google Sheet
-def add_student_to_sheet(student_data):
-    client = get_google_sheet_client()
-    sheet = client.open_by_key("1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew").worksheet('ALL')
-    sheet.append_row(list(student_data.values()))
+def add_student_to_sheet(student_data, allow_duplicate=False):
+    # Checks for duplicates and appends in one call on the shared worksheet handle
+    table = get_student_table()
+    return table.append(student_data, allow_duplicate=allow_duplicate, actor=st.session_state.get("username"))
 
-# Function to load data from Google Sheets
-@st.cache_data(ttl=5)
+# Function to load the latest students from the shared table
 def load_data():
-    try:
-        client = get_google_sheet_client()
-        sheet = client.open_by_key("1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew").worksheet('ALL')
-        expected_headers = ["DATE", "First Name", "Last Name", "Age", "Gender", "Phone N°", "Address", "E-mail", 
-                            "Emergency contact N°", "Chosen School", "Specialite", "Duration", "Payment Amount", 
-                            "Payment Type", "Compte", "Sevis payment ?", "Application payment ?", "DS-160 maker", 
-                            "Password DS-160", "Secret Q.", "School Entry Date", "Entry Date in the US", 
-                            "ADDRESS in the U.S", "E-MAIL RDV", "PASSWORD RDV", "EMBASSY ITW. DATE", "Attempts", 
-                            "Visa Result", "Agent", "Note", "Stage", "BANK", "Student Name"]
-        data = sheet.get_all_records(expected_headers=expected_headers)
-        return pd.DataFrame(data)
-    except Exception as e:
-        st.error(f"Error loading data from Google Sheet: {e}")
-        raise e
+    table = get_student_table()
+    table.refresh_if_stale()
+    return table
+
+# Bulk import of a season's intake from a CSV or Excel file
+def bulk_import_section():
+    with st.expander("📥 Bulk import from CSV / Excel"):
+        st.markdown("Columns are matched to the sheet headers (e.g. `First Name`, `Last Name`, `Phone N°`, `E-mail`). "
+                    "Rows that fail validation or match an existing student are skipped and listed below.")
+        uploaded_file = st.file_uploader("Upload students", type=["csv", "xlsx"], key="bulk_import_file")
+        if uploaded_file is not None and st.button("Import students", key="bulk_import_button"):
+            progress_text = st.empty()
+
+            def show_progress(rows_read, report):
+                progress_text.text(f"Read {rows_read} rows · added {report.added} · skipped {len(report.rejected)}")
+
+            with st.spinner("Importing students..."):
+                report = import_students(get_student_table(), uploaded_file, progress=show_progress,
+                                         actor=st.session_state.get("username"))
+            if report.error:
+                first_row, last_row = report.failed[0][0], report.failed[-1][0]
+                st.error(f"Import stopped: rows {first_row}–{last_row} could not be written ({report.error}). "
+                         f"{report.added} students were added before that; rows after {last_row} were not read.")
+                failed = report.failed_frame()
+                st.dataframe(failed, use_container_width=True)
+                st.download_button("Download rows not written", failed.to_csv(index=False),
+                                   file_name="unwritten_students.csv", mime="text/csv")
+            else:
+                st.success(f"✅ Added {report.added} students in {report.batches} batch(es).")
+            if report.rejected:
+                rejected = report.rejected_frame()
+                st.warning(f"{len(rejected)} rows were skipped.")
+                st.dataframe(rejected, use_container_width=True)
+                st.download_button("Download skipped rows", rejected.to_csv(index=False),
+                                   file_name="skipped_students.csv", mime="text/csv")
 
 # Custom CSS to make the app beautiful and modern
 def load_css():
@@ -92,6 +100,7 @@ def load_css():
 # Streamlit app
 def main():
     st.set_page_config(page_title="Add New Student", layout="wide")
+    tracing.start_rerun("New Student")
     load_css()
 
     st.title("🎓 Add New Student")
@@ -108,101 +117,87 @@ def main():
         col1, col2 = st.columns(2)
 
         with col1:
-            date = st.date_input("📅 Date", datetime.now())
-            first_name = st.text_input("👤 First Name")
-            last_name = st.text_input("👤 Last Name")
-            gender = st.selectbox("⚧ Gender", ["Male", "Female"])
-            phone = st.text_input("📞 Phone Number")
-            address = st.text_input("🏠 Address")
-            email = st.text_input("📧 Email")
-            emergency_contact = st.text_input("🆘 Emergency Contact Number")
+            date = st.date_input("📅 Date", datetime.now(), key="form_date")
+            first_name = st.text_input("👤 First Name", key="form_first_name")
+            last_name = st.text_input("👤 Last Name", key="form_last_name")
+            gender = st.selectbox("⚧ Gender", ["Male", "Female"], key="form_gender")
+            phone = st.text_input("📞 Phone Number", key="form_phone")
+            address = st.text_input("🏠 Address", key="form_address")
+            email = st.text_input("📧 Email", key="form_email")
+            emergency_contact = st.text_input("🆘 Emergency Contact Number", key="form_emergency_contact")
 
         with col2:
-            age = st.text_input("👤 Age")
+            age = st.text_input("👤 Age", key="form_age")
             school_options = ["University", "Community College", "CCLS Miami", "CCLS NY NJ", "Connect English",
                               "CONVERSE SCHOOL", "ELI San Francisco", "F2 Visa", "GT Chicago", "BEA Huston", "BIA Huston",
                               "OHLA Miami", "UCDEA", "HAWAII", "Not Partner", "Not yet"]
-            chosen_school = st.selectbox("🏫 Chosen School", school_options)
-            specialite = st.text_input("📚 Specialite")
-            duration = st.text_input("⏳ Duration")
+            chosen_school = st.selectbox("🏫 Chosen School", school_options, key="form_chosen_school")
+            specialite = st.text_input("📚 Specialite", key="form_specialite")
+            duration = st.text_input("⏳ Duration", key="form_duration")
             payment_amount_options = ["159.000 DZD", "152.000 DZD", "139.000 DZD", "132.000 DZD", "36.000 DZD", "20.000 DZD", "Giveaway", "No Paiement"]
-            payment_amount = st.selectbox("💰 Payment Amount", payment_amount_options)
-            payment_type = st.selectbox("💳 Payment Type", ["Cash", "CCP", "Baridimob", "Bank"])
-            compte = st.selectbox("🏦 Compte", ["Mohamed", "Sid Ali"])
+            payment_amount = st.selectbox("💰 Payment Amount", payment_amount_options, key="form_payment_amount")
+            payment_type = st.selectbox("💳 Payment Type", ["Cash", "CCP", "Baridimob", "Bank"], key="form_payment_type")
+            compte = st.selectbox("🏦 Compte", ["Mohamed", "Sid Ali"], key="form_compte")
             agent_options = ["Nesrine", "Hamza", "Djazila","Nada"]
-            agent = st.selectbox("👨‍💼 Agent", agent_options)
+            agent = st.selectbox("👨‍💼 Agent", agent_options, key="form_agent")
 
+        allow_duplicate = st.checkbox("Add even if a matching student already exists", key="form_allow_duplicate")
         submit_button = st.form_submit_button("Add Student")
 
     if submit_button:
-        # Show a spinner while processing
-        with st.spinner('Adding student to database...'):
-            # Prepare student data
-            student_data = {
-                "DATE": date.strftime("%d/%m/%Y %H:%M:%S"),
-                "First Name": first_name,
-                "Last Name": last_name,
-                "Age": age,
-                "Gender": gender,
-                "Phone N°": phone,
-                "Address": address,
-                "E-mail": email,
-                "Emergency contact N°": emergency_contact,
-                "Chosen School": chosen_school,
-                "Specialite": specialite,
-                "Duration": duration,
-                "BANK": "",
-                "Payment Amount": payment_amount,
-                "Payment Type": payment_type,
-                "Compte": compte,
-                "Sevis payment ?": "NO",
-                "Application payment ?": "NO",
-                "DS-160 maker": "",
-                "Password DS-160": "",
-                "Secret Q.": "",
-                "School Entry Date": "",
-                "Entry Date in the US": "",
-                "ADDRESS in the U.S": "",
-                "E-MAIL RDV": "",
-                "PASSWORD RDV": "",
-                "EMBASSY ITW. DATE": "",
-                "Attempts": "1st Try",
-                "Visa Result": "",
-                "Agent": agent,
-                "Prep ITW": "NO",
-                "School Paid": "NO",
-                "Visa Result": "",
-                "Note": "",
-                "Stage": "PAYMENT & MAIL",
-                "BANK": "",
-                "Student Name": f"{first_name} {last_name}"
-            }
-
-            # Add student to sheet
-            add_student_to_sheet(student_data)
-            time.sleep(1)  # Simulate processing time
-
-        # Set success message
-        st.session_state.success_message = f"✅ Student {first_name} {last_name} added successfully!"
-        st.session_state.form_submitted = True
-
-        # Clear the form by resetting the session state
-        for key in st.session_state.keys():
-            if key not in ['form_submitted', 'success_message']:
-                del st.session_state[key]
-
-        # Rerun the app to show the success message and clear the form
-        st.rerun()
+        # Prepare student data
+        student_data = new_student_record({
+            "DATE": date.strftime("%d/%m/%Y %H:%M:%S"),
+            "First Name": first_name.strip(),
+            "Last Name": last_name.strip(),
+            "Age": age,
+            "Gender": gender,
+            "Phone N°": phone.strip(),
+            "Address": address,
+            "E-mail": email.strip(),
+            "Emergency contact N°": emergency_contact.strip(),
+            "Chosen School": chosen_school,
+            "Specialite": specialite,
+            "Duration": duration,
+            "Payment Amount": payment_amount,
+            "Payment Type": payment_type,
+            "Compte": compte,
+            "Agent": agent,
+        })
+
+        errors = validate_student(student_data)
+        if errors:
+            for error in errors:
+                st.error(error)
+        else:
+            try:
+                with st.spinner('Adding student to database...'):
+                    add_student_to_sheet(student_data, allow_duplicate=allow_duplicate)
+            except DuplicateStudentError as e:
+                st.error(f"⚠️ {e}. Tick the box above to add this student anyway.")
+            else:
+                # Set success message
+                st.session_state.success_message = f"✅ Student {first_name} {last_name} added successfully!"
+                st.session_state.form_submitted = True
+
+                # Clear the form fields only; the rest of the session (login, caches) is kept
+                for key in [key for key in st.session_state.keys() if key.startswith("form_") and key != "form_submitted"]:
+                    del st.session_state[key]
+
+                # Rerun the app to show the success message and clear the form
+                st.rerun()
 
     # Display success message if it exists
     if st.session_state.success_message:
         st.markdown(f'<p class="success-message">{st.session_state.success_message}</p>', unsafe_allow_html=True)
         st.session_state.success_message = None  # Clear the message after displaying
 
+    bulk_import_section()
+
     # Display the latest data
     st.subheader("Latest Students")
-    data = load_data()
-    st.dataframe(data.tail(5))  # Show the last 5 entries
+    table = load_data()
+    st.dataframe(table.tail(5))  # Show the last 5 entries, new rows are patched in without a refetch
 
 if __name__ == "__main__":
     main()
@@ -7,16 +7,23 @@ from datetime import datetime, timedelta
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
-import plotly.express as px
 import functools
 import logging
 import asyncio
 import aiohttp
 import threading
-import numpy as np
 import string
-import time
 import re
+from crm import tracing
+from crm.analytics import PipelineStats, render_dashboard
+from crm.catalogue import SHEET_NAME as CATALOGUE_SHEET, SPREADSHEET_ID as CATALOGUE_ID, shared_catalogue
+from crm.edit_session import cell_text
+from crm.event_log import default_log, student_name as event_student
+from crm.identity import student_key
+from crm.recommender import recommender_for, render_recommendations
+from crm.session_state import session_state
+from crm.student_index import StudentIndex
+from crm.workbook import load_workbook
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -26,9 +33,16 @@ def on_student_select():
     st.session_state.student_changed = True
 
 def reload_data(spreadsheet_id):
-    data = load_data(spreadsheet_id)
-    st.session_state['data'] = data
-    return data
+    # Reloaded by the session state if it is evicted to keep the session in budget
+    return session_state().put('students.data', load_data(spreadsheet_id),
+                               loader=functools.partial(load_data, spreadsheet_id))
+
+def student_index(data):
+    # Built once per load of the data; saves patch it in place
+    index = session_state().get('students.index')
+    if index is None or index.frame is not data:
+        index = session_state().put('students.index', StudentIndex(data))
+    return index
 
 # Caching decorator
 def cache_with_timeout(timeout_minutes=60):
@@ -86,109 +100,134 @@ def upload_file_to_drive(file_path, mime_type, folder_id=None):
         return file_id
     return None
 
+# The universities catalogue shared with the search page, for recommendations
+def get_catalogue():
+    return shared_catalogue(CATALOGUE_ID, CATALOGUE_SHEET,
+                            lambda: (get_google_sheet_client(), get_google_drive_service()))
+
+# Shared by every session; only rows that changed since the last rerun are re-counted
+@st.cache_resource
+def get_pipeline_stats():
+    return PipelineStats()
+
+DATE_COLUMNS = ['DATE', 'School Entry Date', 'Entry Date in the US', 'EMBASSY ITW. DATE']
+
+def open_workbook(spreadsheet_id):
+    # Every worksheet in one request, one edit session per worksheet;
+    # saves send only the changed cells
+    sheet = get_google_sheet_client().open_by_key(spreadsheet_id)
+    return load_workbook(sheet, event_log=default_log(), source="Students",
+                         actor=st.session_state.get("username"))
+
+def load_edit_sessions(spreadsheet_id):
+    # Only when the sessions were evicted: the fresh read becomes the base the
+    # saves compare against, so cells others changed before it are not conflicts
+    return open_workbook(spreadsheet_id).sessions
+
+@tracing.traced("sheets.load_data")
 def load_data(spreadsheet_id):
-    sheet_headers = {
-        'ALL': [
-            'DATE','First Name', 'Last Name','Age', 'Phone N°', 'Address', 'E-mail', 
-            'Emergency contact N°', 'Chosen School', 'Specialite', 'Duration', 
-            'Payment Amount', 'Sevis payment ?', 'Application payment ?', 'DS-160 maker', 
-            'Password DS-160', 'Secret Q.', 'School Entry Date', 'Entry Date in the US', 
-            'ADDRESS in the U.S', 'E-MAIL RDV', 'PASSWORD RDV', 'EMBASSY ITW. DATE', 
-            'Attempts', 'Visa Result', 'Agent', 'Note', 'Stage','Gender','BANK','Prep ITW','School Paid'
-        ]
-    }
-    
     try:
-        client = get_google_sheet_client()
-        sheet = client.open_by_key(spreadsheet_id)
+        workbook = open_workbook(spreadsheet_id)
+        edit_sessions = workbook.sessions
         
-        combined_data = pd.DataFrame()
+        # One concat of all the sheets; rows remember where they live so
+        # they can be saved back in place
+        combined_data = workbook.frame()
         
-        for worksheet in sheet.worksheets():
-            title = worksheet.title
-            expected_headers = sheet_headers.get(title, None)
-            
-            if expected_headers:
-                data = worksheet.get_all_records(expected_headers=expected_headers, value_render_option='UNFORMATTED_VALUE')
-            else:
-                data = worksheet.get_all_records(value_render_option='UNFORMATTED_VALUE')
-            
-            df = pd.DataFrame(data)
-            if not df.empty:
-                # Ensure phone numbers and other text fields are treated as strings
-                text_columns = ['First Name', 'Last Name', 'Phone N°', 'Emergency contact N°', 'E-mail', 'Address']
-                for col in text_columns:
-                    if col in df.columns:
-                        df[col] = df[col].astype(str)
-                
-                # Create Student Name column
-                if 'First Name' in df.columns and 'Last Name' in df.columns:
-                    df['Student Name'] = df['First Name'] + " " + df['Last Name']
-                
-                # Parse dates
-                date_columns = ['DATE', 'School Entry Date', 'Entry Date in the US', 'EMBASSY ITW. DATE']
-                for col in date_columns:
-                    if col in df.columns:
-                        df[col] = pd.to_datetime(df[col], errors='coerce', dayfirst=True)
-                
-                df.dropna(subset=['Student Name'], inplace=True)
-                df.dropna(how='all', inplace=True)
-                combined_data = pd.concat([combined_data, df], ignore_index=True)
+        # Create Student Name column
+        if 'First Name' in combined_data.columns and 'Last Name' in combined_data.columns:
+            combined_data['Student Name'] = combined_data['First Name'] + " " + combined_data['Last Name']
+        
+        # Parse dates
+        for col in DATE_COLUMNS:
+            if col in combined_data.columns:
+                combined_data[col] = pd.to_datetime(combined_data[col], errors='coerce', dayfirst=True)
+        
+        combined_data.dropna(subset=['Student Name'], inplace=True)
+        combined_data.dropna(how='all', inplace=True)
         
         # Handle duplicates by appending a number to duplicate names
-        combined_data['Student Name'] = combined_data['Student Name'].astype(str)
-        name_counts = combined_data['Student Name'].value_counts()
-        for name, count in name_counts.items():
-            if count > 1:
-                indices = combined_data[combined_data['Student Name'] == name].index
-                for i, idx in enumerate(indices):
-                    combined_data.at[idx, 'Student Name'] = f"{name} {i+1}"
+        names = combined_data['Student Name'].astype(str)
+        duplicated = names.duplicated(keep=False)
+        numbers = names[duplicated].groupby(names[duplicated], sort=False).cumcount() + 1
+        combined_data['Student Name'] = names.mask(duplicated, names + " " + numbers.astype(str))
+        logger.info("Students loaded in one request of %.0f ms; per sheet:\n%s", workbook.fetch_ms,
+                    workbook.timings_frame().to_string(index=False))
         
         combined_data.reset_index(drop=True, inplace=True)
+        # The base the saves compare against; they hold every row as text, so
+        # they may be evicted and are then read again
+        session_state().put('students.edit_sessions', edit_sessions,
+                            loader=functools.partial(load_edit_sessions, spreadsheet_id))
 
         return combined_data
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
         return pd.DataFrame()
 
-def save_data(df, spreadsheet_id, sheet_name):
-    logger.info("Attempting to save changes")
-
-    # Handle duplicates by appending a number to duplicate names
-    df['Student Name'] = df['Student Name'].astype(str)
-    name_counts = df['Student Name'].value_counts()
-    for name, count in name_counts.items():
-        if count > 1:
-            indices = df[df['Student Name'] == name].index
-            for i, idx in enumerate(indices):
-                df.at[idx, 'Student Name'] = f"{name} {i+1}"
-    
-    try:
-        client = get_google_sheet_client()
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        sheet = spreadsheet.worksheet(sheet_name)
-
-        # Convert DATE column back to string for saving
-        date_columns = ['DATE', 'School Entry Date', 'Entry Date in the US', 'EMBASSY ITW. DATE']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], dayfirst=True, errors='coerce')  # Ensure DATE is datetime
-                df[col] = df[col].dt.strftime('%d/%m/%Y %H:%M:%S')
-
-        # Replace problematic values with a placeholder
-        df.replace([np.inf, -np.inf, np.nan], 'NaN', inplace=True)
-
-        # Clear the existing sheet
-        sheet.clear()
-
-        # Update the sheet with new data, including the "Student Name" column
-        sheet.update([df.columns.values.tolist()] + df.values.tolist())
-
-        logger.info("Changes saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving changes: {str(e)}")
-        return False
+def changed_cells(student, updates):
+    """Cells of ``updates`` that differ from the loaded ``student`` row."""
+    changes = {}
+    for column, value in updates.items():
+        # Widget keys initialised to None at the top of main() mean "not edited"
+        if value is None:
+            continue
+        current = student.get(column)
+        if column in DATE_COLUMNS:
+            new_date = pd.to_datetime(value, errors='coerce', dayfirst=True)
+            if pd.isna(new_date):
+                continue
+            # date_input has no time part; an unchanged day is not an edit
+            if not pd.isna(current) and new_date.date() == pd.Timestamp(current).date():
+                continue
+            value = new_date.to_pydatetime()
+        elif cell_text(value) == cell_text(current):
+            continue
+        changes[column] = value
+    return changes
+
+@tracing.traced("sheets.save_data")
+def save_student(data, student, updates):
+    """Save the changed cells of one student and patch ``data`` in place.
+
+    Returns the ``SaveResult``; conflicting cells are left untouched in the sheet.
+    """
+    changes = changed_cells(student, updates)
+    if not changes:
+        return None
+    session = session_state().get('students.edit_sessions')[student['_sheet']]
+    if 'Student Name' in session.header and ({'First Name', 'Last Name'} & set(changes)):
+        first = changes.get('First Name', student['First Name'])
+        last = changes.get('Last Name', student['Last Name'])
+        changes['Student Name'] = f"{first} {last}"
+    row = int(student['_row'])
+    logger.info("Saving %d cells of sheet row %d", len(changes), row)
+    result = session.save({row: changes})
+
+    # Mirror what the sheet now holds (including other agents' cells) in the loaded data
+    if row in session.rows:
+        index = data.index[(data['_sheet'] == student['_sheet']) & (data['_row'] == row)]
+        for column in session.header:
+            if column in data.columns and column != 'Student Name':
+                value = session.value(row, column)
+                if column in DATE_COLUMNS:
+                    value = pd.to_datetime(value, errors='coerce', dayfirst=True)
+                data.loc[index, column] = value
+        # The patched row may now belong to other filter views
+        student_index(data).update(data.index.get_indexer(index))
+    return result
+
+def show_save_result(result, message):
+    if result is None:
+        st.info("Nothing to save.")
+    elif result.moved_rows:
+        st.error("This student's row was moved or deleted by someone else. Reload the data and try again.")
+    elif result.conflicts:
+        st.warning("Someone else changed some of these fields since you loaded the data; "
+                   "their values were kept. Save again to overwrite them.")
+        st.dataframe(pd.DataFrame([conflict.as_dict() for conflict in result.conflicts]), hide_index=True)
+    else:
+        st.success(message)
 
 def format_date(date_string):
     if pd.isna(date_string) or date_string == 'NaT':
@@ -384,7 +423,8 @@ async def check_folder_exists_async(folder_name, parent_id, service):
 async def list_files_in_folder_async(folder_id, service):
     try:
         query = f"'{folder_id}' in parents and trashed=false"
-        results = service.files().list(q=query, spaces='drive', fields='files(id, name, webViewLink)').execute()
+        with tracing.span("drive.list_files"):
+            results = service.files().list(q=query, spaces='drive', fields='files(id, name, webViewLink)').execute()
         return results.get('files', [])
     except Exception as e:
         logger.error(f"An error occurred while listing files in folder: {str(e)}")
@@ -409,6 +449,7 @@ def trash_file_in_drive(file_id, student_name):
         st.error(f"An error occurred while moving the file to trash: {str(e)}")
         return False
 
+@tracing.traced("drive.get_document_status")
 def get_document_status(student_name):
     if 'document_status_cache' not in st.session_state:
         st.session_state['document_status_cache'] = {}
@@ -441,6 +482,7 @@ def update_student_data(*args, **kwargs):
 # Main function
 def main():
     st.set_page_config(page_title="Student Application Tracker", layout="wide")
+    tracing.start_rerun("Students")
     
     if 'student_changed' not in st.session_state:
         st.session_state.student_changed = False
@@ -537,18 +579,15 @@ def main():
 
     spreadsheet_id = "1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew"
     
-    if 'data' not in st.session_state or st.session_state.get('reload_data', False):
-        data = load_data(spreadsheet_id)
-        st.session_state['data'] = data
+    if 'students.data' not in session_state() or st.session_state.get('reload_data', False):
+        data = reload_data(spreadsheet_id)
         st.session_state['reload_data'] = False
     else:
-        data = st.session_state['data']
-
-    # Combine First Name and Last Name for all rows
-    data['Student Name'] = data['First Name'] + " " + data['Last Name']
+        data = session_state().get('students.data')
 
     if not data.empty:
-        current_steps = ["All"] + list(data['Stage'].unique())
+        students = student_index(data)
+        current_steps = ["All"] + students.options('Stage')
         agents = ["All", "Nesrine", "Hamza", "Djazila","Nada"]
         school_options = ["All", "University", "Community College", "CCLS Miami", "CCLS NY NJ", "Connect English ",
                           "CONVERSE SCHOOL", "ELI San Francisco", "F2 Visa", "GT Chicago", "BEA Huston", "BIA Huston",
@@ -568,23 +607,18 @@ def main():
         with col4:
             attempts_filter = st.selectbox("Filter by Attempts", attempts_options, key="attempts_filter")
 
-        # Apply filters
-        filtered_data = data
-        if status_filter != "All":
-            filtered_data = filtered_data[filtered_data['Stage'] == status_filter]
-        if agent_filter != "All":
-            filtered_data = filtered_data[filtered_data['Agent'] == agent_filter]
-        if school_filter != "All":
-            filtered_data = filtered_data[filtered_data['Chosen School'] == school_filter]
-        if attempts_filter != "All":
-            filtered_data = filtered_data[filtered_data['Attempts'] == attempts_filter]
-
-        # Combine First Name and Last Name for filtered data
-        filtered_data['Student Name'] = filtered_data['First Name'] + " " + filtered_data['Last Name']
-
-        student_names = filtered_data['Student Name'].tolist()
+        with st.expander("📊 Pipeline analytics"):
+            stats = get_pipeline_stats()
+            with tracing.span("students.analytics", rows=len(data)):
+                stats.sync(data)
+                render_dashboard(stats, event_log=default_log())
+
+        # Row positions of the matching students, cached per combination of filters
+        matches = students.view({'Stage': status_filter, 'Agent': agent_filter,
+                               'Chosen School': school_filter, 'Attempts': attempts_filter})
+        student_names = students.names_of(matches)
         
-        if not filtered_data.empty:
+        if len(matches):
             st.markdown('<div class="stCard" style="display: flex; justify-content: space-between;">', unsafe_allow_html=True)
             col2, col1, col3 = st.columns([3, 2, 3])
         
@@ -593,7 +627,7 @@ def main():
                     "🔍 Search for a student (First or Last Name)",
                     options=student_names,
                     key="search_query",
-                    index=student_names.index(st.session_state.selected_student) if st.session_state.selected_student in student_names else 0,
+                    index=students.locate(st.session_state.selected_student, matches) or 0,
                     on_change=on_student_select
                 )
                 # After the selectbox:
@@ -603,8 +637,7 @@ def main():
                     st.rerun()
                 st.subheader("📝 Student Notes")
                 
-                # Get the current note for the selected student
-                selected_student = filtered_data[filtered_data['Student Name'] == search_query].iloc[0]
+                selected_student = students.row(search_query)
                 current_note = selected_student['Note'] if 'Note' in selected_student else ""
             
                 # Create a text area for note input
@@ -612,25 +645,17 @@ def main():
             
                 # Save button for the note
                 if st.button("Save Note"):
-                    # Update the note in the DataFrame
-                    filtered_data.loc[filtered_data['Student Name'] == search_query, 'Note'] = new_note
-                    
-                    # Save the updated data back to Google Sheets
-                    save_data(filtered_data, spreadsheet_id, 'ALL', search_query)
-                    
-                    st.success("Note saved successfully!")
-                    
-                    # Set a flag to reload data on next run
-                    st.session_state['reload_data'] = True
-                    
-                    # Rerun the app to show updated data
-                    st.rerun()
+                    try:
+                        # Only the Note cell of this student's row is sent
+                        result = save_student(data, selected_student, {'Note': new_note})
+                        show_save_result(result, "Note saved successfully!")
+                    except Exception as e:
+                        st.error(f"An error occurred while saving: {str(e)}")
               
 
             
             with col1:
                 st.subheader("Application Status")
-                selected_student = filtered_data[filtered_data['Student Name'] == search_query].iloc[0]
                 steps = ['PAYMENT & MAIL', 'APPLICATION', 'SCAN & SEND', 'ARAMEX & RDV', 'DS-160', 'ITW Prep.',  'CLIENTS ']
                 current_step = selected_student['Stage']
                 step_index = steps.index(current_step) if current_step in steps else 0
@@ -710,8 +735,7 @@ def main():
             st.info("No students found matching the search criteria.")
 
                                     
-        if not filtered_data.empty:
-            selected_student = filtered_data[filtered_data['Student Name'] == search_query].iloc[0]
+        if len(matches):
             student_name = selected_student['Student Name']
 
             edit_mode = st.toggle("Edit Mode", value=False)
@@ -829,6 +853,11 @@ def main():
                         st.write(f"**School Entry Date:** {format_date(selected_student['School Entry Date'])}")
                         st.write(f"**Entry Date in the US:** {format_date(selected_student['Entry Date in the US'])}")
                         st.write(f"**School Paid:** {selected_student['School Paid']}")
+                    with st.expander("🎓 Recommended programs"):
+                        # An expander's body runs even when collapsed; load the catalogue only on request
+                        if st.toggle("Show recommendations", value=False, key=f"show_recommend_{student_name}"):
+                            recommender = recommender_for(get_catalogue().current())
+                            render_recommendations(recommender, selected_student, key=f"recommend_{student_name}")
                     st.markdown('</div>', unsafe_allow_html=True)
 
             with tab3:
@@ -939,6 +968,14 @@ def main():
                 """
                 st.markdown(progress_bar, unsafe_allow_html=True)
 
+                # Changes saved through the CRM, one row per burst of edits to a field
+                history = default_log().timeline(student_key(selected_student),
+                                                 event_student(selected_student['First Name'], selected_student['Last Name']))
+                if not history.empty:
+                    st.markdown("**🕒 History**")
+                    history['ts'] = pd.to_datetime(history['ts'], unit='s').dt.strftime('%d/%m/%Y %H:%M')
+                    st.dataframe(history.drop(columns=['student_key', 'student']), hide_index=True, use_container_width=True)
+
                 st.markdown('</div>', unsafe_allow_html=True)
 
             with tab6:
@@ -1000,23 +1037,9 @@ def main():
                         'Application payment ?': st.session_state.get('application_payment', selected_student['Application payment ?']),
                     }
             
-                    # Update the data in the DataFrame
-                    for key, value in updated_student.items():
-                        filtered_data.loc[filtered_data['Student Name'] == student_name, key] = value
-            
-                    # Ensure the "Student Name" column is updated
-                    filtered_data['Student Name'] = filtered_data['First Name'] + " " + filtered_data['Last Name']
-            
-                    # Save the updated data back to Google Sheets
-                    if save_data(filtered_data, spreadsheet_id, 'ALL'):
-                        st.success("Changes saved successfully!")
-                        st.session_state['reload_data'] = True
-                        st.cache_data.clear()
-                        with st.spinner("Refreshing data..."):
-                            time.sleep(2)
-                        st.rerun()
-                    else:
-                        st.error("Failed to save changes. Please try again.")
+                    # Only changed cells are sent; other agents' edits to this row are kept
+                    result = save_student(data, selected_student, updated_student)
+                    show_save_result(result, "Changes saved successfully!")
                 except Exception as e:
                     st.error(f"An error occurred while saving: {str(e)}")
         
@@ -12,6 +12,7 @@ import requests
 import gspread
 from google.oauth2.service_account import Credentials
 import streamlit_nested_layout
+from crm import tracing
 
 st.set_page_config(page_title="School Application CRM 🎓", layout="wide")
 
@@ -94,6 +95,7 @@ def generate_email_body(students, school):
 from PIL import UnidentifiedImageError
 from PyPDF2.errors import PdfReadError, EmptyFileError
 
+@tracing.traced("pdf.generate_student_pdf")
 def generate_student_pdf(student, documents):
     pdf = FPDF(format='A4')
     pdf.add_page()
@@ -424,6 +426,7 @@ def review_and_submit():
         st.info("No students added yet. Please add students in the New Application tab. ℹ️")
 
 def main():
+    tracing.start_rerun("Statistics")
     st.title("Student Application CRM 🎓")
     
     login()
@@ -2,10 +2,13 @@ import streamlit as st
 import gspread
 from google.oauth2.service_account import Credentials
 import pandas as pd
-import numpy as np
-import time
 import logging
 from datetime import datetime
+from crm import tracing
+from crm.edit_session import ROW_DELETED, EditSession
+from crm.event_log import default_log
+from crm.query_table import IndexedTable, PendingAdds, page_count
+from crm.session_state import session_state
 
 
 # Set up logging
@@ -14,6 +17,7 @@ logger = logging.getLogger(__name__)
 
 # Page configuration
 st.set_page_config(page_title="Student List", layout="wide")
+tracing.start_rerun("Student List")
 
 # Use Streamlit secrets for service account info
 SERVICE_ACCOUNT_INFO = st.secrets["gcp_service_account"]
@@ -32,49 +36,65 @@ client = get_gsheet_client()
 spreadsheet_url = "https://docs.google.com/spreadsheets/d/1NkW2a4_eOlDGeVxY9PZk-lEI36PvAv9XoO4ZIwl-Sew/edit#gid=1019724402"
 
 # Function to load data from Google Sheets
+@tracing.traced("sheets.load_data")
 def load_data():
     spreadsheet = client.open_by_url(spreadsheet_url)
     sheet = spreadsheet.sheet1  # Adjust if you need to access a different sheet
-    data = sheet.get_all_records()
-    df = pd.DataFrame(data)
-    df['DATE'] = pd.to_datetime(df['DATE'], format='%d/%m/%Y %H:%M:%S', errors='coerce')  # Convert DATE to datetime with dayfirst=True
-    df['Months'] = df['DATE'].dt.strftime('%B %Y')  # Create a new column 'Months' for filtering
-    return df
-
-# Function to save data to Google Sheets
-def save_data(df, spreadsheet_url):
-    logger.info("Attempting to save changes")
-    try:
-        spreadsheet = client.open_by_url(spreadsheet_url)
-        sheet = spreadsheet.sheet1
-
-        # Convert DATE column back to string
-        df['DATE'] = pd.to_datetime(df['DATE'], errors='coerce')  # Ensure DATE is datetime
-        df['DATE'] = df['DATE'].dt.strftime('%d/%m/%Y %H:%M:%S')
-
-        # Replace problematic values with a placeholder
-        df.replace([np.inf, -np.inf, np.nan], 'NaN', inplace=True)
-
-        # Clear the existing sheet
-        sheet.clear()
-
-        # Update the sheet with new data
-        sheet.update([df.columns.values.tolist()] + df.values.tolist())
-
-        logger.info("Changes saved successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving changes: {str(e)}")
-        return False
+    # The edit session keeps every row as loaded so saves only send changed cells
+    return EditSession.load(sheet, event_log=default_log(), source="Student List",
+                            actor=st.session_state.get("username"))
 
-# Load data and initialize session state
-if 'data' not in st.session_state or st.session_state.get('reload_data', False):
-    st.session_state.data = load_data()
-    st.session_state.original_data = st.session_state.data.copy()  # Keep a copy of the original data
+def build_table(session):
+    df = session.frame()
+    df['DATE'] = pd.to_datetime(df['DATE'], format=DATE_FORMAT, errors='coerce')
+    df['Months'] = df['DATE'].dt.strftime('%B %Y')  # Create a new column 'Months' for filtering
+    # Table positions follow sheet order, so position -> sheet row is a lookup
+    return IndexedTable(df, FILTER_COLUMNS), session.row_numbers()
+
+def reset_pending():
+    st.session_state.pending_edits = {}    # row id -> {column: value}
+    st.session_state.pending_deletes = set()
+    st.session_state.pending_adds = PendingAdds()
+    st.session_state.save_conflicts = []
+    st.session_state.moved_rows = []
+    # Drop the editors' own deltas so they are not merged in again
+    for key in [key for key in st.session_state if str(key).startswith("student_data_")]:
+        del st.session_state[key]
+
+@tracing.traced("sheets.save_data")
+def save_changes(session, sheet_rows):
+    edits = {sheet_rows[row_id]: changes for row_id, changes in st.session_state.pending_edits.items()}
+    deletes = [sheet_rows[row_id] for row_id in st.session_state.pending_deletes]
+    adds = st.session_state.pending_adds.rows()
+    logger.info("Saving %d edited, %d deleted and %d new rows", len(edits), len(deletes), len(adds))
+    return session.save(edits, additions=adds, deletions=deletes)
+
+# Columns the filters run against; they get a value -> rows index
+FILTER_COLUMNS = ['Agent', 'Months', 'Stage', 'Chosen School', 'Attempts']
+DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+def rebuild_table():
+    return build_table(state.get('student_list.session'))
+
+# Load data and initialize session state. The edit session is the base of unsaved
+# edits so it is pinned; the table is rebuilt from it if the session runs out of budget
+state = session_state()
+if 'student_list.session' not in state or st.session_state.get('reload_data', False):
+    state.put('student_list.session', load_data(), pinned=True)
+    state.put('student_list.table', rebuild_table(), loader=rebuild_table)
+    reset_pending()
     st.session_state.reload_data = False
 
+table, sheet_rows = state.get('student_list.table')
+
 # Display the editable dataframe
-st.title("Student List")
+title_col, reload_col = st.columns([5, 1])
+with title_col:
+    st.title("Student List")
+with reload_col:
+    if st.button("Reload from sheet", help="Discard unsaved changes and load the latest rows"):
+        st.session_state.reload_data = True
+        st.rerun()
 
 # Filters
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -85,8 +105,7 @@ with col1:
 
 with col2:
     # Sort months chronologically
-    all_months = sorted(st.session_state.data['Months'].unique(), 
-                        key=lambda x: datetime.strptime(x, '%B %Y'))
+    all_months = sorted(table.options('Months'), key=lambda x: datetime.strptime(x, '%B %Y'))
     months_years = ["All"] + list(all_months)
     selected_months = st.multiselect('Filter by Month', options=months_years, default=["All"])
 
@@ -104,49 +123,123 @@ with col5:
     attempts_options = ["All", "1 st Try", "2 nd Try", "3 rd Try"]
     selected_attempts = st.multiselect('Filter by Attempts', options=attempts_options)
 
-filtered_data = st.session_state.data.copy()
-
-if selected_agents and "All" not in selected_agents:
-    filtered_data = filtered_data[filtered_data['Agent'].isin(selected_agents)]
-if selected_months and "All" not in selected_months:
-    filtered_data = filtered_data[filtered_data['Months'].isin(selected_months)]
-if selected_stages and "All" not in selected_stages:
-    filtered_data = filtered_data[filtered_data['Stage'].isin(selected_stages)]
-if selected_schools and "All" not in selected_schools:
-    filtered_data = filtered_data[filtered_data['Chosen School'].isin(selected_schools)]
-if selected_attempts and "All" not in selected_attempts:
-    filtered_data = filtered_data[filtered_data['Attempts'].isin(selected_attempts)]
-
-# Sort filtered data for display using DATE as day-first
-filtered_data['DATE'] = pd.to_datetime(filtered_data['DATE'], dayfirst=True, errors='coerce')
-filtered_data.sort_values(by='DATE', inplace=True)
-
-# Ensure all columns are treated as strings for editing
-filtered_data = filtered_data.astype(str)
-
-# Use a key for the data_editor to ensure proper updates
-edited_df = st.data_editor(filtered_data, num_rows="dynamic", key="student_data")
+# Filter on the indexes and sort by DATE using the precomputed order
+with tracing.span("student_list.query", rows=len(table)):
+    positions = table.filter({
+        'Agent': selected_agents,
+        'Months': selected_months,
+        'Stage': selected_stages,
+        'Chosen School': selected_schools,
+        'Attempts': selected_attempts,
+    })
+    positions = table.sort(positions, 'DATE')
+
+# Pagination
+page_col1, page_col2, page_col3 = st.columns([1, 1, 4])
+with page_col1:
+    page_size = st.selectbox("Rows per page", [50, 100, 250, 500], index=1, key="student_list_page_size")
+total_pages = page_count(len(positions), page_size)
+with page_col2:
+    page = st.number_input("Page", min_value=1, max_value=total_pages, value=1, step=1, key="student_list_page")
+with page_col3:
+    first_row = (page - 1) * page_size
+    st.markdown(f"Showing rows {min(first_row + 1, len(positions))}–{min(first_row + page_size, len(positions))} "
+                f"of {len(positions)} (page {page} of {total_pages})")
+
+# Only the visible page is materialized and sent to the browser
+page_rows = table.page(positions, page, page_size)
+page_ids = page_rows.index.to_numpy()
+page_view = page_rows.drop(columns=['Months']).astype(object)
+page_view['DATE'] = page_rows['DATE'].dt.strftime(DATE_FORMAT)
+for row_id, changes in st.session_state.pending_edits.items():
+    # Show edits made earlier on this page (or with other filters)
+    if row_id in page_view.index:
+        for column, value in changes.items():
+            page_view.at[row_id, column] = value
+page_view = page_view.drop(index=[row_id for row_id in page_view.index if row_id in st.session_state.pending_deletes])
+page_ids = page_view.index.to_numpy()
+page_view = page_view.fillna('').astype(str)
+
+# Use a key per page and filter set so the editor's deltas map onto this page's rows
+filters_signature = hash((tuple(selected_agents), tuple(selected_months), tuple(selected_stages),
+                          tuple(selected_schools), tuple(selected_attempts)))
+editor_key = f"student_data_{filters_signature}_{page}_{page_size}"
+st.data_editor(page_view, num_rows="dynamic", key=editor_key)
+# The editor restarts, added rows and all, when its data changes
+data_signature = int(pd.util.hash_pandas_object(page_view).sum())
+
+# Track edits as row-level deltas keyed by row id
+editor_state = st.session_state.get(editor_key, {})
+for row_position, changes in editor_state.get("edited_rows", {}).items():
+    row_id = int(page_ids[int(row_position)])
+    st.session_state.pending_edits.setdefault(row_id, {}).update(changes)
+for row_position in editor_state.get("deleted_rows", []):
+    st.session_state.pending_deletes.add(int(page_ids[int(row_position)]))
+# The editor's added rows replace its instance's pending adds, so rows removed
+# again in the editor are not written. A new instance (its data or key changed)
+# starts empty; the rows of the one before are kept until saved or discarded
+st.session_state.pending_adds.sync((editor_key, data_signature), editor_state.get("added_rows", []))
+
+pending_adds = st.session_state.pending_adds
+if pending_adds.kept:
+    st.caption(f"{len(pending_adds.kept)} new rows added earlier are no longer shown in the editor "
+               "and will be saved with the other changes.")
+    st.dataframe(pd.DataFrame(pending_adds.kept), hide_index=True)
+    if st.button("Discard these new rows"):
+        pending_adds.discard_kept()
+        st.rerun()
+pending_count = len(st.session_state.pending_edits) + len(st.session_state.pending_deletes) + len(pending_adds)
+if pending_count:
+    st.caption(f"{len(st.session_state.pending_edits)} edited, {len(st.session_state.pending_deletes)} deleted "
+               f"and {len(pending_adds)} new rows not saved yet.")
+
+def after_save(session, result):
+    # Rebuild from the session instead of reloading the whole sheet
+    state.resize('student_list.session')
+    state.put('student_list.table', build_table(session), loader=rebuild_table)
+    # Clears the saved edits, deletes and adds along with the editors' deltas
+    reset_pending()
+    st.session_state.save_conflicts = result.conflicts
+    st.session_state.moved_rows = result.moved_rows
+    st.session_state.save_notice = (f"Saved {result.cells_written} cells, {result.rows_appended} new and "
+                                    f"{result.rows_deleted} deleted rows.")
+    st.rerun()
+
+if st.session_state.get('save_notice'):
+    st.success(st.session_state.pop('save_notice'))
+
+# Cells someone else saved since this page loaded the sheet
+if st.session_state.save_conflicts:
+    st.warning("Some cells were changed by someone else since you loaded the sheet. "
+               "Their values are now shown; keep them or overwrite them with yours.")
+    st.dataframe(pd.DataFrame([conflict.as_dict() for conflict in st.session_state.save_conflicts]),
+                 hide_index=True)
+    keep_col, overwrite_col = st.columns(2)
+    with keep_col:
+        if st.button("Keep their values"):
+            st.session_state.save_conflicts = []
+            st.rerun()
+    with overwrite_col:
+        if st.button("Use my values"):
+            session = state.get('student_list.session')
+            # The session now holds their values as the base, so the retry writes ours
+            changes = {}
+            for conflict in st.session_state.save_conflicts:
+                if conflict.column != ROW_DELETED:
+                    changes.setdefault(conflict.row, {})[conflict.column] = conflict.mine
+            deletions = [conflict.row for conflict in st.session_state.save_conflicts
+                         if conflict.column == ROW_DELETED]
+            after_save(session, session.save(changes, deletions=deletions))
+
+if st.session_state.moved_rows:
+    st.error(f"{len(st.session_state.moved_rows)} rows were moved or deleted by someone else and were not saved. "
+             "Reload from the sheet and apply those changes again.")
 
 # Update Google Sheet with edited data
 if st.button("Save Changes"):
     try:
-        # Convert DATE column back to string for saving
-        edited_df['DATE'] = pd.to_datetime(edited_df['DATE'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
-        edited_df['DATE'] = edited_df['DATE'].dt.strftime('%d/%m/%Y %H:%M:%S')
-        
-        st.session_state.original_data.update(edited_df)  # Update the original dataset with edited data
-        
-        if save_data(st.session_state.original_data, spreadsheet_url):
-            st.session_state.data = load_data()  # Reload the data to ensure consistency
-            st.success("Changes saved successfully!")
-            
-            # Use a spinner while waiting for changes to propagate
-            with st.spinner("Refreshing data..."):
-                time.sleep(2)  # Wait for 2 seconds to allow changes to propagate
-            
-            st.session_state.reload_data = True
-            st.rerun()
-        else:
-            st.error("Failed to save changes. Please try again.")
+        session = state.get('student_list.session')
+        after_save(session, save_changes(session, sheet_rows))
     except Exception as e:
+        logger.error(f"Error saving changes: {str(e)}")
         st.error(f"An error occurred while saving: {str(e)}")
@@ -1,11 +1,15 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta
 from google.oauth2.service_account import Credentials
 import gspread
+from crm import tracing
+from crm.deadlines import KINDS, DeadlineIndex
+from crm.emergency_rules import COLUMNS, SHEET_NAME, SPREADSHEET_ID, evaluate, find_duplicates, parse_dates
+from crm.projection import ColumnStore
 
 # Set page config at the very beginning
 st.set_page_config(layout="wide", page_title="Student Visa CRM Dashboard")
+tracing.start_rerun("Emergency")
 
 # Use Streamlit secrets for service account info
 SERVICE_ACCOUNT_INFO = st.secrets["gcp_service_account"]
@@ -19,77 +23,53 @@ def get_google_sheet_client():
     creds = Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO, scopes=SCOPES)
     return gspread.authorize(creds)
 
+# Shared by every session; each column is fetched and cached on its own
+@st.cache_resource
+def get_column_store(spreadsheet_id, sheet_name):
+    client = get_google_sheet_client()
+    return ColumnStore(client.open_by_key(spreadsheet_id).worksheet(sheet_name))
+
 # Function to load data from Google Sheets
+@tracing.traced("sheets.load_data")
 def load_data(spreadsheet_id, sheet_name):
-    client = get_google_sheet_client()
-    sheet = client.open_by_key(spreadsheet_id).worksheet(sheet_name)
-    data = sheet.get_all_records()
-    df = pd.DataFrame(data)
-    return df
+    # Only the columns the rules and the tabs use, as a new frame the rules can add to
+    return get_column_store(spreadsheet_id, sheet_name).frame(COLUMNS)
+
+# Shared by every session; only rows that changed since the last load are re-indexed
+@st.cache_resource
+def get_deadline_index():
+    return DeadlineIndex()
 
 # Load data
-spreadsheet_id = "1os1G3ri4xMmJdQSNsVSNx6VJttyM8JsPNbmH0DCFUiI"
-sheet_name = "ALL"
+spreadsheet_id = SPREADSHEET_ID
+sheet_name = SHEET_NAME
+if st.sidebar.button("🔄 Refresh data"):
+    get_column_store(spreadsheet_id, sheet_name).clear()
 data = load_data(spreadsheet_id, sheet_name)
+# Synced with this session's data on every lookup
+deadlines = get_deadline_index()
 
-# Convert DATE columns to datetime with explicit format
-date_format = "%d/%m/%Y %H:%M:%S"
-data['DATE'] = pd.to_datetime(data['DATE'], format=date_format, errors='coerce')
-data['School Entry Date'] = pd.to_datetime(data['School Entry Date'], format=date_format, errors='coerce')
-data['EMBASSY ITW. DATE'] = pd.to_datetime(data['EMBASSY ITW. DATE'], format=date_format, errors='coerce')
+with tracing.span("emergency.parse_dates", rows=len(data)):
+    parse_dates(data)
 
 # Get today's date
 today = datetime.now()
 
 # Apply rules
-# Rule 1: School payment 50 days before school entry, exclude students with Visa Denied
-data['School Payment Due'] = data['School Entry Date'] - timedelta(days=50)
-rule_1 = data[(data['School Paid'] != 'Yes') & (data['School Payment Due'] > today) & (data['Visa Result'] != 'Visa Denied')].sort_values(by='DATE').reset_index(drop=True)
-
-# Rule 2: DS-160 step within 30 days before embassy interview
-ds_160_stages = ['PAYMENT & MAIL', 'APPLICATION', 'SCAN & SEND', 'ARAMEX & RDV', 'DS-160', 'ITW Prep', 'CLIENTS']
-data['DS-160 Due'] = data['EMBASSY ITW. DATE'] - timedelta(days=30)
-rule_2 = data[(data['Stage'].isin(ds_160_stages[:5])) & (data['EMBASSY ITW. DATE'] > today) & (data['EMBASSY ITW. DATE'] <= today + timedelta(days=30))].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
-
-# Rule 3: Embassy interview in less than 14 days and stage is not CLIENT or SEVIS payment is NO
-rule_3a = data[(data['EMBASSY ITW. DATE'] > today) & (data['EMBASSY ITW. DATE'] <= today + timedelta(days=14)) & (data['Stage'] != 'CLIENT') & (data['Stage'] != 'CLIENTS')].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
-rule_3b = data[(data['EMBASSY ITW. DATE'] > today) & (data['EMBASSY ITW. DATE'] <= today + timedelta(days=14)) & (data['Sevis payment ?'] == 'NO')].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
-
-# Rule 4: One week after DATE and School Entry Date is still empty, exclude clients with stage 'CLIENTS'
-rule_4 = data[(data['DATE'] <= today - timedelta(days=14)) & (data['School Entry Date'].isna()) & (data['Stage'] != 'CLIENTS')].sort_values(by='DATE').reset_index(drop=True)
-
-# Rule 5: Two weeks after DATE and EMBASSY ITW. DATE is still empty, exclude clients with stage 'CLIENTS'
-rule_5 = data[(data['DATE'] <= today - timedelta(days=14)) & (data['EMBASSY ITW. DATE'].isna()) & (data['Stage'] != 'CLIENTS')].sort_values(by='DATE').reset_index(drop=True)
-
-# New Rule: EMBASSY ITW. DATE is passed today and Visa Result is empty
-rule_6 = data[(data['EMBASSY ITW. DATE'] < today) & (data['Visa Result'].isna())].sort_values(by='EMBASSY ITW. DATE').reset_index(drop=True)
-
-# Rule 7: Unassigned students
-rule_7 = data[
-    (
-        (data['Agent'].isna()) | 
-        (data['Agent'].str.strip() == '') | 
-        (data['Agent'].str.lower() == 'nan')
-    ) & 
-    (data['Stage'].str.strip().str.upper() != 'CLIENT') & 
-    (data['Stage'].str.strip().str.upper() != 'CLIENTS')
-].sort_values(by='DATE').reset_index(drop=True)
+with tracing.span("emergency.rules", rows=len(data)):
+    results = evaluate(data, today, deadlines)
+rule_1 = results['school_payment']
+rule_2 = results['ds160']
+rule_3a = results['interview_prep']
+rule_3b = results['sevis']
+rule_4 = results['i20']
+rule_5 = results['aramex']
+rule_6 = results['visa_result']
+rule_7 = results['unassigned']
 
 # Add this diagnostic print
 st.sidebar.write(f"Number of rows in rule_7: {len(rule_7)}")
 
-def find_duplicates(df):
-    # Combine First Name and Last Name
-    df['Full Name'] = df['First Name'] + ' ' + df['Last Name']
-    
-    # Find duplicates based on Full Name, Phone N°, or E-mail
-    duplicates = df[df.duplicated(subset=['Full Name', 'Phone N°', 'E-mail'], keep=False)]
-    
-    # Sort the duplicates for better readability
-    duplicates = duplicates.sort_values(by=['Full Name', 'Phone N°', 'E-mail'])
-    
-    return duplicates
-
 duplicate_students = find_duplicates(data)
 
 # Apply custom CSS for improved layout and theming
@@ -278,6 +258,21 @@ with tabs[8]:  # This is the new tab for duplicate students
     else:
         st.write("No duplicate students found.")
 
+# Calendar feed of the indexed deadlines
+with st.expander("📆 Deadline calendar"):
+    feed_days = st.slider("Days ahead", min_value=7, max_value=180, value=60, step=7)
+    feed_kinds = st.multiselect("Deadlines", KINDS, default=list(KINDS))
+    feed_end = today + timedelta(days=feed_days)
+    upcoming = deadlines.between(today, feed_end, kinds=feed_kinds, frame=data)
+    st.write(f"{len(upcoming)} deadlines in the next {feed_days} days.")
+    feed_col1, feed_col2 = st.columns(2)
+    with feed_col1:
+        st.download_button("Download iCal (.ics)", deadlines.to_ical(data, today, feed_end, kinds=feed_kinds),
+                           file_name="deadlines.ics", mime="text/calendar")
+    with feed_col2:
+        st.download_button("Download JSON", deadlines.to_json(data, today, feed_end, kinds=feed_kinds),
+                           file_name="deadlines.json", mime="application/json")
+
 # Add a footer
 st.markdown("---")
 st.markdown("© 2024 Student Visa CRM Dashboard. All rights reserved.")